@@ -0,0 +1,10 @@
+@ECHO OFF
+
+REM Can be either py or python, depends on the system
+SET PY_PATH=py
+SET CWD=%~dp0
+
+ECHO Running storage benchmarks...
+CALL %CWD%/venv/Scripts/python.exe -m benchmarks.storage --out bench_storage.json
+
+PAUSE
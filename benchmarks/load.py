@@ -0,0 +1,396 @@
+"""End-to-end websocket load generator. Starts the mock LLM and a Memento server
+pointed at it in a temporary directory, then drives concurrent Memento clients
+with a weighted mix of operations. Run from the repository root:
+
+    python -m benchmarks.load --clients 16 --duration 60 --mix query=50,store=30,process=10,count=8,evict=2
+
+With --attach an already running server is used instead; point its
+openllm.base_url at the printed mock URL (or use --no-mock)."""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from client_libs.python.memento import Memento, Memory, OpenLlmMsg
+from benchmarks.mock_llm import MockLlm, parse_latencies
+from src.config import Config
+from src.latency import LatencyTracker
+
+
+OP_TYPES = ("query", "store", "process", "evict", "count")
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_WORDS = ("cake", "stream", "game", "music", "cat", "rain", "birthday", "chess", "movie", "trip", "song",
+          "pizza", "book", "coffee", "dragon", "castle", "ocean", "train", "garden", "robot")
+
+
+def parse_mix(spec: str)-> dict[str, float]:
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        if name not in OP_TYPES:
+            raise ValueError(f"unknown op {name!r}, expected one of {OP_TYPES}")
+        mix[name] = float(weight or 1.0)
+    return mix
+
+
+def _free_port()-> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class _OpStats:
+    latencies: list[float]
+    errors: int
+    error_samples: list[str]
+
+    def __init__(self)-> None:
+        self.latencies = []
+        self.errors = 0
+        self.error_samples = []
+        return
+
+
+    def to_dict(self, duration: float)-> dict:
+        tracker = LatencyTracker(window=max(1, len(self.latencies)))
+        for s in self.latencies:
+            tracker.add(s)
+
+        def _ms(p: float)-> float | None:
+            val = tracker.percentile(p)
+            return round(val * 1_000, 2) if val is not None else None
+
+        return {
+            "ok": len(self.latencies),
+            "errors": self.errors,
+            "throughput_ops_s": round(len(self.latencies) / duration, 2) if duration > 0.0 else 0.0,
+            "mean_ms": round(sum(self.latencies) * 1_000 / len(self.latencies), 2) if self.latencies else None,
+            "p50_ms": _ms(0.5),
+            "p95_ms": _ms(0.95),
+            "p99_ms": _ms(0.99),
+            "error_samples": self.error_samples,
+        }
+
+
+class LoadRun:
+    """One load test: clients, per-op latencies and a sampled timeline of server state."""
+    args: argparse.Namespace
+    stats: dict[str, _OpStats]
+    timeline: list[dict]
+
+    def __init__(self, args: argparse.Namespace)-> None:
+        self.args = args
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.mix = parse_mix(args.mix)
+        self.stats = {op: _OpStats() for op in self.mix}
+        self.timeline = []
+        self._window_ops = 0
+        self._window_errors = 0
+        self._local_lag = LatencyTracker(window=10_000)
+        return
+
+
+    # --- server ---
+
+    def _write_server_dir(self, work_dir: str, llm_url: str, port: int)-> None:
+        conf = Config()
+        conf.wss.port = port
+        conf.openllm.base_url = llm_url
+        conf.openllm.model = "mock"
+        conf.short_vdb.device = self.args.device
+        conf.long_vdb.device = self.args.device
+        conf.short_vdb.max_size_before_evict = self.args.stm_max
+        conf.metrics.port = _free_port()
+        with open(os.path.join(work_dir, "config.json"), "w", encoding="utf-8") as f:
+            f.write(conf.model_dump_json(indent=4))
+        with open(os.path.join(work_dir, ".env"), "w", encoding="utf-8") as f:
+            f.write("OPENAI_API_KEY=mock\n")
+        shutil.copytree(os.path.join(REPO_DIR, "prompts"), os.path.join(work_dir, "prompts"))
+
+
+    def _spawn_server(self, work_dir: str)-> subprocess.Popen:
+        log = open(os.path.join(work_dir, "server.log"), "w", encoding="utf-8")
+        return subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "main.py")], cwd=work_dir, stdout=log, stderr=subprocess.STDOUT)
+
+
+    async def _wait_for_port(self, host: str, port: int, proc: subprocess.Popen | None, timeout: float)-> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if proc is not None and proc.poll() is not None:
+                raise RuntimeError(f"server exited early with code {proc.returncode}, see server.log")
+            try:
+                _, writer = await asyncio.open_connection(host, port)
+                writer.close()
+                return
+            except OSError:
+                await asyncio.sleep(0.25)
+        raise TimeoutError(f"server did not open {host}:{port} within {timeout:.0f}s")
+
+
+    # --- clients ---
+
+    async def _connect(self, host: str, port: int)-> Memento:
+        client = Memento(host=host, port=port, encoding=self.args.encoding)
+        while client._conn is None:
+            await asyncio.sleep(0.01)
+        return client
+
+
+    def _memory(self, rng: random.Random, user: str | None)-> Memory:
+        return Memory.from_dict({
+            "id": str(uuid.uuid4()),
+            "content": " ".join(rng.choice(_WORDS) for _ in range(rng.randint(6, 16))),
+            "user": user,
+            "time": int(time.time() * 1_000),
+            "score": rng.randint(0, 10) / 10,
+            "lifetime": rng.randint(1, 30),
+        })
+
+
+    async def _run_op(self, op: str, client: Memento, rng: random.Random)-> None:
+        coll = f"load{rng.randrange(self.args.collections)}"
+        user = f"user{rng.randrange(self.args.users)}"
+        timeout = self.args.timeout
+
+        match op:
+            case "query":
+                await client.query(" ".join(rng.choice(_WORDS) for _ in range(4)), collection_name=coll, user=user, n=[3, 3, 3], timeout=timeout)
+                return
+            case "count":
+                await client.count(collection_name=coll, timeout=timeout)
+                return
+            case "store":
+                batch = client.batch().store([self._memory(rng, rng.choice([user, None])) for _ in range(rng.randint(1, 3))], collection_name=coll)
+            case "process":
+                messages = [
+                    OpenLlmMsg(role="user", name=f"user{rng.randrange(self.args.users)}", content=" ".join(rng.choice(_WORDS) for _ in range(8)))
+                    for _ in range(rng.randint(2, 6))
+                ]
+                batch = client.batch().process(messages, collection_name=coll)
+            case "evict":
+                batch = client.batch().evict(collection_name=coll)
+
+        # fire-and-forget messages go out as single-op batches so each one is acknowledged
+        res = await batch.send(timeout=timeout)
+        if res is None or not res[0].ok:
+            raise RuntimeError(res[0].error if res else "no response")
+
+
+    async def _client_loop(self, idx: int, client: Memento, deadline: float)-> None:
+        rng = random.Random(self.args.seed * 1_000 + idx)
+        ops, weights = list(self.mix), list(self.mix.values())
+        while time.monotonic() < deadline:
+            op = rng.choices(ops, weights)[0]
+            start = time.perf_counter()
+            try:
+                await self._run_op(op, client, rng)
+                self.stats[op].latencies.append(time.perf_counter() - start)
+                self._window_ops += 1
+            except Exception as e:
+                stats = self.stats[op]
+                stats.errors += 1
+                self._window_errors += 1
+                if len(stats.error_samples) < 5:
+                    stats.error_samples.append(f"{type(e).__name__}: {str(e)[:200]}")
+            if self.args.think > 0.0:
+                await asyncio.sleep(rng.expovariate(1.0 / self.args.think))
+
+
+    # --- sampling ---
+
+    async def _local_lag_monitor(self)-> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(0.05)
+            self._local_lag.add(max(0.0, loop.time() - start - 0.05))
+
+
+    async def _sampler(self, client: Memento, start: float)-> None:
+        prev_lag: dict = {}
+        while True:
+            await asyncio.sleep(self.args.interval)
+            ops, errors = self._window_ops, self._window_errors
+            self._window_ops = self._window_errors = 0
+
+            sample = {
+                "t": round(time.monotonic() - start, 2),
+                "ops_per_s": round(ops / self.args.interval, 2),
+                "errors": errors,
+                "generator_loop_lag_p99_ms": round((self._local_lag.percentile(0.99) or 0.0) * 1_000, 2),
+            }
+            self._local_lag.samples.clear()
+            try:
+                stats = await client.stats(timeout=self.args.interval * 5)
+                lag = stats["metrics"].get("memento_event_loop_lag_seconds", {}).get("", {})
+                d_count = lag.get("count", 0) - prev_lag.get("count", 0)
+                d_sum = lag.get("sum_ms", 0.0) - prev_lag.get("sum_ms", 0.0)
+                prev_lag = lag
+                sample.update(
+                    compress_backlog=stats["jobs"]["pending"].get("compress", 0),
+                    pending_jobs=sum(stats["jobs"]["pending"].values()),
+                    llm_queue=stats["llm_governor"]["queue_depth"],
+                    server_loop_lag_avg_ms=round(d_sum / d_count, 2) if d_count else None,
+                )
+            except Exception as e:
+                sample["stats_error"] = str(e)[:200]
+            self.timeline.append(sample)
+            self.logger.info("t=%.0fs ops/s=%.1f errors=%d backlog=%s server_lag=%sms", sample["t"], sample["ops_per_s"], errors,
+                             sample.get("compress_backlog"), sample.get("server_loop_lag_avg_ms"))
+
+
+    # --- run ---
+
+    async def run(self)-> dict:
+        args = self.args
+        mock = None
+        llm_url = args.llm_url
+        if not args.no_mock:
+            mock = MockLlm(parse_latencies(args.llm_latency), args.llm_error_rate, args.llm_rate_limit_rate, seed=args.seed)
+            llm_url = f"http://127.0.0.1:{await mock.start(port=args.mock_port)}/v1"
+            self.logger.info("mock LLM at %s", llm_url)
+
+        work_dir = None
+        proc = None
+        host, port = args.host, args.port
+        if not args.attach:
+            work_dir = tempfile.mkdtemp(prefix="memento-load-")
+            port = port or _free_port()
+            self._write_server_dir(work_dir, llm_url, port)
+            proc = self._spawn_server(work_dir)
+            self.logger.info("started server pid=%d in %s", proc.pid, work_dir)
+
+        clients: list[Memento] = []
+        try:
+            await self._wait_for_port(host, port, proc, args.startup_timeout)
+            clients = [await self._connect(host, port) for _ in range(args.clients + 1)]
+            monitor = clients[-1]
+
+            start = time.monotonic()
+            deadline = start + args.duration
+            background = [asyncio.create_task(self._local_lag_monitor()), asyncio.create_task(self._sampler(monitor, start))]
+            await asyncio.gather(*(self._client_loop(i, c, deadline) for i, c in enumerate(clients[:-1])))
+            duration = time.monotonic() - start
+            for t in background:
+                t.cancel()
+
+            final_stats = await monitor.stats(timeout=30.0)
+        finally:
+            if proc is not None:
+                await self._stop_server(clients, proc)
+            for c in clients:
+                c._ws_task.cancel()
+            if mock is not None:
+                await mock.stop()
+            if work_dir is not None and not args.keep_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        total_ok = sum(len(s.latencies) for s in self.stats.values())
+        return {
+            "meta": {
+                "clients": args.clients,
+                "duration_s": round(duration, 2),
+                "mix": self.mix,
+                "encoding": args.encoding,
+                "llm_latency": args.llm_latency,
+                "llm_error_rate": args.llm_error_rate,
+                "llm_rate_limit_rate": args.llm_rate_limit_rate,
+                "stm_max": args.stm_max,
+                "seed": args.seed,
+            },
+            "summary": {
+                "ok": total_ok,
+                "errors": sum(s.errors for s in self.stats.values()),
+                "throughput_ops_s": round(total_ok / duration, 2) if duration > 0.0 else 0.0,
+            },
+            "per_type": {op: s.to_dict(duration) for op, s in self.stats.items()},
+            "timeline": self.timeline,
+            "server_stats": final_stats,
+            "mock_llm": mock.stats if mock is not None else None,
+        }
+
+
+    async def _stop_server(self, clients: list[Memento], proc: subprocess.Popen)-> None:
+        # "close" stops the server cleanly, unfinished jobs stay journaled in the temp dir
+        if clients and proc.poll() is None:
+            try:
+                await clients[0].close()
+            except Exception:
+                pass
+        try:
+            await asyncio.wait_for(asyncio.to_thread(proc.wait), timeout=15.0)
+        except asyncio.TimeoutError:
+            proc.terminate()
+            await asyncio.to_thread(proc.wait)
+
+
+def _print_report(report: dict)-> None:
+    print(f"\n{'op':<10} {'ok':>8} {'errors':>7} {'ops/s':>9} {'mean_ms':>9} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9}")
+    for op, r in report["per_type"].items():
+        print(f"{op:<10} {r['ok']:>8} {r['errors']:>7} {r['throughput_ops_s']:>9} {r['mean_ms']!s:>9} {r['p50_ms']!s:>9} {r['p95_ms']!s:>9} {r['p99_ms']!s:>9}")
+    s = report["summary"]
+    print(f"\ntotal: {s['ok']} ok, {s['errors']} errors, {s['throughput_ops_s']} ops/s over {report['meta']['duration_s']}s")
+    for op, r in report["per_type"].items():
+        for sample in r["error_samples"]:
+            print(f"  {op} error: {sample}")
+
+
+def parse_load_args(args: list[str])-> argparse.Namespace:
+    arg_parser = argparse.ArgumentParser(prog="python -m benchmarks.load", description="End-to-end websocket load generator.")
+    arg_parser.add_argument("--clients", type=int, default=8, help="concurrent Memento clients")
+    arg_parser.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    arg_parser.add_argument("--mix", default="query=50,store=30,process=10,count=8,evict=2", help="weighted op mix")
+    arg_parser.add_argument("--think", type=float, default=0.0, help="mean pause between a client's ops, seconds (exponential)")
+    arg_parser.add_argument("--collections", type=int, default=4, help="ai_name collections spread over")
+    arg_parser.add_argument("--users", type=int, default=20, help="distinct users per collection")
+    arg_parser.add_argument("--encoding", choices=("json", "msgpack"), default="json")
+    arg_parser.add_argument("--timeout", type=float, default=60.0, help="per op timeout, seconds")
+    arg_parser.add_argument("--interval", type=float, default=1.0, help="timeline sampling interval, seconds")
+    arg_parser.add_argument("--seed", type=int, default=0)
+
+    arg_parser.add_argument("--llm-latency", default="process=lognormal:800:0.4,compress=lognormal:1500:0.4,merge=lognormal:300:0.4",
+                            help='mock LLM latency, "const:MS", "uniform:LO:HI", "lognormal:MEDIAN:SIGMA", optionally per kind (process/compress/merge)')
+    arg_parser.add_argument("--llm-error-rate", type=float, default=0.0, help="fraction of mock LLM requests failing with HTTP 500")
+    arg_parser.add_argument("--llm-rate-limit-rate", type=float, default=0.0, help="fraction of mock LLM requests failing with HTTP 429")
+    arg_parser.add_argument("--mock-port", type=int, default=0, help="mock LLM port, 0 = any free port")
+    arg_parser.add_argument("--no-mock", action="store_true", help="don't start the mock, use --llm-url")
+    arg_parser.add_argument("--llm-url", default="https://api.openai.com/v1", help="LLM base url when --no-mock is set")
+
+    arg_parser.add_argument("--attach", action="store_true", help="use a server already running on --host/--port")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=0, help="server port, 0 = any free port for a spawned server")
+    arg_parser.add_argument("--device", choices=("cpu", "cuda"), default="cpu", help="embedding device of the spawned server")
+    arg_parser.add_argument("--stm-max", type=int, default=200, help="short_vdb.max_size_before_evict of the spawned server")
+    arg_parser.add_argument("--startup-timeout", type=float, default=180.0, help="seconds to wait for the spawned server")
+    arg_parser.add_argument("--keep-dir", action="store_true", help="keep the spawned server's directory (config, log, databases)")
+
+    arg_parser.add_argument("--out", default=None, help="write the JSON report here")
+    parsed = arg_parser.parse_args(args)
+    if parsed.attach and not parsed.port:
+        arg_parser.error("--attach needs --port")
+    return parsed
+
+
+def main(argv: list[str])-> int:
+    args = parse_load_args(argv)
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s][%(name)s] %(message)s", datefmt="%m/%d %H:%M:%S")
+
+    report = asyncio.run(LoadRun(args).run())
+    _print_report(report)
+    if args.out is not None:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
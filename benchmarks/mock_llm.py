@@ -0,0 +1,289 @@
+"""OpenAI-compatible chat completions stub for load tests, no network or API key needed.
+
+Answers structured-output requests for ProcessResult, _CompressOut and _MergeOut
+(picked by the response_format schema name) with valid JSON, streamed or not,
+after a latency drawn from a configurable distribution. Errors are injected at
+configurable rates. Standalone:
+
+    python -m benchmarks.mock_llm --port 8090 --latency process=lognormal:800:0.4,merge=const:150"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import re
+import sys
+import time
+import uuid
+
+
+KINDS = ("process", "compress", "merge")
+_SCHEMA_KINDS = {"ProcessResult": "process", "_CompressOut": "compress", "_MergeOut": "merge"}
+_ID_RE = re.compile(r"\(id=([^)]+)\)")
+_SPEAKER_RE = re.compile(r"^([^:\n]{1,40}): ")
+
+
+class LatencyDist:
+    """Parsed from "const:MS", "uniform:LO_MS:HI_MS" or "lognormal:MEDIAN_MS:SIGMA"."""
+    kind: str
+    params: tuple[float, ...]
+
+    def __init__(self, spec: str)-> None:
+        parts = spec.split(":")
+        self.kind = parts[0]
+        self.params = tuple(float(x) for x in parts[1:])
+        expected = {"const": 1, "uniform": 2, "lognormal": 2}.get(self.kind)
+        if expected is None or len(self.params) != expected:
+            raise ValueError(f"invalid latency distribution: {spec!r}")
+        return
+
+
+    def sample(self, rng: random.Random)-> float:
+        """Seconds."""
+        match self.kind:
+            case "const":
+                ms = self.params[0]
+            case "uniform":
+                ms = rng.uniform(self.params[0], self.params[1])
+            case _:
+                ms = self.params[0] * rng.lognormvariate(0.0, self.params[1])
+        return max(0.0, ms) / 1_000
+
+
+def parse_latencies(spec: str)-> dict[str, LatencyDist]:
+    """"lognormal:800:0.5" for every kind, or "process=...,merge=..." per kind (others default to const:50)."""
+    if "=" not in spec:
+        return {kind: LatencyDist(spec) for kind in KINDS}
+    out = {kind: LatencyDist("const:50") for kind in KINDS}
+    for item in spec.split(","):
+        kind, _, dist = item.partition("=")
+        if kind not in KINDS:
+            raise ValueError(f"unknown kind {kind!r}, expected one of {KINDS}")
+        out[kind] = LatencyDist(dist)
+    return out
+
+
+def _tenth(rng: random.Random)-> float:
+    # the schemas require multiples of 0.1
+    return rng.randint(0, 10) / 10
+
+
+class MockLlm:
+    latencies: dict[str, LatencyDist]
+    error_rate: float
+    rate_limit_rate: float
+    stream_chunks: int
+    stats: dict[str, dict[str, int]]
+
+    def __init__(
+        self,
+        latencies: dict[str, LatencyDist] | None = None,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        stream_chunks: int = 8,
+        seed: int | None = None,
+    )-> None:
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.latencies = latencies or parse_latencies("const:50")
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.stream_chunks = max(1, stream_chunks)
+        self.rng = random.Random(seed)
+        self.stats = {kind: {"requests": 0, "errors": 0, "rate_limited": 0} for kind in (*KINDS, "unknown")}
+        self._server: asyncio.Server | None = None
+        return
+
+
+    # --- answers ---
+
+    def _answer(self, kind: str, messages: list[dict])-> dict:
+        prompt = str(messages[-1].get("content", "")) if messages else ""
+        match kind:
+            case "process":
+                # the conversation is the trailing "name: text" lines of the prompt
+                speakers = []
+                for line in reversed(prompt.splitlines()):
+                    speaker = _SPEAKER_RE.match(line)
+                    if speaker is None:
+                        break
+                    if speaker.group(1) != "SYSTEM" and speaker.group(1) not in speakers:
+                        speakers.append(speaker.group(1))
+                remember = [
+                    {"text": f"{user} talked about topic {self.rng.randint(0, 999)}.", "user": user}
+                    for user in (speakers[:self.rng.randint(1, 3)] or ["User"])
+                ]
+                return {
+                    "summary": f"Conversation summary {uuid.uuid4().hex[:8]}: " + prompt[-200:].replace("\n", " "),
+                    "remember": remember,
+                    "emotions": {k: _tenth(self.rng) for k in ("neutral", "sadness", "joy", "love", "anger", "fear", "surprise")},
+                    "emotional_intensity": _tenth(self.rng),
+                    "importance": _tenth(self.rng),
+                }
+            case "compress":
+                ids = _ID_RE.findall(prompt) or ["none"]
+                groups = [ids[i:i + 4] for i in range(0, len(ids), 4)]
+                return {"memories": [{"text": f"Compressed memory of {len(g)} items.", "source_ids": g} for g in groups]}
+            case "merge":
+                # never merges, like the model is told to do by default
+                new = prompt.split("NEW MEMORY:\n", 1)[-1].split("\n\nEXISTING CANDIDATES:", 1)[0]
+                return {"new_text": new.strip()[:2000] or "empty", "delete_ids": []}
+        return {}
+
+
+    def _completion(self, model: str, content: str, prompt_chars: int)-> dict:
+        prompt_tokens, completion_tokens = prompt_chars // 4, len(content) // 4
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content, "refusal": None},
+                "finish_reason": "stop",
+                "logprobs": None,
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+
+    def _chunk(self, cid: str, model: str, delta: dict, finish_reason: str | None = None, usage: dict | None = None)-> bytes:
+        obj = {
+            "id": cid,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [] if usage is not None else [{"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}],
+        }
+        if usage is not None:
+            obj["usage"] = usage
+        return f"data: {json.dumps(obj)}\n\n".encode("utf-8")
+
+
+    # --- http ---
+
+    async def _write_response(self, writer: asyncio.StreamWriter, status: str, body: bytes, content_type: str = "application/json")-> None:
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n".encode("ascii") + body
+        )
+        await writer.drain()
+
+
+    async def _write_chunked(self, writer: asyncio.StreamWriter, data: bytes)-> None:
+        writer.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        await writer.drain()
+
+
+    async def _completions(self, writer: asyncio.StreamWriter, body: dict)-> None:
+        fmt = body.get("response_format") or {}
+        kind = _SCHEMA_KINDS.get((fmt.get("json_schema") or {}).get("name", ""), "unknown")
+        stats = self.stats[kind]
+        stats["requests"] += 1
+
+        latency = self.latencies[kind].sample(self.rng) if kind in self.latencies else 0.0
+        roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            stats["rate_limited"] += 1
+            await asyncio.sleep(min(latency, 0.05))
+            err = {"error": {"message": "mock rate limit", "type": "rate_limit_error", "code": "rate_limit_exceeded"}}
+            await self._write_response(writer, "429 Too Many Requests", json.dumps(err).encode("utf-8"))
+            return
+        if roll < self.rate_limit_rate + self.error_rate:
+            stats["errors"] += 1
+            await asyncio.sleep(latency)
+            err = {"error": {"message": "mock server error", "type": "server_error", "code": None}}
+            await self._write_response(writer, "500 Internal Server Error", json.dumps(err).encode("utf-8"))
+            return
+
+        messages = body.get("messages", [])
+        model = body.get("model", "mock")
+        content = json.dumps(self._answer(kind, messages))
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in messages)
+
+        if not body.get("stream", False):
+            await asyncio.sleep(latency)
+            await self._write_response(writer, "200 OK", json.dumps(self._completion(model, content, prompt_chars)).encode("utf-8"))
+            return
+
+        # first token after a third of the latency, the rest spread evenly
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        cid = f"chatcmpl-{uuid.uuid4().hex}"
+        await asyncio.sleep(latency / 3)
+        step = -(-len(content) // self.stream_chunks)
+        pieces = [content[i:i + step] for i in range(0, len(content), step)]
+        for i, piece in enumerate(pieces):
+            delta = {"role": "assistant", "content": piece} if i == 0 else {"content": piece}
+            await self._write_chunked(writer, self._chunk(cid, model, delta))
+            await asyncio.sleep(latency * 2 / 3 / len(pieces))
+        await self._write_chunked(writer, self._chunk(cid, model, {}, finish_reason="stop"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            completion = self._completion(model, content, prompt_chars)
+            await self._write_chunked(writer, self._chunk(cid, model, {}, usage=completion["usage"]))
+        await self._write_chunked(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter)-> None:
+        # keep-alive: the openai client reuses its connections
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                method, path, _ = request_line.split(" ", 2)
+                headers = {k.strip().lower(): v.strip() for k, _, v in (h.partition(":") for h in header_lines if h)}
+                raw = await reader.readexactly(int(headers.get("content-length", "0")))
+
+                if method == "POST" and path.rstrip("/").endswith("/chat/completions"):
+                    await self._completions(writer, json.loads(raw or b"{}"))
+                elif method == "GET" and path.rstrip("/").endswith("/stats"):
+                    await self._write_response(writer, "200 OK", json.dumps(self.stats).encode("utf-8"))
+                else:
+                    await self._write_response(writer, "404 Not Found", b'{"error": {"message": "not found"}}')
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception:
+            self.logger.exception("mock request failed")
+        finally:
+            writer.close()
+
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0)-> int:
+        """Returns the bound port, pass port=0 for a free one."""
+        self._server = await asyncio.start_server(self._handle, host=host, port=port)
+        bound = self._server.sockets[0].getsockname()[1]
+        self.logger.info("mock LLM listening on http://%s:%d/v1", host, bound)
+        return bound
+
+
+    async def stop(self)-> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+
+async def _serve_forever(args: argparse.Namespace)-> None:
+    mock = MockLlm(parse_latencies(args.latency), args.error_rate, args.rate_limit_rate, seed=args.seed)
+    await mock.start(args.host, args.port)
+    await asyncio.Future()
+
+
+def main(argv: list[str])-> None:
+    arg_parser = argparse.ArgumentParser(prog="python -m benchmarks.mock_llm", description="OpenAI-compatible stub for load tests.")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8090)
+    arg_parser.add_argument("--latency", default="const:50", help='e.g. "lognormal:800:0.5" or "process=uniform:300:900,merge=const:100"')
+    arg_parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 500")
+    arg_parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 429")
+    arg_parser.add_argument("--seed", type=int, default=None)
+    args = arg_parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s][%(name)s] %(message)s", datefmt="%m/%d %H:%M:%S")
+    try:
+        asyncio.run(_serve_forever(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
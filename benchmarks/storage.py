@@ -0,0 +1,359 @@
+"""Storage layer microbenchmarks, driving the VectorDataBase interface and
+UserDatabase directly. Run from the repository root:
+
+    python -m benchmarks.storage --sizes 100,1000,10000 --out bench.json
+    python -m benchmarks.storage --sizes 100,1000,10000 --compare bench.json
+
+Everything runs in a temporary working directory, existing state is never touched."""
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from typing import Callable
+
+import numpy as np
+
+from src.config import LexicalConfig
+from src.latency import LatencyTracker
+from src.memory import Memory
+from src.user_database import UserDatabase
+from src.vdbs.decaying_vdb import DecayingVdb
+from src.vdbs.evicting_vdb import EvictingVdb
+from src.vdbs.lexical_index import LexicalIndex
+from src.vdbs.vector_database import VectorDataBase
+
+
+OPS = ("store_many", "store", "evicting_store", "query", "lexical_query", "hybrid_query", "count", "pop_oldest", "decay_all",
+       "index_add", "index_remove", "index_query")
+USER_OPS = ("store", "query")
+LEXICAL_OPS = ("index_add", "index_remove", "index_query")
+DEFAULT_SIZES = (100, 1_000, 10_000, 100_000)
+FILL_CHUNK = 500
+
+VdbFactory = Callable[[str], VectorDataBase]
+
+
+class HashEmbedding:
+    """Deterministic stand-in for MiniLM: hashed word unigrams in a normalized
+    384-d vector. Same text, same vector, no model download or GPU."""
+    dim: int
+
+    def __init__(self, dim: int = 384)-> None:
+        self.dim = dim
+        return
+
+
+    def __call__(self, input: list[str])-> list[np.ndarray]:
+        out = np.zeros((len(input), self.dim), dtype=np.float32)
+        for row, text in enumerate(input):
+            for word in text.lower().split():
+                h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+                out[row, h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        out /= np.where(norms == 0.0, 1.0, norms)
+        return list(out)
+
+
+class Corpus:
+    """Seeded memory and query generator, identical across runs and machines."""
+    rng: random.Random
+    vocab: list[str]
+
+    def __init__(self, seed: int = 0, vocab_size: int = 5_000)-> None:
+        self.rng = random.Random(seed)
+        syllables = ["ka", "lo", "mi", "ne", "ru", "sa", "to", "vi", "ze", "an", "el", "or", "um", "ix"]
+        self.vocab = ["".join(self.rng.choice(syllables) for _ in range(self.rng.randint(2, 4))) for _ in range(vocab_size)]
+        return
+
+
+    def text(self, min_words: int = 8, max_words: int = 24)-> str:
+        return " ".join(self.rng.choice(self.vocab) for _ in range(self.rng.randint(min_words, max_words)))
+
+
+    def memory(self, user: str | None = None)-> Memory:
+        return Memory(
+            id=str(uuid.UUID(int=self.rng.getrandbits(128))),
+            content=self.text(),
+            time=int(time.time() * 1000),
+            user=user,
+            score=round(self.rng.random(), 3),
+            lifetime=1_000, # outlives any decay run here
+        )
+
+
+def _summarize(backend: str, op: str, size: int, samples: list[float])-> dict:
+    tracker = LatencyTracker(window=max(1, len(samples)))
+    for s in samples:
+        tracker.add(s)
+    total = sum(samples)
+    return {
+        "backend": backend,
+        "op": op,
+        "size": size,
+        "ops": len(samples),
+        "mean_ms": round(total * 1_000 / len(samples), 4) if samples else None,
+        "p50_ms": round(tracker.percentile(0.5) * 1_000, 4) if samples else None,
+        "p90_ms": round(tracker.percentile(0.9) * 1_000, 4) if samples else None,
+        "p99_ms": round(tracker.percentile(0.99) * 1_000, 4) if samples else None,
+        "ops_per_s": round(len(samples) / total, 2) if total > 0.0 else None,
+    }
+
+
+def _timed(fn: Callable[[], object], n: int)-> list[float]:
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def chroma_backend(embedder: str, device: str)-> VdbFactory:
+    from src.vdbs.vdb_chroma import VdbChroma
+    embedding_function = HashEmbedding() if embedder == "hash" else None
+    return lambda name: VdbChroma(db_name=name, size_limit=-1, device=device, embedding_function=embedding_function, lexical=LexicalConfig())
+
+
+# name -> factory builder, raising ImportError when the backend is not installed
+BACKENDS: dict[str, Callable[[str, str], VdbFactory]] = {
+    "chroma": chroma_backend,
+}
+
+
+def bench_vdb(backend: str, make: VdbFactory, size: int, n_ops: int, corpus: Corpus, ops: tuple[str, ...])-> list[dict]:
+    # one database per size keeps decay_all from walking the other sizes' collections
+    vdb = make(f"bench{size}")
+    coll = "bench"
+    results = []
+
+    fill = []
+    for start in range(0, size, FILL_CHUNK):
+        mems = [corpus.memory() for _ in range(min(FILL_CHUNK, size - start))]
+        t = time.perf_counter()
+        vdb.store_many(coll, mems)
+        fill.append(time.perf_counter() - t)
+    if "store_many" in ops:
+        results.append(_summarize(backend, f"store_many_{FILL_CHUNK}", size, fill))
+
+    if "store" in ops:
+        results.append(_summarize(backend, "store", size, _timed(lambda: vdb.store(coll, corpus.memory()), n_ops)))
+
+    if "evicting_store" in ops:
+        # full collection, every store evicts one memory to a no-op sink
+        evicting = EvictingVdb(wrapped_vdb=vdb, dest_vdb=make(f"bench{size}dst"), max_size_before_evict=vdb.count(coll))
+        evicting.set_on_evict(lambda coll_name, mems: None)
+        results.append(_summarize(backend, "evicting_store", size, _timed(lambda: evicting.store(coll, corpus.memory()), n_ops)))
+
+    if "query" in ops:
+        results.append(_summarize(backend, "query", size, _timed(lambda: vdb.query(coll, corpus.text(4, 12), 5), n_ops)))
+
+    if "lexical_query" in ops:
+        vdb.query_lexical(coll, corpus.text(2, 4), 5) # first call builds the index from the collection
+        results.append(_summarize(backend, "lexical_query", size, _timed(lambda: vdb.query_lexical(coll, corpus.text(2, 4), 5), n_ops)))
+
+    if "hybrid_query" in ops:
+        results.append(_summarize(backend, "hybrid_query", size, _timed(lambda: vdb.query_hybrid(coll, corpus.text(4, 12), 5), n_ops)))
+
+    if "count" in ops:
+        results.append(_summarize(backend, "count", size, _timed(lambda: vdb.count(coll), n_ops)))
+
+    if "pop_oldest" in ops:
+        results.append(_summarize(backend, "pop_oldest", size, _timed(lambda: vdb.pop_oldest(coll, 1), n_ops)))
+
+    if "decay_all" in ops:
+        # one full pass, rewrites (and re-embeds) every memory
+        decaying = DecayingVdb(wrapped_vdb=vdb)
+        decaying._save_last_run(datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(days=2))
+        results.append(_summarize(backend, "decay_all", size, _timed(decaying.decay_all, 1)))
+    return results
+
+
+def bench_users(size: int, n_ops: int, corpus: Corpus, ops: tuple[str, ...])-> list[dict]:
+    users = UserDatabase(size_limit_per_user=-1)
+    user = f"user{size}"
+    for start in range(0, size, FILL_CHUNK):
+        users.store_many("bench", user, [corpus.memory(user) for _ in range(min(FILL_CHUNK, size - start))])
+
+    results = []
+    if "store" in ops:
+        results.append(_summarize("users_json", "store", size, _timed(lambda: users.store("bench", user, corpus.memory(user)), n_ops)))
+    if "query" in ops:
+        results.append(_summarize("users_json", "query", size, _timed(lambda: users.query("bench", user, 5), n_ops)))
+    return results
+
+
+def bench_lexical(size: int, n_ops: int, corpus: Corpus, ops: tuple[str, ...])-> tuple[list[dict], dict]:
+    """The BM25 index on its own: update and search cost, and the memory it holds."""
+    mems = [corpus.memory(f"user{i % 50}") for i in range(size)]
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    index = LexicalIndex()
+    for m in mems:
+        index.add(m.id, m.content, m.user)
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    memory = {"backend": "lexical", "size": size, "bytes": held, "bytes_per_doc": round(held / max(1, size), 1), **index.stats()}
+
+    results = []
+    if "index_add" in ops:
+        results.append(_summarize("lexical", "index_add", size, _timed(lambda: (lambda m: index.add(m.id, m.content, m.user))(corpus.memory("user0")), n_ops)))
+    if "index_query" in ops:
+        results.append(_summarize("lexical", "index_query", size, _timed(lambda: index.search(corpus.text(2, 4), 5), n_ops)))
+    if "index_remove" in ops:
+        ids = iter([m.id for m in mems])
+        results.append(_summarize("lexical", "index_remove", size, _timed(lambda: index.remove(next(ids)), min(n_ops, size))))
+    return results, memory
+
+
+def _git_rev()-> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(sizes: list[int], n_ops: int, seed: int, embedder: str, device: str, backends: list[str], ops: tuple[str, ...])-> dict:
+    logger = logging.getLogger("bench")
+    report = {
+        "meta": {
+            "created": datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+            "git_rev": _git_rev(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "embedder": embedder,
+            "device": device,
+            "seed": seed,
+            "ops_per_measure": n_ops,
+            "sizes": sizes,
+        },
+        "skipped": {},
+        "results": [],
+        "memory": [],
+    }
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="memento-bench-") as tmp:
+        # all databases use paths relative to the working directory
+        os.chdir(tmp)
+        try:
+            for size in sizes:
+                for name in backends:
+                    try:
+                        make = BACKENDS[name](embedder, device)
+                    except ImportError as e:
+                        report["skipped"][name] = f"not available: {e}"
+                        continue
+                    logger.warning("running %s at size %d", name, size)
+                    report["results"].extend(bench_vdb(name, make, size, n_ops, Corpus(seed), ops))
+
+                logger.warning("running users_json at size %d", size)
+                report["results"].extend(bench_users(size, n_ops, Corpus(seed), tuple(o for o in ops if o in USER_OPS)))
+
+                if any(o in LEXICAL_OPS for o in ops):
+                    logger.warning("running lexical index at size %d", size)
+                    results, memory = bench_lexical(size, n_ops, Corpus(seed), ops)
+                    report["results"].extend(results)
+                    report["memory"].append(memory)
+        finally:
+            os.chdir(cwd)
+    return report
+
+
+def compare(current: dict, baseline: dict, threshold: float)-> list[dict]:
+    """Rows for every (backend, op, size) present in both reports, compared on p50."""
+    base = {(r["backend"], r["op"], r["size"]): r for r in baseline.get("results", [])}
+    rows = []
+    for r in current.get("results", []):
+        b = base.get((r["backend"], r["op"], r["size"]))
+        if b is None or not b.get("p50_ms") or r.get("p50_ms") is None:
+            continue
+        change = (r["p50_ms"] - b["p50_ms"]) / b["p50_ms"]
+        rows.append({
+            "backend": r["backend"],
+            "op": r["op"],
+            "size": r["size"],
+            "baseline_p50_ms": b["p50_ms"],
+            "p50_ms": r["p50_ms"],
+            "change": round(change, 4),
+            "regression": change > threshold,
+        })
+    return rows
+
+
+def _print_results(report: dict)-> None:
+    print(f"{'backend':<12} {'op':<16} {'size':>8} {'ops':>6} {'mean_ms':>10} {'p50_ms':>10} {'p99_ms':>10} {'ops/s':>10}")
+    for r in report["results"]:
+        print(f"{r['backend']:<12} {r['op']:<16} {r['size']:>8} {r['ops']:>6} {r['mean_ms']!s:>10} {r['p50_ms']!s:>10} {r['p99_ms']!s:>10} {r['ops_per_s']!s:>10}")
+    for m in report.get("memory", []):
+        print(f"{m['backend']} index at {m['size']}: {m['bytes'] / 1_048_576:.2f} MiB, {m['bytes_per_doc']} B/doc, {m['terms']} terms, {m['postings']} postings")
+    for name, reason in report["skipped"].items():
+        print(f"skipped {name}: {reason}")
+
+
+def _print_comparison(rows: list[dict])-> None:
+    print(f"{'backend':<12} {'op':<16} {'size':>8} {'base p50':>10} {'p50':>10} {'change':>8}")
+    for r in rows:
+        flag = "  REGRESSION" if r["regression"] else ""
+        print(f"{r['backend']:<12} {r['op']:<16} {r['size']:>8} {r['baseline_p50_ms']:>10} {r['p50_ms']:>10} {r['change']:>+8.1%}{flag}")
+
+
+def parse_bench_args(args: list[str])-> argparse.Namespace:
+    arg_parser = argparse.ArgumentParser(prog="python -m benchmarks.storage", description="Storage layer microbenchmarks.")
+    arg_parser.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=list(DEFAULT_SIZES),
+                            help="comma separated collection sizes (default: 100,1000,10000,100000)")
+    arg_parser.add_argument("--ops", type=int, default=200, help="operations timed per measurement")
+    arg_parser.add_argument("--only", type=lambda s: tuple(s.split(",")), default=OPS, help=f"comma separated subset of {','.join(OPS)}")
+    arg_parser.add_argument("--backends", type=lambda s: s.split(","), default=list(BACKENDS), help="comma separated backend names")
+    arg_parser.add_argument("--embedder", choices=("hash", "onnx"), default="hash",
+                            help="hash: deterministic offline stand-in, onnx: the real MiniLM model")
+    arg_parser.add_argument("--device", choices=("cpu", "cuda"), default="cpu", help="device for --embedder onnx")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--out", default=None, help="write the JSON report here")
+    arg_parser.add_argument("--compare", default=None, help="baseline JSON report to compare against")
+    arg_parser.add_argument("--input", default=None, help="compare this saved report instead of running")
+    arg_parser.add_argument("--threshold", type=float, default=0.10, help="p50 increase reported as regression (default 0.10)")
+    return arg_parser.parse_args(args)
+
+
+def main(argv: list[str])-> int:
+    args = parse_bench_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="[%(asctime)s][%(name)s] %(message)s", datefmt="%m/%d %H:%M:%S")
+
+    if args.input is not None:
+        with open(args.input, "r", encoding="utf-8") as f:
+            report = json.load(f)
+    else:
+        report = run(args.sizes, args.ops, args.seed, args.embedder, args.device, args.backends, args.only)
+        _print_results(report)
+
+    if args.out is not None:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(report, baseline, args.threshold)
+        _print_comparison(rows)
+        # non-zero exit so CI can gate on it
+        return 1 if any(r["regression"] for r in rows) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -87,13 +87,17 @@ namespace ProtoMemento
 
         private readonly ConcurrentDictionary<string, TaskCompletionSource<QueryResult>> _pendingQueries = new();
         private readonly SemaphoreSlim _sendLock = new(1, 1);
+        private readonly List<string>? _fields;
 
         public event Action<string>? SummaryReceived;
 
-        public MementoClient(string host = "127.0.0.1", int port = 4286, bool secure = false)
+        // fields: memory fields returned by queries ("id", "content", "time", "user", "score", "lifetime"), null = all.
+        // The wire stays json, msgpack is only offered by the Python and JS clients.
+        public MementoClient(string host = "127.0.0.1", int port = 4286, bool secure = false, List<string>? fields = null)
         {
             _uri = new Uri($"{(secure ? "wss" : "ws")}://{host}:{port}");
             _ws.Options.KeepAliveInterval = Timeout.Zero;
+            _fields = fields;
         }
 
         public async Task ConnectAsync(CancellationToken ct = default)
@@ -101,6 +105,18 @@ namespace ProtoMemento
             if (_ws.State == WebSocketState.Open) return;
             await _ws.ConnectAsync(_uri, ct).ConfigureAwait(false);
             _recvLoop = Task.Run(ReceiveLoopAsync);
+
+            if (_fields != null)
+            {
+                var hello = new
+                {
+                    uid = Guid.NewGuid().ToString(),
+                    type = "hello",
+                    encodings = new List<string> { "json" },
+                    fields = _fields
+                };
+                await SendAsync(hello, ct).ConfigureAwait(false);
+            }
         }
 
         public async ValueTask DisposeAsync()
@@ -146,6 +162,7 @@ namespace ProtoMemento
             List<DbEnum>? from = null,
             List<int>? n = null,
             TimeSpan? timeout = null,
+            List<string>? fields = null,
             CancellationToken ct = default)
         {
             from ??= new List<DbEnum> { DbEnum.stm, DbEnum.ltm, DbEnum.users };
@@ -163,7 +180,8 @@ namespace ProtoMemento
                 user = user ?? "",
                 query,
                 from = MapDbEnums(from),
-                n
+                n,
+                fields
             };
 			
 			try
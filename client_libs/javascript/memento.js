@@ -6,6 +6,12 @@ const fs = require("fs");
 const { ChildProcess, spawn } = require("child_process");
 const { randomUUID } = require("crypto");
 
+// optional, npm install @msgpack/msgpack for the binary wire encoding
+let msgpack = null;
+try {
+    msgpack = require("@msgpack/msgpack");
+} catch (e) {}
+
 /** @typedef {{id: string, content: string, time: number, user?: string?, score?: number?, lifetime?: number?}} MemObj */
 /** @typedef {{memory: MemObj, dictance: number}} QueriedMemObj */
 /** @typedef {{role: "user" | "assistant" | "system" | string, content: string, name?: string}} OpenLlmMessage */
@@ -102,6 +108,7 @@ class WSWrapper {
     _connect() {
         try {
             this.websocket = new WebSocket(this.url);
+            this.websocket.binaryType = "arraybuffer";
 
             this.websocket.onopen = (event) => {
                 this.retryCount = 0;
@@ -183,13 +190,25 @@ class Memento {
 
     /** @private @type {Record<string, (value: any)=>any>} */ _resolvers = {};
 
+    /** @private @type {"json" | "msgpack"} */ _encoding = "json";
+    /** @private @type {"json" | "msgpack"} */ _wantedEncoding = "json";
+    /** @private @type {string[]?} */ _fields = null;
+
     /**
-     * @param {{abs_dir?: string?, host: string, port: number}?} params
+     * encoding: "msgpack" is used once the server agreed to it, json until then.
+     * fields: memory fields returned by queries, null = all.
+     * @param {{abs_dir?: string?, host: string, port: number, encoding?: "json" | "msgpack", fields?: string[]?}?} params
      */
     constructor(params = { abs_dir: null, host: "127.0.0.1", port: 4286 }) {
         this._conn = null;
         this._url = new URL(`ws://${params.host}:${params.port.toString()}`);
         this._abs_dir = params.abs_dir;
+
+        this._wantedEncoding = params.encoding || "json";
+        this._fields = params.fields || null;
+        if (this._wantedEncoding == "msgpack" && !msgpack) {
+            throw new Error('encoding "msgpack" requires the @msgpack/msgpack package.');
+        }
     }
 
     /**
@@ -295,14 +314,39 @@ class Memento {
         }
 
         this._conn = new WSWrapper(this._url);
+        this._conn.on("message", (data) => this._handleMessage(data));
         this._conn.on("open", () => {
-            this._conn.on("message", this._handleMessage);
+            this._encoding = "json";
+            if (this._wantedEncoding != "json" || this._fields) {
+                this._send({
+                    uid: randomUUID(),
+                    type: "hello",
+                    encodings: [this._wantedEncoding, "json"],
+                    fields: this._fields,
+                });
+            }
         });
     }
 
+    /**
+     * @private
+     * @param {object} obj
+     */
+    _send(obj) {
+        if (this._encoding == "msgpack") {
+            this._conn.send(msgpack.encode(obj));
+        } else {
+            this._conn.send(JSON.stringify(obj));
+        }
+    }
+
     async _handleMessage(data) {
         try {
-            var obj = JSON.parse(data);
+            // binary frames are msgpack, text frames json
+            var obj =
+                data instanceof ArrayBuffer
+                    ? msgpack.decode(new Uint8Array(data))
+                    : JSON.parse(data);
         } catch (e) {
             return;
         }
@@ -323,6 +367,10 @@ class Memento {
         let msgId = obj["uid"];
 
         switch (msgType) {
+            case "hello": {
+                this._encoding = obj["encoding"] || "json";
+                break;
+            }
             case "query": {
                 let res = new QueryResult();
                 let dbs = obj["from"];
@@ -364,6 +412,8 @@ class Memento {
             from: ["stm", "ltm", "users"],
             n: [1, 1, 1],
             timeoutMs: 5_000,
+            /** @type {string[] | null} */
+            fields: null,
         }
     ) {
         let reqId = randomUUID();
@@ -375,17 +425,16 @@ class Memento {
 
         this._resolvers[reqId] = resolver;
 
-        this._conn.send(
-            JSON.stringify({
-                uid: reqId,
-                type: "query",
-                query: queryStr,
-                ai_name: params.collectionName,
-                user: params.user,
-                from: params.from,
-                n: params.n,
-            })
-        );
+        this._send({
+            uid: reqId,
+            type: "query",
+            query: queryStr,
+            ai_name: params.collectionName,
+            user: params.user,
+            from: params.from,
+            n: params.n,
+            fields: params.fields,
+        });
 
         let timeoutPromise = new Promise((resolve) =>
             setTimeout(resolve, params.timeoutMs)
@@ -413,15 +462,13 @@ class Memento {
             memobjs.push(mem.toRecord())
         }
 
-        this._conn.send(
-            JSON.stringify({
-                uid: randomUUID(),
-                type: "store",
-                memories: memobjs,
-                ai_name: params.collectionName,
-                to: params.to,
-            })
-        );
+        this._send({
+            uid: randomUUID(),
+            type: "store",
+            memories: memobjs,
+            ai_name: params.collectionName,
+            to: params.to,
+        });
     }
 
     /**
@@ -433,37 +480,31 @@ class Memento {
         context: [],
         collectionName: "default",
     }) {
-        this._conn.send(
-            JSON.stringify({
-                uid: randomUUID(),
-                type: "process",
-                messages: messages,
-                context: params.context,
-                ai_name: params.collectionName,
-            })
-        );
+        this._send({
+            uid: randomUUID(),
+            type: "process",
+            messages: messages,
+            context: params.context,
+            ai_name: params.collectionName,
+        });
     }
 
     close() {
-        this._conn.send(
-            JSON.stringify({
-                uid: randomUUID(),
-                type: "close",
-            })
-        );
+        this._send({
+            uid: randomUUID(),
+            type: "close",
+        });
     }
 
     /**
      * @param {string} collectionName 
      */
     evict(collectionName = "default") {
-        this._conn.send(
-            JSON.stringify({
-                uid: randomUUID(),
-                type: "evict",
-                ai_name: collectionName
-            })
-        );
+        this._send({
+            uid: randomUUID(),
+            type: "evict",
+            ai_name: collectionName
+        });
     }
 
     clear(params = {
@@ -472,15 +513,13 @@ class Memento {
         user: null,
         target: "stm",
     }) {
-        this._conn.send(
-            JSON.stringify({
-                uid: randomUUID(),
-                type: "clear",
-                ai_name: params.collectionName,
-                target: params.target,
-                user: params.user,
-            })
-        );
+        this._send({
+            uid: randomUUID(),
+            type: "clear",
+            ai_name: params.collectionName,
+            target: params.target,
+            user: params.user,
+        });
     }
 
     /**
@@ -502,14 +541,12 @@ class Memento {
 
         this._resolvers[reqId] = resolver;
 
-        this._conn.send(
-            JSON.stringify({
-                uid: reqId,
-                type: "count",
-                ai_name: params.collectionName,
-                from: params.from,
-            })
-        );
+        this._send({
+            uid: reqId,
+            type: "count",
+            ai_name: params.collectionName,
+            from: params.from,
+        });
 
         let timeoutPromise = new Promise((resolve) =>
             setTimeout(resolve, params.timeoutMs)
@@ -1,4 +1,5 @@
 # pip install websockets
+# optional: pip install msgpack (binary wire encoding)
 
 import asyncio
 import os
@@ -8,7 +9,7 @@ import json
 import time
 import uuid
 
-from typing import Callable, Literal
+from typing import AsyncIterator, Callable, Literal
 from enum import Enum
 
 import websockets.sync.client
@@ -17,6 +18,11 @@ from websockets.asyncio.client import ClientConnection, connect
 from typing import Optional
 from pydantic import BaseModel, Field
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 
 class Memory(BaseModel):
     id: str = Field(...)
@@ -125,19 +131,132 @@ class CountResult:
         self.long_term = 0
 
 
+class ExportPage:
+    memories: list[Memory]
+    embeddings: list[list[float]] | None
+    cursor: str | None # pass to export() to resume after this page
+    done: bool
+
+    def __init__(self):
+        self.memories = []
+        self.embeddings = None
+        self.cursor = None
+        self.done = False
+
+    @staticmethod
+    def from_dict(input: dict):
+        page = ExportPage()
+        page.memories = [Memory.from_dict(x) for x in input.get("memories", [])]
+        page.embeddings = input.get("embeddings", None)
+        page.cursor = input.get("cursor", None)
+        page.done = bool(input.get("done", False))
+        return page
+
+
+def _parse_query(obj: dict)-> QueryResult | list[QueryResult]:
+    dbs: list[str] = obj["from"]
+
+    if "queries" in obj:
+        # list query: one result per query, user memories are shared
+        users = [Memory.from_dict(x) for x in obj["users"]] if "users" in dbs else []
+        results = []
+        for i in range(len(obj["queries"])):
+            res = QueryResult()
+            if "stm" in dbs:
+                res.short_term = [QueriedMemory.from_dict(x) for x in obj["stm"][i]]
+            if "ltm" in dbs:
+                res.long_term = [QueriedMemory.from_dict(x) for x in obj["ltm"][i]]
+            res.users = users
+            results.append(res)
+        return results
+
+    res = QueryResult()
+    if "stm" in dbs:
+        res.short_term = [QueriedMemory.from_dict(x) for x in obj["stm"]]
+    if "ltm" in dbs:
+        res.long_term = [QueriedMemory.from_dict(x) for x in obj["ltm"]]
+    if "users" in dbs:
+        res.users = [Memory.from_dict(x) for x in obj["users"]]
+    return res
+
+
+def _parse_count(obj: dict)-> CountResult:
+    res = CountResult()
+
+    if "stm" in obj:
+        res.short_term = obj["stm"]
+    if "ltm" in obj:
+        res.long_term = obj["ltm"]
+    return res
+
+
+class BatchItemResult:
+    type: str
+    ok: bool
+    result: QueryResult | CountResult | str | None # str is the summary of a process op
+    error: str | None
+
+    def __init__(self):
+        self.type = ""
+        self.ok = False
+        self.result = None
+        self.error = None
+
+    @staticmethod
+    def from_dict(input: dict):
+        res = BatchItemResult()
+        res.type = input.get("type", "")
+        res.ok = bool(input.get("ok", False))
+        res.error = input.get("error", None)
+
+        resp: dict | None = input.get("response", None)
+        if resp is not None:
+            match resp.get("type"):
+                case "query":
+                    res.result = _parse_query(resp)
+                case "count":
+                    res.result = _parse_count(resp)
+                case "summary":
+                    res.result = resp.get("summary", "")
+        return res
+
+
+MemoryField = Literal["id", "content", "time", "user", "score", "lifetime"]
+
+
 class Memento:
     _conn: ClientConnection
     _proc: subprocess.Popen
     _uri: str
 
+    _encoding: Literal["json", "msgpack"] = "json"
+    _wanted_encoding: Literal["json", "msgpack"] = "json"
+    _fields: list[MemoryField] | None = None
+
     _summary_cb: Callable[[str], None] = None
+    _summary_partial_cb: Callable[[str], None] = None
     _pending_requests: dict[str, asyncio.Future] = {}
-
-
-    def __init__(self, abs_dir: str = "", host: str = "127.0.0.1", port: int = 4286, loop=None):
+    _pending_streams: dict[str, asyncio.Queue] = {}
+
+
+    def __init__(self,
+            abs_dir: str = "",
+            host: str = "127.0.0.1",
+            port: int = 4286,
+            loop=None,
+            encoding: Literal["json", "msgpack"] = "json",
+            fields: list[MemoryField] | None = None,
+        ):
+        """encoding: "msgpack" is used once the server agreed to it, json until then.
+        fields: memory fields returned by queries, None = all."""
         self._conn = None
         self._uri = f"ws://{host}:{str(port)}"
 
+        if encoding == "msgpack" and msgpack is None:
+            raise Exception("encoding \"msgpack\" requires the msgpack package.")
+        self._wanted_encoding = encoding
+        self._fields = fields
+
         self._proc = None
         if not self._is_port_open(host, port, timeout=2.0):
             if abs_dir == "":
@@ -185,14 +304,31 @@ class Memento:
         return False
     
     
+    async def _send(self, obj: dict)-> None:
+        if self._encoding == "msgpack":
+            await self._conn.send(message=msgpack.packb(obj, use_bin_type=True), text=False)
+        else:
+            await self._conn.send(message=json.dumps(obj), text=True)
+
+
     async def _runner(self):
         async with connect(uri=self._uri) as ws:
             self._conn = ws
+            self._encoding = "json"
+            if self._wanted_encoding != "json" or self._fields is not None:
+                await self._send({
+                    "uid": str(uuid.uuid4()),
+                    "type": "hello",
+                    "encodings": [self._wanted_encoding, "json"],
+                    "fields": self._fields,
+                })
+
             async for message in ws:
                 try:
-                    obj = json.loads(message)
+                    # binary frames are msgpack, text frames json
+                    obj = msgpack.unpackb(message, raw=False) if isinstance(message, bytes) else json.loads(message)
                 except Exception as e:
-                    raise Exception("received malformed json from Memento.", e)
+                    raise Exception("received malformed payload from Memento.", e)
                 
                 if "type" not in obj:
                     raise Exception("received malformed payload from Memento. missing field: \"type\"")
@@ -210,16 +346,11 @@ class Memento:
                 message_id = obj["uid"]
 
                 match message_type:
+                    case "hello":
+                        self._encoding = obj.get("encoding", "json")
+
                     case "query":
-                        res = QueryResult()
-                        dbs: list[str] = obj["from"]
-                        
-                        if "stm" in dbs:
-                            res.short_term = [QueriedMemory.from_dict(x) for x in obj["stm"]]
-                        if "ltm" in dbs:
-                            res.long_term = [QueriedMemory.from_dict(x) for x in obj["ltm"]]
-                        if "users" in dbs:
-                            res.users = [Memory.from_dict(x) for x in obj["users"]]
+                        res = _parse_query(obj)
 
                         if message_id in self._pending_requests:
                             future = self._pending_requests.pop(message_id, None)
@@ -229,19 +360,19 @@ class Memento:
                             raise Exception("received unhandled response to query request.")
 
                     case "summary":
+                        summary: str = obj["summary"]
+
+                        if obj.get("partial", False):
+                            if self._summary_partial_cb is not None:
+                                self._summary_partial_cb(summary)
+                            continue
+
                         if self._summary_cb is None:
                             continue
-                        
-                        summary: str = obj["summary"]
                         self._summary_cb(summary)
                     
                     case "count":
-                        res = CountResult()
-                        
-                        if "stm" in obj:
-                            res.short_term = obj["stm"]
-                        if "ltm" in obj:
-                            res.long_term = obj["ltm"]
+                        res = _parse_count(obj)
                         
                         if message_id in self._pending_requests:
                             future = self._pending_requests.pop(message_id, None)
@@ -249,38 +380,103 @@ class Memento:
                                 future.set_result(res)
                         else:
                             raise Exception("received unhandled response to count request.")
+
+                    case "batch":
+                        res = [BatchItemResult.from_dict(x) for x in obj["results"]]
+
+                        if message_id in self._pending_requests:
+                            future = self._pending_requests.pop(message_id, None)
+                            if future:
+                                future.set_result(res)
+                        else:
+                            raise Exception("received unhandled response to batch request.")
+
+                    case "export":
+                        queue = self._pending_streams.get(message_id, None)
+                        if queue is None:
+                            raise Exception("received unhandled response to export request.")
+                        queue.put_nowait(obj)
+
+                    case "import":
+                        if message_id in self._pending_requests:
+                            future = self._pending_requests.pop(message_id, None)
+                            if future:
+                                future.set_result(int(obj.get("count", 0)))
+                        else:
+                            raise Exception("received unhandled response to import request.")
+
+                    case "stats":
+                        if message_id in self._pending_requests:
+                            future = self._pending_requests.pop(message_id, None)
+                            if future:
+                                future.set_result({k: v for k, v in obj.items() if k not in ("type", "uid")})
+                        else:
+                            raise Exception("received unhandled response to stats request.")
+
+                    case "profile":
+                        if message_id in self._pending_requests:
+                            future = self._pending_requests.pop(message_id, None)
+                            if future:
+                                future.set_result({k: v for k, v in obj.items() if k not in ("type", "uid")})
+                        else:
+                            raise Exception("received unhandled response to profile request.")
+
+                    case "error":
+                        err = Exception("Memento error: " + str(obj.get("error", "")))
+                        if message_id in self._pending_streams:
+                            self._pending_streams[message_id].put_nowait(err)
+                        elif message_id in self._pending_requests:
+                            future = self._pending_requests.pop(message_id, None)
+                            if future and not future.done():
+                                future.set_exception(err)
                         
     
     
     def set_on_summary(self, cb: Callable[[str], None]):
         self._summary_cb = cb
+
+
+    # only called for process requests sent with stream=True
+    def set_on_partial_summary(self, cb: Callable[[str], None]):
+        self._summary_partial_cb = cb
     
 
     async def query(self,
-            query_str: str,
+            query_str: str | list[str],
             collection_name: str = "default",
             user: str | None = None,
             from_: list[DbEnum] = [DbEnum.SHORT_TERM, DbEnum.LONG_TERM, DbEnum.USERS],
             n: list[int] = [1, 1, 1],
             timeout: float = 5.0,
-        )-> QueryResult:
+            fields: list[MemoryField] | None = None,
+            mode: str = "vector",
+            rank: dict | None = None,
+            dedup: bool = False,
+        )-> QueryResult | list[QueryResult]:
+        """mode applies to stm/ltm: "vector" (embeddings), "lexical" (keywords and
+        "quoted phrases", no embedding) or "hybrid" (both, fused by rank).
+        rank re-orders stm/ltm results on the server, e.g. {"distance": 1.0, "score": 0.5,
+        "recency": 0.5, "half_life": 3600, "lifetime": 0.0, "candidates": 4, "mmr": 0.7}.
+        A list of queries is embedded in one batch and returns one QueryResult per query,
+        dedup keeps each memory only in the result where it ranks highest."""
 
         req_id = str(uuid.uuid4())
         future: asyncio.Future[QueryResult] = asyncio.Future()
         self._pending_requests[req_id] = future
         
-        await self._conn.send(
-            message=json.dumps({
-                "uid": req_id,
-                "type": "query",
-                "query": query_str,
-                "ai_name": collection_name,
-                "user": user,
-                "from": [x.value for x in from_],
-                "n": n,
-            }),
-            text=True,
-        )
+        await self._send({
+            "uid": req_id,
+            "type": "query",
+            "query": query_str,
+            "ai_name": collection_name,
+            "user": user,
+            "from": [x.value for x in from_],
+            "n": n,
+            "fields": fields,
+            "mode": mode,
+            "rank": rank,
+            "dedup": dedup,
+        })
 
         try:
             async with asyncio.timeout(timeout) as t:
@@ -296,57 +492,47 @@ class Memento:
             to: list[DbEnum] = [DbEnum.SHORT_TERM, DbEnum.USERS],
         )-> None:
 
-        await self._conn.send(
-            message=json.dumps({
-                "uid": str(uuid.uuid4()),
-                "type": "store",
-                "memories": [x.to_dict() for x in memories],
-                "ai_name": collection_name,
-                "to": [x.value for x in to],
-            }),
-            text=True,
-        )
+        await self._send({
+            "uid": str(uuid.uuid4()),
+            "type": "store",
+            "memories": [x.to_dict() for x in memories],
+            "ai_name": collection_name,
+            "to": [x.value for x in to],
+        })
 
 
     async def process(self,
             messages: list[OpenLlmMsg],
             context: list[OpenLlmMsg] = None,
             collection_name: str = "default",
+            stream: bool = False,
         )-> None:
 
         if context is None:
             context = []
 
-        await self._conn.send(
-            message=json.dumps({
-                "uid": str(uuid.uuid4()),
-                "type": "process",
-                "ai_name": collection_name,
-                "messages": [x.model_dump(mode="json") for x in messages],
-                "context": [x.model_dump(mode="json") for x in context],
-            }),
-            text=True,
-        )
+        await self._send({
+            "uid": str(uuid.uuid4()),
+            "type": "process",
+            "ai_name": collection_name,
+            "messages": [x.model_dump(mode="json") for x in messages],
+            "context": [x.model_dump(mode="json") for x in context],
+            "stream": stream,
+        })
 
 
     async def close(self)-> None:
-        await self._conn.send(
-            message=json.dumps({
-                "uid": str(uuid.uuid4()),
-                "type": "close",
-            }),
-            text=True,
-        )
+        await self._send({
+            "uid": str(uuid.uuid4()),
+            "type": "close",
+        })
     
     async def evict(self, collection_name: str = "default")-> None:
-        await self._conn.send(
-            message=json.dumps({
-                "uid": str(uuid.uuid4()),
-                "type": "evict",
-                "ai_name": collection_name,
-            }),
-            text=True,
-        )
+        await self._send({
+            "uid": str(uuid.uuid4()),
+            "type": "evict",
+            "ai_name": collection_name,
+        })
     
     async def clear(self,
             collection_name: str = "default",
@@ -354,16 +540,13 @@ class Memento:
             target: DbEnum = DbEnum.SHORT_TERM,
         )-> None:
 
-        await self._conn.send(
-            message=json.dumps({
-                "uid": str(uuid.uuid4()),
-                "type": "clear",
-                "ai_name": collection_name,
-                "target": target.value,
-                "user": user,
-            }),
-            text=True,
-        )
+        await self._send({
+            "uid": str(uuid.uuid4()),
+            "type": "clear",
+            "ai_name": collection_name,
+            "target": target.value,
+            "user": user,
+        })
     
     async def count(self,
             collection_name: str = "default",
@@ -375,15 +558,248 @@ class Memento:
         future: asyncio.Future[CountResult] = asyncio.Future()
         self._pending_requests[req_id] = future
         
-        await self._conn.send(
-            message=json.dumps({
+        await self._send({
+            "uid": req_id,
+            "type": "count",
+            "ai_name": collection_name,
+            "from": [x.value for x in from_],
+        })
+
+        try:
+            async with asyncio.timeout(timeout):
+                return await future
+        except asyncio.TimeoutError as e:
+            future.set_result(None)
+            raise e
+
+
+    async def export(self,
+            db: DbEnum,
+            collection_name: str = "default",
+            cursor: str | None = None,
+            page_size: int = 256,
+            embeddings: bool = False,
+            max_pages: int | None = None,
+            timeout: float = 30.0,
+        )-> AsyncIterator[ExportPage]:
+        """Yields pages until the collection is exhausted (or max_pages). Keep the
+        cursor of the last page received to resume after a reconnect."""
+        req_id = str(uuid.uuid4())
+        queue: asyncio.Queue = asyncio.Queue()
+        self._pending_streams[req_id] = queue
+
+        try:
+            await self._send({
                 "uid": req_id,
-                "type": "count",
+                "type": "export",
                 "ai_name": collection_name,
-                "from": [x.value for x in from_],
-            }),
-            text=True,
-        )
+                "from": db.value,
+                "cursor": cursor,
+                "page_size": page_size,
+                "max_pages": max_pages,
+                "embeddings": embeddings,
+            })
+
+            pages = 0
+            while True:
+                async with asyncio.timeout(timeout):
+                    item = await queue.get()
+                if isinstance(item, Exception):
+                    raise item
+
+                page = ExportPage.from_dict(item)
+                pages += 1
+                yield page
+                if page.done or (max_pages is not None and pages >= max_pages):
+                    return
+        finally:
+            self._pending_streams.pop(req_id, None)
+
+
+    async def import_page(self,
+            memories: list[Memory],
+            db: DbEnum,
+            collection_name: str = "default",
+            embeddings: list[list[float]] | None = None,
+            timeout: float = 30.0,
+        )-> int:
+        """Upserts one page (e.g. from export), stored vectors are reused when given.
+        Returns how many memories were written."""
+        req_id = str(uuid.uuid4())
+        future: asyncio.Future[int] = asyncio.Future()
+        self._pending_requests[req_id] = future
+
+        await self._send({
+            "uid": req_id,
+            "type": "import",
+            "ai_name": collection_name,
+            "to": db.value,
+            "memories": [x.to_dict() for x in memories],
+            "embeddings": embeddings,
+        })
+
+        try:
+            async with asyncio.timeout(timeout):
+                return await future
+        finally:
+            self._pending_requests.pop(req_id, None)
+
+
+    async def stats(self, timeout: float = 5.0)-> dict:
+        """Server metrics: request latencies per message type, vdb/embedding/LLM
+        timings, queue depths, job and LLM governor stats."""
+        req_id = str(uuid.uuid4())
+        future: asyncio.Future[dict] = asyncio.Future()
+        self._pending_requests[req_id] = future
+
+        await self._send({"uid": req_id, "type": "stats"})
+
+        try:
+            async with asyncio.timeout(timeout):
+                return await future
+        finally:
+            self._pending_requests.pop(req_id, None)
+
+
+    async def profile(
+            self,
+            action: str,
+            scope: str | None = None,
+            duration: float | None = None,
+            timeout: float = 30.0,
+        )-> dict:
+        """Starts ("start"), stops ("stop") or inspects ("status") the server's sampling profiler.
+        scope limits sampling to one message type, stopping returns the written files under "last"."""
+        req_id = str(uuid.uuid4())
+        future: asyncio.Future[dict] = asyncio.Future()
+        self._pending_requests[req_id] = future
+
+        msg = {"uid": req_id, "type": "profile", "action": action}
+        if scope is not None:
+            msg["scope"] = scope
+        if duration is not None:
+            msg["duration"] = duration
+        await self._send(msg)
+
+        try:
+            async with asyncio.timeout(timeout):
+                return await future
+        finally:
+            self._pending_requests.pop(req_id, None)
+
+
+    def batch(self, parallel: bool = False)-> "Batch":
+        """Collects operations sent as a single message, see Batch."""
+        return Batch(self, parallel=parallel)
+
+
+class Batch:
+    """Operations sent in one frame and answered with one response, in order.
+    e.g: res = await memento.batch().query("...").count().send()"""
+    _client: Memento
+    _ops: list[dict]
+    parallel: bool
+
+    def __init__(self, client: Memento, parallel: bool = False):
+        self._client = client
+        self._ops = []
+        self.parallel = parallel
+
+
+    def query(self,
+            query_str: str,
+            collection_name: str = "default",
+            user: str | None = None,
+            from_: list[DbEnum] = [DbEnum.SHORT_TERM, DbEnum.LONG_TERM, DbEnum.USERS],
+            n: list[int] = [1, 1, 1],
+            fields: list[MemoryField] | None = None,
+        )-> "Batch":
+        self._ops.append({
+            "type": "query",
+            "query": query_str,
+            "ai_name": collection_name,
+            "user": user,
+            "from": [x.value for x in from_],
+            "n": n,
+            "fields": fields,
+        })
+        return self
+
+
+    def store(self,
+            memories: list[Memory],
+            collection_name: str = "default",
+            to: list[DbEnum] = [DbEnum.SHORT_TERM, DbEnum.USERS],
+        )-> "Batch":
+        self._ops.append({
+            "type": "store",
+            "memories": [x.to_dict() for x in memories],
+            "ai_name": collection_name,
+            "to": [x.value for x in to],
+        })
+        return self
+
+
+    def process(self,
+            messages: list[OpenLlmMsg],
+            context: list[OpenLlmMsg] = None,
+            collection_name: str = "default",
+        )-> "Batch":
+        self._ops.append({
+            "type": "process",
+            "ai_name": collection_name,
+            "messages": [x.model_dump(mode="json") for x in messages],
+            "context": [x.model_dump(mode="json") for x in (context or [])],
+        })
+        return self
+
+
+    def evict(self, collection_name: str = "default")-> "Batch":
+        self._ops.append({
+            "type": "evict",
+            "ai_name": collection_name,
+        })
+        return self
+
+
+    def clear(self,
+            collection_name: str = "default",
+            user: str | None = None,
+            target: DbEnum = DbEnum.SHORT_TERM,
+        )-> "Batch":
+        self._ops.append({
+            "type": "clear",
+            "ai_name": collection_name,
+            "target": target.value,
+            "user": user,
+        })
+        return self
+
+
+    def count(self,
+            collection_name: str = "default",
+            from_: list[DbEnum] = [DbEnum.SHORT_TERM, DbEnum.LONG_TERM],
+        )-> "Batch":
+        self._ops.append({
+            "type": "count",
+            "ai_name": collection_name,
+            "from": [x.value for x in from_],
+        })
+        return self
+
+
+    async def send(self, timeout: float = 5.0)-> list[BatchItemResult]:
+        """Results are in the order the operations were added."""
+        req_id = str(uuid.uuid4())
+        future: asyncio.Future[list[BatchItemResult]] = asyncio.Future()
+        self._client._pending_requests[req_id] = future
+
+        await self._client._send({
+            "uid": req_id,
+            "type": "batch",
+            "ops": self._ops,
+            "parallel": self.parallel,
+        })
 
         try:
             async with asyncio.timeout(timeout):
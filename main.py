@@ -1,4 +1,5 @@
 import asyncio
+import atexit
 import logging
 import sys
 
@@ -7,44 +8,71 @@ from websockets.asyncio.server import serve
 
 #from src.messages import generate_schemas
 from src.args import        parse_args
-from src.dump import        dump_all_dbs
+from src.dump import        dump_all_dbs, restore_dump
 from src.env import         parse_env
 from src.config import      parse_config
 from src.logging import     logging_init
 from src.decay import       periodic_decay
 from src.db_bundle import   databases_init
+from src.metrics import     monitor_loop_lag, serve_metrics
+from src.profiling import   PROFILER
+from src.snapshot import    snapshot_from_cli
 from src.wss_handler import WssHandler
 
 
 async def main():
     parsed_args = parse_args(sys.argv[1:])
+
+    # config first, it holds the logging settings
+    conf = parse_config()
     
-    logging_init(parsed_args)
+    logging_init(parsed_args, conf.logging)
     logger = logging.getLogger("global")
 
+    if parsed_args.profile:
+        PROFILER.start(conf.profiling, scope=parsed_args.profile_scope)
+        atexit.register(PROFILER.stop) # runs before the log listener is stopped
+
     logger.info("available onnxruntime providers: %s", ", ".join(onnxruntime.get_available_providers()))
 
-    logger.info("reading config & env")
+    logger.info("reading env")
     env =    parse_env()
-    conf = parse_config()
 
     #generate_schemas() # generate schemas for inbound Ws messages
 
+    if parsed_args.snapshot:
+        # before any database is opened here, a running server may own them
+        if await snapshot_from_cli(conf.snapshot, conf.wss.host, conf.wss.port) is None:
+            sys.exit(1)
+        return
+
     logger.info("initializing databases...")
     bundle = databases_init(conf)
+    if bundle.embedding_pool is not None:
+        atexit.register(bundle.embedding_pool.close)
 
     if parsed_args.dump:
-        dump_all_dbs(bundle, conf)
+        dump_all_dbs(bundle, conf, out_dir=parsed_args.dump_dir, with_embeddings=parsed_args.dump_embeddings)
+        return
+
+    if parsed_args.restore:
+        restore_dump(bundle, conf, in_dir=parsed_args.dump_dir, workers=parsed_args.restore_workers)
         return
 
     logger.info("running periodic decay routine")
-    decay_task = asyncio.create_task(periodic_decay(bundle.long_term))
+    decay_task = asyncio.create_task(periodic_decay(bundle.long_term, bundle.gate))
+
+    lag_task = asyncio.create_task(monitor_loop_lag())
+    metrics_server = await serve_metrics(conf.metrics.host, conf.metrics.port) if conf.metrics.enabled else None
 
     wss_handler = WssHandler(database_bundle=bundle, config=conf, env=env)
     async with serve(wss_handler.handle, host=conf.wss.host, port=conf.wss.port) as wss:
         await wss_handler.bind_and_wait(server=wss)
         # server is being closed
         decay_task.cancel() # may keep program running if not cancelled
+        lag_task.cancel()
+    if metrics_server is not None:
+        metrics_server.close()
     return
 
 
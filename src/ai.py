@@ -1,14 +1,20 @@
+import asyncio
 import logging
 import re
+import time
+import jiter
 import openai
 
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Awaitable, Callable, List, Optional
 
 from src.config import Config
+from src.latency import LatencyTracker
+from src.llm_governor import LlmCallSite, LlmGovernor
 from src.messages import OpenLlmMsg
+from src import metrics
 
-from src.retry_and_timeout import with_retry_and_timeout_async
+from src.retry_and_timeout import CircuitBreaker, RetryPolicy, with_retry_and_timeout_async
 
 
 class RememberEntry(BaseModel):
@@ -32,10 +38,56 @@ class ProcessResult(BaseModel):
     importance: float = Field(..., ge=0.0, le=1.0, multiple_of=0.1)
 
 
+class _SummaryStreamer:
+    """Turns content deltas of a streamed ProcessResult into summary callbacks:
+    (partial_text, False) while "summary" is generated, then (text, True) exactly once,
+    from flush() after the whole result parsed. Shared by every retry of the call, so a
+    failed attempt can never finalize a summary that is not the one stored."""
+    on_summary: Callable[[str, bool], Awaitable[None]]
+    last: str
+    final: bool
+
+    def __init__(self, on_summary: Callable[[str, bool], Awaitable[None]])-> None:
+        self.on_summary = on_summary
+        self.last = ""
+        self.final = False
+        return
+
+
+    async def on_delta(self, event)-> None:
+        if self.final:
+            return
+        # the SDK only exposes completed strings in event.parsed, the field may
+        # still be done before the rest of the result validates
+        if isinstance(event.parsed, dict) and isinstance(event.parsed.get("summary"), str):
+            summary = event.parsed["summary"]
+        else:
+            try:
+                partial = jiter.from_json(event.snapshot.encode("utf-8"), partial_mode="trailing-strings")
+            except ValueError:
+                return
+            summary = partial.get("summary") if isinstance(partial, dict) else None
+        if isinstance(summary, str) and summary != self.last:
+            self.last = summary
+            await self.on_summary(summary, False)
+
+
+    async def flush(self, summary: str)-> None:
+        # the parsed summary of the attempt that succeeded
+        if not self.final:
+            self.final = True
+            await self.on_summary(summary, True)
+
+
 class AI:
     config: Config
     client: openai.AsyncClient
     model_name: str
+    governor: LlmGovernor
+    breaker: CircuitBreaker
+    retry_policies: dict[str, RetryPolicy]
+    latency: dict[tuple[str, str], LatencyTracker]
+    usage: dict[str, dict[str, int]]
     prompt_cache: dict[str, str] = {}
     logger: logging.Logger
 
@@ -45,10 +97,202 @@ class AI:
         self.client = openai.AsyncClient(
             api_key=api_key,
             base_url=base_url,
+            max_retries=0, # retries are handled by our own policies
         )
         self.model_name = model_name
         self.logger = logging.getLogger(self.__class__.__name__)
+        self.governor = LlmGovernor(
+            max_concurrency=config.llm_governor.max_concurrency,
+            tokens_per_minute=config.llm_governor.tokens_per_minute,
+            token_burst=config.llm_governor.token_burst,
+        )
+        self.breaker = CircuitBreaker(
+            failure_threshold=config.llm_retry.breaker.failure_threshold,
+            reset_after=config.llm_retry.breaker.reset_after,
+            name=model_name,
+        )
+        self.retry_policies = {}
+        for call_site in ("process", "stm_merge", "compression"):
+            site_conf = getattr(config.llm_retry, call_site)
+            self.retry_policies[call_site] = RetryPolicy(
+                max_retries=site_conf.max_retries,
+                timeout_each=site_conf.timeout_each,
+                backoff_base=site_conf.backoff_base,
+                backoff_max=site_conf.backoff_max,
+            )
+        self.latency = {}
+        self.usage = {}
         return
+
+
+    def _get_usage(self, call_site: str)-> dict[str, int]:
+        if call_site not in self.usage:
+            self.usage[call_site] = {
+                "requests": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "hedges": 0,
+                "hedge_wins": 0,
+                "hedge_wasted_est_tokens": 0,
+            }
+        return self.usage[call_site]
+
+
+    def _get_latency(self, model: str, call_site: str)-> LatencyTracker:
+        key = (model, call_site)
+        if key not in self.latency:
+            self.latency[key] = LatencyTracker()
+        return self.latency[key]
+
+
+    def _hedge_delay(self, model: str, call_site: str)-> float:
+        conf = self.config.process_hedge
+        tracker = self._get_latency(model, call_site)
+        if tracker.count() < conf.min_samples:
+            return conf.max_delay
+        return min(conf.max_delay, max(conf.min_delay, tracker.percentile(conf.percentile)))
+
+
+    async def _timed_parse(self, call_site: LlmCallSite, est_tokens: int, on_delta: Callable | None = None, track: bool = True, **kwargs):
+        """track False: the caller adds the latency sample itself (hedged calls)."""
+        usage = self._get_usage(call_site)
+        usage["requests"] += 1
+
+        tracker = self._get_latency(kwargs["model"], call_site)
+        start = time.monotonic()
+        outcome = "error"
+        try:
+            if on_delta is None:
+                completion = await self.client.beta.chat.completions.parse(**kwargs)
+            else:
+                async with self.client.beta.chat.completions.stream(**kwargs, stream_options={"include_usage": True}) as stream:
+                    async for event in stream:
+                        if event.type == "content.delta":
+                            await on_delta(event)
+                    completion = await stream.get_final_completion()
+            outcome = "ok"
+        except asyncio.CancelledError:
+            # timed out: the elapsed time is a lower bound, dropping it would leave only fast calls
+            outcome = "cancelled"
+            if track:
+                tracker.add(time.monotonic() - start)
+            raise
+        finally:
+            metrics.LLM_CALL_SECONDS.observe(time.monotonic() - start, site=call_site, outcome=outcome)
+        if track:
+            tracker.add(time.monotonic() - start)
+
+        if completion.usage is not None:
+            usage["prompt_tokens"] += completion.usage.prompt_tokens
+            usage["completion_tokens"] += completion.usage.completion_tokens
+            metrics.LLM_TOKENS.inc(completion.usage.prompt_tokens, site=call_site, kind="prompt")
+            metrics.LLM_TOKENS.inc(completion.usage.completion_tokens, site=call_site, kind="completion")
+            self.governor.settle(est_tokens, completion.usage.total_tokens)
+        return completion
+
+
+    async def _hedged_parse(self, call_site: LlmCallSite, est_tokens: int, **kwargs):
+        """Fire a duplicate request if the first one is slower than the tracked
+        latency percentile, keep whichever answers first and cancel the other.
+        The latency sample is the time the caller waited, not that of either attempt:
+        a cut off loser is not a sample, a slow call still is one."""
+        tracker = self._get_latency(kwargs["model"], call_site)
+        start = time.monotonic()
+        try:
+            result = await self._hedged_attempts(call_site, est_tokens, **kwargs)
+        except asyncio.CancelledError:
+            tracker.add(time.monotonic() - start) # timed out, a lower bound
+            raise
+        tracker.add(time.monotonic() - start)
+        return result
+
+
+    async def _hedged_attempts(self, call_site: LlmCallSite, est_tokens: int, **kwargs):
+        delay = self._hedge_delay(kwargs["model"], call_site)
+        primary = asyncio.create_task(self._timed_parse(call_site, est_tokens, track=False, **kwargs))
+
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+        if done:
+            return primary.result()
+
+        self.logger.info("hedging %s request after %.2fs", call_site, delay)
+        usage = self._get_usage(call_site)
+        usage["hedges"] += 1
+
+        async def _secondary():
+            async with self.governor.slot(call_site, est_tokens):
+                return await self._timed_parse(call_site, est_tokens, track=False, **kwargs)
+
+        secondary = asyncio.create_task(_secondary())
+        pending = {primary, secondary}
+        first_exc: BaseException | None = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception() is None:
+                        if t is secondary:
+                            usage["hedge_wins"] += 1
+                        if pending:
+                            # the loser is cancelled mid-flight, count what it was estimated to cost
+                            usage["hedge_wasted_est_tokens"] += est_tokens
+                        return t.result()
+                    first_exc = first_exc or t.exception()
+            raise first_exc
+        finally:
+            for t in pending:
+                t.cancel()
+
+
+    def _estimate_tokens(self, messages: list[dict], max_completion_tokens: int)-> int:
+        # ~4 chars per token is close enough for rate limiting purposes
+        chars = sum(len(str(m.get("content", ""))) for m in messages)
+        return chars // 4 + max_completion_tokens
+
+
+    async def parse(
+        self,
+        call_site: LlmCallSite,
+        messages: list[dict],
+        response_format: type[BaseModel],
+        temperature: float,
+        max_completion_tokens: int,
+        hedge: bool = False,
+        on_delta: Callable[[object], Awaitable[None]] | None = None,
+    ):
+        """Structured completion going through the shared governor and the call site's retry policy.
+        Every LLM call should use this instead of touching self.client directly.
+
+        With on_delta, the completion is streamed and every "content.delta" event is
+        passed to it before the final parsed completion is returned. Streaming disables hedging:
+        two racing streams would interleave their deltas."""
+        est_tokens = self._estimate_tokens(messages, max_completion_tokens)
+        policy = self.retry_policies[call_site]
+
+        async def _call(**kwargs):
+            if on_delta is not None:
+                return await self._timed_parse(call_site, est_tokens, on_delta=on_delta, **kwargs)
+            if hedge and self.config.process_hedge.enabled:
+                return await self._hedged_parse(call_site, est_tokens, **kwargs)
+            return await self._timed_parse(call_site, est_tokens, **kwargs)
+
+        return await with_retry_and_timeout_async(
+            cr=_call,
+            model=self.model_name,
+            messages=messages,
+            temperature=temperature,
+            max_completion_tokens=max_completion_tokens,
+            response_format=response_format,
+            timeout=policy.timeout_each + 5.0,
+
+            policy=policy,
+            breaker=self.breaker,
+            gate=lambda: self.governor.slot(call_site, est_tokens),
+        )
     
 
     def _get_cached_prompt(self, prompt_name: str)-> str:
@@ -60,7 +304,18 @@ class AI:
             return self.prompt_cache[prompt_name]
 
 
-    async def process(self, ai_name: str, context: list[OpenLlmMsg], messages: list[OpenLlmMsg])-> ProcessResult | None:
+    async def process(
+        self,
+        ai_name: str,
+        context: list[OpenLlmMsg],
+        messages: list[OpenLlmMsg],
+        on_summary: Callable[[str, bool], Awaitable[None]] | None = None,
+        stream: bool = False,
+    )-> ProcessResult | None:
+        """When on_summary is given it is called with (text, final). With stream (and
+        openllm.stream_process allowing it) it gets partial summaries as they are generated,
+        otherwise the call is hedged; in every case it is called exactly once with
+        final=True, once the whole result parsed."""
         process_prompt = self._get_cached_prompt("process")
 
         msg_str = ""
@@ -83,25 +338,27 @@ class AI:
 
         ctx_msgs = [x.model_dump() for x in context]
 
-        maybe_completion = await with_retry_and_timeout_async(
-            cr=self.client.beta.chat.completions.parse,
-            model=self.model_name,
+        streamer = _SummaryStreamer(on_summary) if on_summary is not None else None
+        streamed = streamer is not None and stream and self.config.openllm.stream_process
+
+        maybe_completion = await self.parse(
+            call_site="process",
             messages=[*ctx_msgs, prompt_msg],
             temperature=self.config.openllm.temp,
             max_completion_tokens=self.config.openllm.max_completion_tokens,
             response_format=ProcessResult,
-            timeout=65.0,
-
-            max_retries=5,
-            timeout_each=60.0,
+            hedge=True,
+            on_delta=streamer.on_delta if streamed else None,
         )
 
         if maybe_completion is None:
-            raise Exception("failed to process memories due to ai backend failure. data loss occured.")
+            raise Exception("failed to process memories due to ai backend failure.")
             
 
         parsed = maybe_completion.choices[0].message.parsed
 
         self.logger.info("process result: %s", parsed.model_dump_json(indent=4))
+        if streamer is not None:
+            await streamer.flush(parsed.summary)
         return parsed
         
@@ -10,7 +10,51 @@ def parse_args(args: list[str]) -> argparse.Namespace:
     arg_parser.add_argument(
         "-d", "--dump",
         action="store_true",
-        help="dump contents of all databases to dump.json file"
+        help="dump contents of all databases to --dump-dir, one NDJSON file per collection"
+    )
+
+    arg_parser.add_argument(
+        "--dump-dir",
+        default="dump",
+        help="directory used by --dump and --restore (default: dump)"
+    )
+
+    arg_parser.add_argument(
+        "--dump-embeddings",
+        action="store_true",
+        help="include stm/ltm vectors in the dump, so --restore does not recompute them"
+    )
+
+    arg_parser.add_argument(
+        "--restore",
+        action="store_true",
+        help="load a dump from --dump-dir into the databases"
+    )
+
+    arg_parser.add_argument(
+        "--restore-workers",
+        type=int,
+        default=4,
+        help="collections restored in parallel (default: 4)"
+    )
+
+    arg_parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help="take a snapshot of all on-disk state into config.snapshot.dir and exit, through the running server if there is one"
+    )
+
+    arg_parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="sample all threads from startup until shutdown, written to config.profiling.dir"
+    )
+
+    arg_parser.add_argument(
+        "--profile-scope",
+        default=None,
+        metavar="TYPE",
+        help="with --profile, only sample work done while handling this message type"
     )
 
     arg_parser.add_argument(
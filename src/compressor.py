@@ -3,14 +3,14 @@ import uuid
 import logging
 import asyncio
 from math import floor
-from typing import List
+from typing import Callable, List
 from pydantic import BaseModel, Field
 
 from src.ai import AI
 from src.config import Config
 from src.memory import Memory
+from src.snapshot import WriteGate
 from src.vdbs.vector_database import VectorDataBase
-from src.retry_and_timeout import with_retry_and_timeout_async
 
 
 class _CompressItem(BaseModel):
@@ -28,10 +28,11 @@ class _MergeOut(BaseModel):
 
 
 class Compressor:
-    def __init__(self, ai: AI, long_vdb: VectorDataBase, config: Config):
+    def __init__(self, ai: AI, long_vdb: VectorDataBase, config: Config, gate: WriteGate | None = None):
         self.ai = ai
         self.long_vdb = long_vdb
         self.conf = config
+        self.gate = gate
         self.log = logging.getLogger(self.__class__.__name__)
 
 
@@ -121,11 +122,38 @@ class Compressor:
 
 
 
+    async def _write(self, fn: Callable[..., None], *args)-> None:
+        """LTM writes embed their texts, so they run on a worker thread."""
+        if self.gate is None:
+            await asyncio.to_thread(fn, *args)
+            return
+        async with self.gate.writing():
+            await asyncio.to_thread(fn, *args)
+
+
+    def _apply_merge(self, ai_name: str, delete_ids: List[str], mem: Memory)-> None:
+        for mem_id in delete_ids:
+            try:
+                self.long_vdb.remove(ai_name, mem_id)
+                self.log.info("ltm delete: id=%s", mem_id)
+            except Exception as e:
+                self.log.warning("ltm delete failed: id=%s err=%s", mem_id, e)
+        self.long_vdb.store(ai_name, mem)
+
+
     def _filter_score(self, score: float | None, floor_val: float)-> bool:
         return (score if score is not None else 0.0) >= floor_val
     
 
     async def compress_batch_async(self, ai_name: str, stm_batch: List[Memory]) -> None:
+        plan = await self.compress_llm_async(ai_name, stm_batch)
+        if plan is not None:
+            await self.merge_into_ltm_async(ai_name, *plan)
+
+
+    async def compress_llm_async(self, ai_name: str, stm_batch: List[Memory]) -> tuple[List[Memory], _CompressOut] | None:
+        """First step of compress_batch_async: only talks to the LLM and does not touch
+        LTM, so it is safe to run for several batches of one collection at once."""
         self.log.info("compress_batch_async start: coll=%s size=%d", ai_name, len(stm_batch))
 
         floor_val = self.conf.compression.score_floor_for_ltm
@@ -136,34 +164,35 @@ class Compressor:
 
         if len(filtered) == 0:
             self.log.info("compress_batch_async abort: nothing above floor.")
-            return
+            return None
 
-        by_id = {m.id: m for m in filtered}
         comp_msg = self._build_batch_prompt(ai_name, filtered)
 
-        maybe_comp = await with_retry_and_timeout_async(
-            cr=self.ai.client.beta.chat.completions.parse,
-            model=self.ai.model_name,
+        maybe_comp = await self.ai.parse(
+            call_site="compression",
             messages=[comp_msg],
             temperature=self.conf.openllm.temp,
             max_completion_tokens=self.conf.openllm.max_completion_tokens,
             response_format=_CompressOut,
-            timeout=65.0,
-
-            max_retries=5,
-            timeout_each=60.0,
         )
 
         if maybe_comp is None:
-            raise Exception("failed to compress memories due to ai backend failure. data loss occured.")
+            raise Exception("failed to compress memories due to ai backend failure.")
 
         out: _CompressOut | None = maybe_comp.choices[0].message.parsed
         self.log.info("compress_batch_async LLM parsed <<< %s", out.model_dump_json(indent=4))
 
         if out is None or len(out.memories) == 0:
             self.log.info("compress_batch_async abort: LLM returned no memories.")
-            return
+            return None
+
+        return filtered, out
 
+
+    async def merge_into_ltm_async(self, ai_name: str, filtered: List[Memory], out: _CompressOut) -> None:
+        """Second step of compress_batch_async: merges compressed memories into LTM.
+        Batches of one collection must go through here one at a time, in order."""
+        by_id = {m.id: m for m in filtered}
         fallback_score = self._score_mean(filtered)
 
         for idx, item in enumerate(out.memories, start=1):
@@ -176,7 +205,8 @@ class Compressor:
             self.log.info("merge step: %d/%d (sources=%d score=%.2f life=%d)",
                           idx, len(out.memories), len(contributing), score, lifetime)
 
-            existing_q = self.long_vdb.query(
+            existing_q = await asyncio.to_thread(
+                self.long_vdb.query,
                 coll_name=ai_name,
                 query_str=new_text,
                 n=self.conf.compression.similar_top_k
@@ -186,33 +216,21 @@ class Compressor:
 
             merge_msgs = self._build_merge_prompt(ai_name, new_text, existing, self.conf.compression.prefer_new)
 
-            maybe_comp = await with_retry_and_timeout_async(
-                cr=self.ai.client.beta.chat.completions.parse,
-                model=self.ai.model_name,
+            maybe_comp = await self.ai.parse(
+                call_site="compression",
                 messages=merge_msgs,
                 temperature=self.conf.openllm.temp,
                 max_completion_tokens=self.conf.openllm.max_completion_tokens,
                 response_format=_MergeOut,
-                timeout=65.0,
-
-                max_retries=5,
-                timeout_each=60.0,
             )
             
             if maybe_comp is None:
-                raise Exception("failed to process memories due to ai backend failure. data loss occured.")
+                raise Exception("failed to merge memories due to ai backend failure.")
             
             merged = maybe_comp.choices[0].message.parsed
 
             self.log.info("merge LLM parsed <<< %s", merged.model_dump_json(indent=4))
 
-            for mem_id in (merged.delete_ids or []):
-                try:
-                    self.long_vdb.remove(ai_name, mem_id)
-                    self.log.info("ltm delete: id=%s", mem_id)
-                except Exception as e:
-                    self.log.warning("ltm delete failed: id=%s err=%s", mem_id, e)
-
             mem = Memory(
                 id=str(uuid.uuid4()),
                 content=merged.new_text.strip(),
@@ -221,7 +239,7 @@ class Compressor:
                 score=score,
                 lifetime=lifetime
             )
-            self.long_vdb.store(ai_name, mem)
+            await self._write(self._apply_merge, ai_name, merged.delete_ids or [], mem)
             self.log.info('ltm store: id=%s score=%.2f life=%d content="%s"',
                           mem.id, score, lifetime, mem.content[:120].replace("\n"," "))
 
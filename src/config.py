@@ -7,6 +7,8 @@ from pydantic import BaseModel, Field
 class WssConfig(BaseModel):
     host: str = Field("127.0.0.1")
     port: int = Field(4286)
+    max_in_flight: int = Field(64, ge=1)     # requests handled at once per connection, reading pauses at the cap
+    ordered_writes: bool = Field(True)       # per collection: writes wait for earlier requests, reads for earlier writes
 
 
 class OpenLlmConfig(BaseModel):
@@ -14,12 +16,47 @@ class OpenLlmConfig(BaseModel):
     model: str = Field("gpt-4o-mini")
     temp: float = Field(1.0)
     max_completion_tokens: int = Field(1000)
+    stream_process: bool = Field(True)      # let process requests with "stream" get partial summaries; streamed calls are never hedged (process_hedge)
+
+
+class LlmGovernorConfig(BaseModel):
+    max_concurrency: int = Field(4, ge=1)       # max in-flight LLM requests across all call sites
+    tokens_per_minute: int = Field(0, ge=0)     # estimated token budget, 0 = no rate limit
+    token_burst: int = Field(0, ge=0)           # token bucket capacity, 0 = one minute worth
+
+
+class RetryConfig(BaseModel):
+    max_retries: int = Field(5, ge=1)           # attempts, including the first one
+    timeout_each: float = Field(60.0, gt=0.0)   # seconds allowed per attempt
+    backoff_base: float = Field(1.0, ge=0.0)    # max delay before the 1st retry, doubled each attempt (full jitter)
+    backoff_max: float = Field(30.0, ge=0.0)    # cap for a single backoff delay, a longer Retry-After is not waited for
+
+
+class CircuitBreakerConfig(BaseModel):
+    failure_threshold: int = Field(5, ge=1)     # consecutive retryable failures before failing fast
+    reset_after: float = Field(30.0, gt=0.0)    # seconds to stay open before letting a probe through
+
+
+class LlmRetryConfig(BaseModel):
+    process: RetryConfig = Field(RetryConfig(max_retries=3, timeout_each=30.0, backoff_base=0.5, backoff_max=5.0))
+    stm_merge: RetryConfig = Field(RetryConfig(max_retries=3, timeout_each=30.0))
+    compression: RetryConfig = Field(RetryConfig())
+    breaker: CircuitBreakerConfig = Field(CircuitBreakerConfig())
+
+
+class HedgeConfig(BaseModel):
+    enabled: bool = Field(False)                       # send a duplicate process request when the first one is slow
+    percentile: float = Field(0.9, gt=0.0, lt=1.0)     # hedge once the first attempt is slower than this latency percentile
+    min_delay: float = Field(1.0, ge=0.0)              # never hedge sooner than this (seconds)
+    max_delay: float = Field(15.0, gt=0.0)             # never wait longer than this, also used until enough samples exist
+    min_samples: int = Field(20, ge=1)                 # latency samples needed before the percentile is trusted
 
 
 class ShortVdbConfig(BaseModel):
     device: Literal["cuda", "cpu"] = Field("cuda")
     progressive_eviction: bool = Field(True)
     max_size_before_evict: int = Field(500)
+    max_deferred: int = Field(50, ge=0)    # how far STM may grow past max_size_before_evict while compression is backlogged
 
 
 class LongVdbConfig(BaseModel):
@@ -40,6 +77,29 @@ class CompressionConfig(BaseModel):
     prefer_new: bool = Field(True)                 # contradictory old memories are deleted
     batch_fraction_on_breach: float = Field(1.0)   # 0.5 = evict half, 1.0 = evict all, 0.0 = overflow-only
     min_batch_on_breach: int = Field(1)            # minimum items to evict when triggered
+    coalesce_linger: float = Field(10.0, ge=0.0)   # seconds a partial batch waits for more evicted mems before compressing
+    backlog_high_watermark: int = Field(8, ge=1)   # pending compress jobs per collection before STM eviction is deferred
+    fanout: int = Field(2, ge=1)                   # batches of one collection whose LLM step may run at once (LTM merges stay ordered)
+
+
+class JobQueueConfig(BaseModel):
+    compress_concurrency: int = Field(2, ge=1)   # compression workers, each busy with a different collection
+    process_concurrency: int = Field(2, ge=1)    # replayed/retried process jobs running at once
+    stm_merge_concurrency: int = Field(1, ge=1)  # replayed/retried STM merge jobs running at once
+    retry_base: float = Field(5.0, ge=0.0)       # delay before the first retry of a failed job, doubled each time
+    retry_max: float = Field(300.0, ge=0.0)      # cap for the retry delay
+    max_attempts: int = Field(10, ge=1)          # failed jobs are kept on disk as dead afterwards
+    synchronous: Literal["NORMAL", "FULL"] = Field("NORMAL") # sqlite fsync level, FULL survives power loss
+
+
+class TransferConfig(BaseModel):
+    max_page_size: int = Field(500, ge=1)   # max memories per export/import page
+
+
+class SnapshotConfig(BaseModel):
+    dir: str = Field("snapshots")                 # where snapshots are kept
+    keep: int = Field(5, ge=1)                    # older snapshots are deleted
+    compress_level: int = Field(6, ge=0, le=9)    # gzip level for changed files
 
 
 class StmMergeConfig(BaseModel):
@@ -49,14 +109,82 @@ class StmMergeConfig(BaseModel):
     temp: float = Field(1.0)                 # (optional) model temp for STM merges
     max_completion_tokens: int = Field(1000) # (optional) cap for STM merges
 
+
+class DedupConfig(BaseModel):
+    enabled: bool = Field(True)                         # drop duplicate memories locally before any STM merge call
+    simhash_max_bits: int = Field(3, ge=0, le=64)       # max differing SimHash bits for two texts to count as near-duplicates
+    min_cosine: float = Field(0.95, ge=0.0, le=1.0)     # embedding similarity at which an STM neighbor is a duplicate, 1.0 = exact only
+
+class LoggingConfig(BaseModel):
+    queue_size: int = Field(10_000, ge=0)               # records buffered for the writer thread, dropped when full, 0 = unbounded
+    max_payload_chars: int = Field(2000, ge=0)          # logged payloads are cut past this, 0 = no limit
+    redact_keys: list[str] = Field(["api_key", "authorization", "password", "token"])
+    sample: dict[str, float] = Field({})                # logger name prefix -> fraction of INFO/DEBUG records kept
+    rate_limit: dict[str, float] = Field({              # logger name prefix -> max INFO/DEBUG records per second
+        "WssHandler": 50.0,
+        "VdbChroma": 20.0,
+        "EvictingVdb": 20.0,
+    })
+
+
+class MetricsConfig(BaseModel):
+    enabled: bool = Field(True)           # Prometheus text endpoint, the "stats" message works either way
+    host: str = Field("127.0.0.1")
+    port: int = Field(9286)
+
+
+class LexicalConfig(BaseModel):
+    enabled: bool = Field(True)              # BM25 index next to each stm/ltm collection, built on first lexical/hybrid query
+    k1: float = Field(1.2, ge=0.0)           # term frequency saturation
+    b: float = Field(0.75, ge=0.0, le=1.0)   # document length normalization
+    rrf_k: int = Field(60, ge=1)             # hybrid queries: rank fusion constant, higher flattens rank differences
+    candidates: int = Field(3, ge=1)         # hybrid queries: each side returns n * candidates before fusion
+
+
+class QueryCacheConfig(BaseModel):
+    enabled: bool = Field(True)              # identical queries in flight are shared either way
+    ttl: float = Field(30.0, ge=0.0)         # seconds, 0 = until the collection is written to
+    max_entries: int = Field(1024, ge=0)     # least recently used results are dropped past this
+
+
+class EmbeddingPoolConfig(BaseModel):
+    enabled: bool = Field(False)                    # embed in worker processes instead of the server process, one model per worker
+    workers: int = Field(2, ge=1)
+    device: Literal["cpu", "cuda"] = Field("cuda")  # replaces short_vdb.device and long_vdb.device while enabled
+    max_batch: int = Field(64, ge=1)                # texts per worker request, bigger calls are split across workers
+    request_timeout: float = Field(60.0, gt=0)      # a worker busy longer on one batch is killed and restarted
+    health_interval: float = Field(1.0, gt=0)       # seconds between liveness checks of idle workers
+
+
+class ProfilingConfig(BaseModel):
+    dir: str = Field("profiles")                   # where --profile and the "profile" message write their files
+    interval_ms: float = Field(5.0, gt=0)          # time between stack samples
+    max_duration: float = Field(600.0, gt=0)       # cap for profiles started by message, --profile runs until shutdown
+    max_depth: int = Field(128, ge=1)              # frames kept per stack, counted from the leaf
+    include_idle: bool = Field(False)              # keep samples of threads waiting in select/queues/locks
+    formats: list[Literal["collapsed", "pstats"]] = Field(["collapsed", "pstats"])
+
 class Config(BaseModel):
     wss: WssConfig = Field(WssConfig())
     openllm: OpenLlmConfig = Field(OpenLlmConfig())
+    llm_governor: LlmGovernorConfig = Field(LlmGovernorConfig())
+    llm_retry: LlmRetryConfig = Field(LlmRetryConfig())
+    process_hedge: HedgeConfig = Field(HedgeConfig())
     short_vdb: ShortVdbConfig = Field(ShortVdbConfig())
     long_vdb: LongVdbConfig = Field(LongVdbConfig())
     user_db: UserDbConfig = Field(UserDbConfig())
     compression: CompressionConfig = Field(CompressionConfig())
     stm_merge: StmMergeConfig = Field(StmMergeConfig())
+    stm_dedup: DedupConfig = Field(DedupConfig())
+    jobs: JobQueueConfig = Field(JobQueueConfig())
+    transfer: TransferConfig = Field(TransferConfig())
+    snapshot: SnapshotConfig = Field(SnapshotConfig())
+    logging: LoggingConfig = Field(LoggingConfig())
+    metrics: MetricsConfig = Field(MetricsConfig())
+    query_cache: QueryCacheConfig = Field(QueryCacheConfig())
+    lexical: LexicalConfig = Field(LexicalConfig())
+    profiling: ProfilingConfig = Field(ProfilingConfig())
+    embedding_pool: EmbeddingPoolConfig = Field(EmbeddingPoolConfig())
 
 
 
@@ -3,34 +3,48 @@ from src.config import Config
 from src.vdbs.evicting_vdb import EvictingVdb
 from src.vdbs.decaying_vdb import DecayingVdb
 from src.user_database import UserDatabase
-from src.vdbs.vdb_chroma import VdbChroma
+from src.snapshot import WriteGate
+from src.vdbs.vdb_chroma import PooledEmbedding, VdbChroma
+from src.embedding_pool import EmbeddingPool
 
 class DbBundle:
     short_term: EvictingVdb
     long_term: DecayingVdb
     users: UserDatabase
+    gate: WriteGate # writers wait on it while a snapshot is being captured
+    embedding_pool: EmbeddingPool | None
 
-    def __init__(self, short: EvictingVdb, long: DecayingVdb, users: UserDatabase)-> None:
+    def __init__(self, short: EvictingVdb, long: DecayingVdb, users: UserDatabase, embedding_pool: EmbeddingPool | None = None)-> None:
         self.short_term = short
         self.long_term = long
         self.users = users
+        self.gate = WriteGate()
+        self.embedding_pool = embedding_pool
         return
 
 
 def databases_init(conf: Config) -> DbBundle:
-    short_size = conf.short_vdb.max_size_before_evict + 10\
+    # hard cap, leaves room for eviction deferred under backpressure
+    short_size = conf.short_vdb.max_size_before_evict + conf.short_vdb.max_deferred + 10\
                       if conf.short_vdb.progressive_eviction and conf.short_vdb.max_size_before_evict > 0\
                       else -1
 
+    # both tiers share the worker processes, models are then never loaded in this process
+    pool = EmbeddingPool(conf.embedding_pool) if conf.embedding_pool.enabled else None
+
     short_vdb = VdbChroma(
         db_name="short",
         size_limit=short_size,
         device=conf.short_vdb.device,
+        embedding_function=PooledEmbedding(pool, "short") if pool is not None else None,
+        lexical=conf.lexical,
     )
     long_vdb = VdbChroma(
         db_name="long",
         size_limit=conf.long_vdb.max_size,
         device=conf.long_vdb.device,
+        embedding_function=PooledEmbedding(pool, "long") if pool is not None else None,
+        lexical=conf.lexical,
     )
 
     short_evicting = EvictingVdb(
@@ -40,8 +54,9 @@ def databases_init(conf: Config) -> DbBundle:
         max_size_before_evict=conf.short_vdb.max_size_before_evict,
         evict_fraction=conf.compression.batch_fraction_on_breach,
         evict_min_batch=conf.compression.min_batch_on_breach,
+        max_deferred=conf.short_vdb.max_deferred,
     )
     long_decaying = DecayingVdb(wrapped_vdb=long_vdb)
     user_db = UserDatabase(size_limit_per_user=conf.user_db.max_size_per_user)
     
-    return DbBundle(short=short_evicting, long=long_decaying, users=user_db)
+    return DbBundle(short=short_evicting, long=long_decaying, users=user_db, embedding_pool=pool)
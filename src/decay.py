@@ -1,11 +1,24 @@
 import asyncio
+import logging
+import time
+from src import metrics
+from src.snapshot import WriteGate
 from src.vdbs.decaying_vdb import DecayingVdb
 
 
-async def periodic_decay(decay_vdb: DecayingVdb):
+async def periodic_decay(decay_vdb: DecayingVdb, gate: WriteGate | None = None):
     try:
         while True:
-            decay_vdb.decay_all()
+            if gate is not None:
+                await gate.opened()
+            start = time.perf_counter()
+            try:
+                decay_vdb.decay_all()
+                metrics.DECAY_RUNS.inc(status="ok")
+            except Exception:
+                metrics.DECAY_RUNS.inc(status="error")
+                logging.getLogger("decay").exception("decay run failed")
+            metrics.DECAY_SECONDS.observe(time.perf_counter() - start)
             await asyncio.sleep(60 * 60 * 12) # every 6 hours, will skip if date diff < 1
     except asyncio.CancelledError:
         return
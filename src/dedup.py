@@ -0,0 +1,122 @@
+import hashlib
+import logging
+import re
+import unicodedata
+
+from src.config import DedupConfig
+from src.memory import Memory, QueriedMemory
+
+
+_WORD_RE = re.compile(r"\w+(?:'\w+)*")
+# scripts written without spaces between words, one \w+ match would be a whole sentence
+_UNSPACED_RE = re.compile(r"[\u0e00-\u0eff\u1000-\u109f\u1780-\u17ff\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+
+
+def normalize_text(text: str)-> str:
+    return " ".join(_WORD_RE.findall(unicodedata.normalize("NFKC", text).casefold()))
+
+
+def text_hash(text: str)-> str | None:
+    """None for text without any word characters, which must never match another text by hash."""
+    norm = normalize_text(text)
+    if not norm:
+        return None
+    return hashlib.blake2b(norm.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _features(norm: str)-> list[str]:
+    """Word unigrams and bigrams; words of unspaced scripts become character bigrams."""
+    features: list[str] = []
+    words: list[str] = []
+    for word in norm.split(" "):
+        if len(word) > 1 and _UNSPACED_RE.search(word):
+            features.extend(word[i:i + 2] for i in range(len(word) - 1))
+        elif word:
+            words.append(word)
+    features.extend(words)
+    features.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+    return features
+
+
+def simhash(text: str)-> int | None:
+    """64-bit SimHash over word unigrams and bigrams, None for text without any word characters."""
+    features = _features(normalize_text(text))
+    if not features:
+        return None
+
+    weights = [0] * 64
+    for feat in features:
+        h = int.from_bytes(hashlib.blake2b(feat.encode("utf-8"), digest_size=8).digest(), "little")
+        for bit in range(64):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+
+    out = 0
+    for bit in range(64):
+        if weights[bit] > 0:
+            out |= 1 << bit
+    return out
+
+
+def hamming(a: int, b: int)-> int:
+    return (a ^ b).bit_count()
+
+
+class Deduper:
+    """Catches exact and near-duplicate memories locally, without any LLM call."""
+    conf: DedupConfig
+    logger: logging.Logger
+
+    def __init__(self, config: DedupConfig)-> None:
+        self.conf = config
+        self.logger = logging.getLogger(self.__class__.__name__)
+        return
+
+
+    def _is_near(self, a: str, b: str, a_sig: int | None = None, b_sig: int | None = None)-> bool:
+        a_hash, b_hash = text_hash(a), text_hash(b)
+        if a_hash is None or b_hash is None:
+            return a.strip() == b.strip() # nothing to compare but the raw text
+        if a_hash == b_hash:
+            return True
+        a_sig = a_sig if a_sig is not None else simhash(a)
+        b_sig = b_sig if b_sig is not None else simhash(b)
+        return hamming(a_sig, b_sig) <= self.conf.simhash_max_bits
+
+
+    def dedup_batch(self, mems: list[Memory])-> list[Memory]:
+        """Drops duplicates within one batch, keeping the first occurence. A dropped
+        duplicate folds its score/lifetime into the kept memory if they are higher."""
+        if not self.conf.enabled:
+            return mems
+
+        kept: list[tuple[Memory, int]] = []
+        for mem in mems:
+            sig = simhash(mem.content)
+            dup = next((k for k, k_sig in kept if k.user == mem.user and self._is_near(k.content, mem.content, k_sig, sig)), None)
+            if dup is None:
+                kept.append((mem, sig))
+                continue
+
+            if mem.score is not None and (dup.score is None or mem.score > dup.score):
+                dup.score = mem.score
+            if mem.lifetime is not None and (dup.lifetime is None or mem.lifetime > dup.lifetime):
+                dup.lifetime = mem.lifetime
+            self.logger.info('dropped in-batch duplicate: "%s" ~ "%s"', mem.content[:80], dup.content[:80])
+
+        return [k for k, _ in kept]
+
+
+    def find_duplicate(self, mem: Memory, neighbors: list[QueriedMemory])-> QueriedMemory | None:
+        """Returns the neighbor `mem` duplicates, if any. Distances are expected to be
+        squared L2 between normalized embeddings (chroma's default), i.e. 2 - 2*cos."""
+        if not self.conf.enabled:
+            return None
+
+        max_dist = 2.0 * (1.0 - self.conf.min_cosine)
+        sig = simhash(mem.content)
+        for qm in neighbors:
+            if qm.memory.user != mem.user:
+                continue
+            if qm.distance <= max_dist or self._is_near(mem.content, qm.memory.content, sig):
+                return qm
+        return None
@@ -1,42 +1,158 @@
 import json
+import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from src.config import Config
 from src.db_bundle import DbBundle
+from src.memory import Memory
+from src import transfer
+from src.transfer import Tier
+import src.utils as utils
 
 
-def dump_all_dbs(bundle: DbBundle, conf: Config)-> None:
-    obj = {
-        "stm": [],
-        "ltm": [],
-        "users": [],
+_TIERS: tuple[Tier, ...] = ("stm", "ltm", "users")
+_MANIFEST = "manifest.json"
+
+logger = logging.getLogger("dump")
+
+
+class _Progress:
+    """Logs throughput at most every `every` seconds."""
+    label: str
+    count: int
+    start: float
+    last_log: float
+    every: float
+
+    def __init__(self, label: str, every: float = 2.0)-> None:
+        self.label = label
+        self.count = 0
+        self.start = time.monotonic()
+        self.last_log = self.start
+        self.every = every
+        return
+
+
+    def _rate(self)-> float:
+        elapsed = time.monotonic() - self.start
+        return self.count / elapsed if elapsed > 0.0 else 0.0
+
+
+    def add(self, n: int)-> None:
+        self.count += n
+        now = time.monotonic()
+        if now - self.last_log >= self.every:
+            self.last_log = now
+            logger.info("%s: %d mems, %.0f mems/s", self.label, self.count, self._rate())
+
+
+    def done(self)-> None:
+        logger.info("%s: done, %d mems in %.1fs (%.0f mems/s)", self.label, self.count, time.monotonic() - self.start, self._rate())
+
+
+def _collection_names(bundle: DbBundle, tier: Tier)-> list[str]:
+    if tier == "stm":
+        return bundle.short_term.get_collection_names()
+    if tier == "ltm":
+        return bundle.long_term.get_collection_names()
+    return bundle.users.get_collaction_names()
+
+
+def dump_all_dbs(bundle: DbBundle, conf: Config, out_dir: str = "dump", with_embeddings: bool = False)-> None:
+    """Writes one NDJSON file per tier and collection, page by page, so memory use
+    does not depend on the collection sizes. Embeddings go in the "e" key of each line."""
+    page_size = conf.transfer.max_page_size
+    manifest = {
+        "created": int(time.time() * 1000),
+        "embeddings": with_embeddings,
+        "files": [],
     }
+    total = _Progress("dump")
+
+    for tier in _TIERS:
+        os.makedirs(os.path.join(out_dir, tier), exist_ok=True)
+
+        for coll_name in _collection_names(bundle, tier):
+            rel_path = os.path.join(tier, utils.sanitize_for_path(coll_name) + ".ndjson")
+            progress = _Progress(f"dump {tier}/{coll_name}")
+
+            with open(os.path.join(out_dir, rel_path), "w", encoding="utf-8") as f:
+                offset = 0
+                while offset is not None:
+                    page = transfer.read_page(bundle, tier, coll_name, offset, page_size, with_embeddings and tier != "users")
+                    for i, mem in enumerate(page.mems):
+                        line = mem.to_dict()
+                        if page.embeddings is not None:
+                            line["e"] = page.embeddings[i]
+                        f.write(json.dumps(line, separators=(",", ":")))
+                        f.write("\n")
+                    progress.add(len(page.mems))
+                    total.add(len(page.mems))
+                    offset = page.next_offset
+
+            progress.done()
+            manifest["files"].append({"tier": tier, "coll": coll_name, "path": rel_path, "count": progress.count})
+
+    # written last, a dump without manifest is incomplete
+    with open(os.path.join(out_dir, _MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4)
+
+    total.done()
+    logger.info("dump written to %s", os.path.abspath(out_dir))
+    return
+
+
+def _restore_file(bundle: DbBundle, in_dir: str, entry: dict, page_size: int)-> int:
+    tier: Tier = entry["tier"]
+    coll_name: str = entry["coll"]
+    progress = _Progress(f"restore {tier}/{coll_name}")
+
+    def _flush(mems: list[Memory], embeddings: list[list[float]])-> None:
+        # stm is restored as-is, eviction runs on the next regular store
+        transfer.write_page(bundle, tier, coll_name, mems, embeddings if len(embeddings) == len(mems) else None, evict=False)
+        progress.add(len(mems))
+
+    with open(os.path.join(in_dir, entry["path"]), "r", encoding="utf-8") as f:
+        mems: list[Memory] = []
+        embeddings: list[list[float]] = []
+        for line in f:
+            if not line.strip():
+                continue
+            obj = json.loads(line)
+            if "e" in obj:
+                embeddings.append(obj.pop("e"))
+            mems.append(Memory.from_dict(obj))
+
+            if len(mems) >= page_size:
+                _flush(mems, embeddings)
+                mems, embeddings = [], []
+        if mems:
+            _flush(mems, embeddings)
+
+    progress.done()
+    if tier != "users":
+        # a restore bypasses eviction, past the hard size limit the oldest memories are dropped
+        vdb = bundle.short_term if tier == "stm" else bundle.long_term
+        kept = vdb.count(coll_name)
+        if kept < progress.count:
+            logger.warning("restore %s/%s: %d of %d memories dropped by the size limit", tier, coll_name, progress.count - kept, progress.count)
+    return progress.count
+
+
+def restore_dump(bundle: DbBundle, conf: Config, in_dir: str = "dump", workers: int = 4)-> None:
+    """Loads a dump written by dump_all_dbs, one collection file per worker."""
+    with open(os.path.join(in_dir, _MANIFEST), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    entries: list[dict] = manifest.get("files", [])
+    logger.info("restoring %d collection file(s) from %s with %d worker(s)", len(entries), os.path.abspath(in_dir), workers)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        counts = list(pool.map(lambda e: _restore_file(bundle, in_dir, e, conf.transfer.max_page_size), entries))
 
-    for coll_name in bundle.short_term.get_collection_names():
-        mems = bundle.short_term.peek_oldest(coll_name, None)
-        obj["stm"].append({
-            "coll": coll_name,
-            "mems": [x.to_dict() for x in mems]
-        })
-    
-    for coll_name in bundle.long_term.get_collection_names():
-        mems = bundle.long_term.peek_oldest(coll_name, None)
-        obj["ltm"].append({
-            "coll": coll_name,
-            "mems": [x.to_dict() for x in mems]
-        })
-    
-    for coll_name in bundle.users.get_collaction_names():
-        coll_obj = {"coll": coll_name, "users": []}
-        for user in bundle.users.get_collection_users(coll_name):
-            mems = bundle.users.query(coll_name, user, n=conf.user_db.max_size_per_user + 1)
-            coll_obj["users"].append({
-                "user": user,
-                "mems": [x.to_dict() for x in mems]
-            })
-        obj["users"] = coll_obj
-    
-    with open("dump.json", "w+", encoding="utf-8") as f:
-        json.dump(obj, f)
-    
-    os.startfile("dump.json")
+    elapsed = time.monotonic() - start
+    logger.info("restore: done, %d mems in %.1fs (%.0f mems/s)", sum(counts), elapsed, sum(counts) / elapsed if elapsed > 0.0 else 0.0)
+    return
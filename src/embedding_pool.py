@@ -0,0 +1,386 @@
+import functools
+import itertools
+import logging
+import multiprocessing as mp
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Connection, wait
+from multiprocessing.process import BaseProcess
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Sequence
+
+import numpy as np
+
+from src.config import EmbeddingPoolConfig
+from src import metrics
+
+
+_MAX_FAILURES = 5       # consecutive crashes before a worker slot is given up
+_MAX_BACKOFF = 30.0     # seconds between restarts of a crashing worker
+
+
+def load_minilm(device: str)-> Callable[[list[str]], Sequence]:
+    """Default model factory, runs inside the worker process."""
+    from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+    provider = "CUDAExecutionProvider" if device == "cuda" else "CPUExecutionProvider"
+    return ONNXMiniLM_L6_V2(preferred_providers=[provider])
+
+
+def _worker_main(conn: Connection, factory: Callable[[], Callable], max_batch: int)-> None:
+    """Worker process: loads the model once, then embeds batches into its shared memory block until told to stop."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # the server shuts its workers down itself
+
+    model = factory()
+    dim = len(model(["warmup"])[0])
+    shm = SharedMemory(create=True, size=max_batch * dim * 4)
+    out = np.ndarray((max_batch, dim), dtype=np.float32, buffer=shm.buf)
+    conn.send(("ready", shm.name, dim))
+    try:
+        while True:
+            try:
+                msg = conn.recv()
+            except EOFError:
+                break # the server went away
+            if msg is None:
+                break
+            job_id, texts = msg
+            try:
+                out[:len(texts)] = np.asarray(model(texts), dtype=np.float32)
+                conn.send(("done", job_id, None))
+            except Exception as e:
+                conn.send(("done", job_id, repr(e)))
+    finally:
+        del out
+        shm.close()
+    return
+
+
+class _Request:
+    """One embedding call, split into batches that may run on different workers."""
+
+    def __init__(self, batches: int)-> None:
+        self.future: Future = Future()
+        self.parts: list[np.ndarray | None] = [None] * batches
+        self.remaining = batches
+        self.lock = threading.Lock()
+        return
+
+
+    def done(self, index: int, vectors: np.ndarray)-> None:
+        with self.lock:
+            if self.future.done():
+                return
+            self.parts[index] = vectors
+            self.remaining -= 1
+            if self.remaining > 0:
+                return
+        self.future.set_result(np.concatenate(self.parts))
+
+
+    def fail(self, e: BaseException)-> None:
+        with self.lock:
+            if not self.future.done():
+                self.future.set_exception(e)
+
+
+class _Job:
+    id: int
+    request: _Request
+    index: int
+    texts: list[str]
+    attempts: int
+
+    def __init__(self, id: int, request: _Request, index: int, texts: list[str])-> None:
+        self.id = id
+        self.request = request
+        self.index = index
+        self.texts = texts
+        self.attempts = 0
+        return
+
+
+class _Slot:
+    """A worker process and its state, replaced in place on restart. gen tells stale idle entries apart."""
+
+    def __init__(self, index: int)-> None:
+        self.index = index
+        self.gen = 0
+        self.process: BaseProcess | None = None
+        self.conn: Connection | None = None
+        self.shm: SharedMemory | None = None
+        self.out: np.ndarray | None = None
+        self.job: _Job | None = None
+        self.deadline = 0.0
+        self.failures = 0
+        self.restart_at = 0.0
+        self.gave_up = False
+        return
+
+
+class EmbeddingPool:
+    """Embedding models in worker processes, so tokenization and inference never hold
+    the GIL of the process running the websocket loop. Texts go to a worker over a pipe,
+    vectors come back through the worker's shared memory block. A monitor thread
+    restarts workers that exit or stay busy past request_timeout; their batch is retried once."""
+    workers: int
+    max_batch: int
+    request_timeout: float
+    health_interval: float
+    logger: logging.Logger
+
+    def __init__(self, config: EmbeddingPoolConfig, factory: Callable[[], Callable] | None = None)-> None:
+        """factory must be picklable, it is called once in every worker process."""
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.workers = config.workers
+        self.max_batch = config.max_batch
+        self.request_timeout = config.request_timeout
+        self.health_interval = config.health_interval
+        self._factory = factory if factory is not None else functools.partial(load_minilm, config.device)
+        self._ctx = mp.get_context("spawn") # forking would copy the event loop, its threads and any CUDA state
+
+        self._ids = itertools.count()
+        self._jobs: queue.Queue[_Job | None] = queue.Queue()
+        self._idle: queue.Queue[tuple[_Slot, int] | None] = queue.Queue()
+        self._lock = threading.Lock() # slot.job, slot.gen
+        self._closed = False
+        self._broken: RuntimeError | None = None
+
+        self._slots = [_Slot(i) for i in range(self.workers)]
+        for slot in self._slots:
+            self._spawn(slot)
+
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="EmbeddingPool-dispatch", daemon=True)
+        self._monitor = threading.Thread(target=self._monitor_loop, name="EmbeddingPool-monitor", daemon=True)
+        self._dispatcher.start()
+        self._monitor.start()
+        metrics.EMBED_POOL_PENDING.set_function(lambda: float(self._jobs.qsize()))
+        self.logger.info("started %d embedding workers", self.workers)
+        return
+
+
+    def submit(self, texts: Sequence[str])-> Future:
+        """Queues texts and returns at once, the future resolves to a float32 array of one row per text."""
+        if self._closed:
+            raise RuntimeError("embedding pool is closed")
+        if self._broken is not None:
+            raise self._broken
+
+        texts = list(texts)
+        if not texts:
+            future: Future = Future()
+            future.set_result(np.zeros((0, 0), dtype=np.float32))
+            return future
+
+        batches = [texts[i:i + self.max_batch] for i in range(0, len(texts), self.max_batch)]
+        request = _Request(len(batches))
+        for index, batch in enumerate(batches):
+            self._jobs.put(_Job(next(self._ids), request, index, batch))
+        return request.future
+
+
+    def embed(self, texts: Sequence[str])-> np.ndarray:
+        """Blocks the calling thread only, the GIL is released while waiting."""
+        return self.submit(texts).result()
+
+
+    def close(self)-> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._jobs.put(None)
+        self._idle.put(None)
+        self._monitor.join(timeout=self.health_interval + 5.0)
+        self._dispatcher.join(timeout=5.0)
+
+        for slot in self._slots:
+            if slot.process is None:
+                continue
+            try:
+                slot.conn.send(None)
+            except (OSError, ValueError):
+                pass
+            slot.process.join(timeout=5.0)
+            if slot.process.is_alive():
+                slot.process.kill()
+                slot.process.join()
+            self._release(slot)
+
+        with self._lock:
+            pending = [slot.job for slot in self._slots if slot.job is not None]
+        pending.extend(self._drain())
+        for job in pending:
+            job.request.fail(RuntimeError("embedding pool is closed"))
+        self.logger.info("embedding workers stopped")
+        return
+
+
+    def _spawn(self, slot: _Slot)-> None:
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self._factory, self.max_batch),
+            name=f"embedding-worker-{slot.index}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        with self._lock:
+            slot.process = process
+            slot.conn = parent_conn
+        return
+
+
+    def _release(self, slot: _Slot)-> None:
+        slot.out = None
+        if slot.shm is not None:
+            slot.shm.close()
+            try:
+                slot.shm.unlink()
+            except FileNotFoundError:
+                pass
+            slot.shm = None
+        if slot.conn is not None:
+            slot.conn.close()
+            slot.conn = None
+        slot.process = None
+        return
+
+
+    def _drain(self)-> list[_Job]:
+        jobs = []
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                return jobs
+            if job is not None:
+                jobs.append(job)
+
+
+    def _dispatch_loop(self)-> None:
+        """Hands each batch to the next idle worker."""
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            if job.request.future.done():
+                continue # another batch of the same call already failed
+
+            while True:
+                entry = self._idle.get()
+                if entry is None:
+                    # closed, or every worker gave up
+                    e = self._broken or RuntimeError("embedding pool is closed")
+                    for pending in [job, *self._drain()]:
+                        pending.request.fail(e)
+                    return
+                slot, gen = entry
+                with self._lock:
+                    if gen != slot.gen or slot.job is not None:
+                        continue # the worker was replaced after it went idle
+                    slot.job = job
+                    slot.deadline = time.monotonic() + self.request_timeout
+                    conn = slot.conn
+                break
+
+            try:
+                conn.send((job.id, job.texts))
+            except (OSError, ValueError):
+                pass # the worker died, the monitor retries its job
+
+
+    def _monitor_loop(self)-> None:
+        """Collects results and checks worker health."""
+        while not self._closed:
+            live = [slot for slot in self._slots if slot.process is not None]
+            handles = [slot.conn for slot in live] + [slot.process.sentinel for slot in live]
+            if handles:
+                ready = wait(handles, timeout=self.health_interval)
+            else:
+                time.sleep(self.health_interval)
+                ready = []
+            if self._closed:
+                return
+
+            now = time.monotonic()
+            for slot in live:
+                if slot.conn in ready:
+                    while slot.conn.poll():
+                        if not self._receive(slot):
+                            break
+                if slot.process.sentinel in ready or not slot.process.is_alive():
+                    self._replace(slot, None)
+                elif slot.job is not None and now > slot.deadline:
+                    self._replace(slot, f"busy for more than {self.request_timeout}s")
+
+            for slot in self._slots:
+                if slot.process is None and not slot.gave_up and now >= slot.restart_at:
+                    self._spawn(slot)
+
+
+    def _receive(self, slot: _Slot)-> bool:
+        try:
+            msg = slot.conn.recv()
+        except (EOFError, OSError):
+            return False # the exit is handled by the caller
+
+        if msg[0] == "ready":
+            _, shm_name, dim = msg
+            slot.shm = SharedMemory(name=shm_name)
+            slot.out = np.ndarray((self.max_batch, dim), dtype=np.float32, buffer=slot.shm.buf)
+            self.logger.info("embedding worker %d ready (pid %d)", slot.index, slot.process.pid)
+            self._idle.put((slot, slot.gen))
+            return True
+
+        _, job_id, error = msg
+        with self._lock:
+            job = slot.job
+            if job is None or job.id != job_id:
+                return True
+            slot.job = None
+        slot.failures = 0 # only a finished batch proves the worker healthy, loading is not enough
+        if error is not None:
+            job.request.fail(RuntimeError(f"embedding worker {slot.index} failed: {error}"))
+        else:
+            # copied out, the block is overwritten by the worker's next batch
+            job.request.done(job.index, slot.out[:len(job.texts)].copy())
+        self._idle.put((slot, slot.gen))
+        return True
+
+
+    def _replace(self, slot: _Slot, reason: str | None)-> None:
+        """reason None: the worker exited on its own."""
+        with self._lock:
+            job, slot.job = slot.job, None
+            slot.gen += 1
+        process = slot.process
+        if process.is_alive():
+            process.kill()
+        process.join(timeout=5.0)
+        self._release(slot)
+        reason = reason or f"exited with code {process.exitcode}"
+
+        slot.failures += 1
+        metrics.EMBED_POOL_RESTARTS.inc()
+        self.logger.warning("embedding worker %d %s, restarting", slot.index, reason)
+
+        if job is not None:
+            job.attempts += 1
+            if job.attempts > 1:
+                job.request.fail(RuntimeError(f"embedding batch failed on {job.attempts} workers"))
+            else:
+                self._jobs.put(job)
+
+        if slot.failures < _MAX_FAILURES:
+            slot.restart_at = time.monotonic() + min(0.5 * 2 ** (slot.failures - 1), _MAX_BACKOFF)
+            return
+
+        slot.gave_up = True
+        self.logger.error("embedding worker %d crashed %d times in a row, giving up on it", slot.index, slot.failures)
+        if all(s.gave_up for s in self._slots):
+            self._broken = RuntimeError("every embedding worker keeps crashing")
+            self._idle.put(None)
+        return
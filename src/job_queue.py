@@ -0,0 +1,611 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Coroutine, Literal
+
+
+class Job:
+    id: str
+    kind: str
+    coll: str
+    payload: dict
+    attempts: int
+    not_before: float
+    seq: int
+    state: Literal["claimed", "delayed", "ready", "held", "running"]
+    filling: bool # put_coalesced is committing more items into it, it must not start yet
+
+    def __init__(self, id: str, kind: str, coll: str, payload: dict, attempts: int = 0, not_before: float = 0.0, seq: int = 0)-> None:
+        self.id = id
+        self.kind = kind
+        self.coll = coll
+        self.payload = payload
+        self.attempts = attempts
+        self.not_before = not_before
+        self.seq = seq
+        self.state = "claimed"
+        self.filling = False
+        return
+
+
+JobHandler = Callable[[Job], Coroutine[Any, Any, None]]
+
+
+class JobQueue:
+    """Durable queue for LLM-dependent work, backed by SQLite.
+
+    Jobs are committed before the caller deletes their source data, acked (deleted)
+    once their handler returns, and retried with a delay when it raises. Whatever is
+    left in the database at startup is replayed. Delivery is at-least-once.
+
+    Synchronous puts commit immediately and are meant for worker threads; async
+    puts, acks and retries are grouped into a single commit by a background writer.
+    Nothing commits on the event loop thread.
+
+    Kinds registered as ordered run at most one job per collection at a time, in
+    enqueue order; a job waiting for its retry holds back the rest of its collection."""
+    logger: logging.Logger
+
+    _DB_DIR = os.path.join(".", "jobs")
+
+    def __init__(
+        self,
+        retry_base: float = 5.0,
+        retry_max: float = 300.0,
+        max_attempts: int = 10,
+        synchronous: Literal["NORMAL", "FULL"] = "NORMAL",
+    )-> None:
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.max_attempts = max(1, max_attempts)
+
+        os.makedirs(self._DB_DIR, exist_ok=True)
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self._DB_DIR, "jobs.sqlite3"), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(f"PRAGMA synchronous={synchronous}")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT NOT NULL, coll TEXT NOT NULL, payload TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0, not_before REAL NOT NULL DEFAULT 0,"
+            " dead INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL)"
+        )
+
+        self._jobs: dict[str, Job] = {}
+        self._handlers: dict[str, JobHandler] = {}
+        self._limits: dict[str, int] = {}
+        self._ordered: set[str] = set()
+        self._lines: dict[tuple[str, str], deque[str]] = {}
+        self._in_flight: dict[str, int] = {}
+        self._ready: dict[str, deque[str]] = {}
+        self._delayed: list[tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        # newest not-yet-started job per (kind, coll) that put_coalesced may still append to.
+        # Jobs themselves, not ids: put_coalesced runs on worker threads and must not read _jobs,
+        # which like _lines and the dispatch state is only touched on the loop thread.
+        # _open_lock only guards this map and job states, never a commit, the loop takes it too
+        self._open: dict[tuple[str, str], Job] = {}
+        self._open_lock = threading.Lock()
+        self._coalesce_lock = threading.Lock() # put_coalesced calls commit one at a time, in order
+
+        self._pending_writes: list[tuple[str, tuple, asyncio.Future | None]] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wake: asyncio.Event | None = None
+        self._write_wake: asyncio.Event | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._flushing: asyncio.Future | None = None # group commit the writer handed to a thread
+        self._running: set[asyncio.Task] = set()
+
+        self._started_at = time.monotonic()
+        self._busy_s: dict[str, float] = {}
+        self._done: dict[str, int] = {}
+        self._failed: dict[str, int] = {}
+
+        self._replay: list[Job] = self._load()
+        return
+
+
+    def _load(self)-> list[Job]:
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT id, kind, coll, payload, attempts, not_before FROM jobs WHERE dead = 0 ORDER BY created"
+            ).fetchall()
+            dead = self._db.execute("SELECT COUNT(*) FROM jobs WHERE dead = 1").fetchone()[0]
+
+        jobs = [Job(id=r[0], kind=r[1], coll=r[2], payload=json.loads(r[3]), attempts=r[4], not_before=r[5], seq=next(self._seq)) for r in rows]
+        if jobs or dead:
+            self.logger.info("loaded %d pending job(s) for replay, %d dead job(s) kept on disk", len(jobs), dead)
+        return jobs
+
+
+    def register(self, kind: str, handler: JobHandler, concurrency: int = 1, ordered: bool = False)-> None:
+        self._handlers[kind] = handler
+        self._limits[kind] = max(1, concurrency)
+        if ordered:
+            self._ordered.add(kind)
+        self._in_flight.setdefault(kind, 0)
+        self._ready.setdefault(kind, deque())
+        self._busy_s.setdefault(kind, 0.0)
+        self._done.setdefault(kind, 0)
+        self._failed.setdefault(kind, 0)
+
+
+    def start(self)-> None:
+        """Start dispatching, replays whatever was pending at startup. Handlers must be registered first."""
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._write_wake = asyncio.Event()
+        self._started_at = time.monotonic()
+        with self._open_lock:
+            # the newest pending job of a collection takes more items, as it did before the restart
+            for job in self._replay:
+                if job.attempts == 0:
+                    self._open[(job.kind, job.coll)] = job
+                else:
+                    self._open.pop((job.kind, job.coll), None)
+        for job in self._replay:
+            self._schedule(job)
+        self._replay = []
+        self._tasks = [
+            asyncio.create_task(self._dispatcher()),
+            asyncio.create_task(self._writer()),
+        ]
+
+
+    async def stop(self)-> None:
+        for t in [*self._tasks, *self._running]:
+            t.cancel()
+        await asyncio.gather(*self._tasks, *self._running, return_exceptions=True)
+        if self._flushing is not None:
+            # shielded from the cancel above, its writes were already taken off the list
+            await asyncio.gather(self._flushing, return_exceptions=True)
+        # whatever was not written is replayed on next start
+        self._flush_writes(self._take_writes())
+        with self._db_lock:
+            self._db.close()
+
+
+    # --- writes ---
+
+    def _insert_rows(self, jobs: list[Job])-> list[tuple]:
+        now = time.time()
+        return [(j.id, j.kind, j.coll, json.dumps(j.payload), j.attempts, j.not_before, now) for j in jobs]
+
+
+    def _commit_now(self, jobs: list[Job], delete_id: str | None = None, update: tuple[Job, dict] | None = None)-> None:
+        with self._db_lock:
+            self._db.execute("BEGIN")
+            try:
+                if delete_id is not None:
+                    self._db.execute("DELETE FROM jobs WHERE id = ?", (delete_id,))
+                if update is not None:
+                    self._db.execute("UPDATE jobs SET payload = ? WHERE id = ?", (json.dumps(update[1]), update[0].id))
+                self._db.executemany(
+                    "INSERT INTO jobs (id, kind, coll, payload, attempts, not_before, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    self._insert_rows(jobs),
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+
+    def _queue_write(self, sql: str, params: tuple, fut: asyncio.Future | None = None)-> None:
+        self._pending_writes.append((sql, params, fut))
+        if self._write_wake is not None:
+            self._loop.call_soon_threadsafe(self._write_wake.set)
+
+
+    def _take_writes(self)-> list[tuple[str, tuple, asyncio.Future | None]]:
+        writes, self._pending_writes = self._pending_writes, []
+        return writes
+
+
+    def _flush_writes(self, writes: list[tuple[str, tuple, asyncio.Future | None]])-> None:
+        if not writes:
+            return
+        with self._db_lock:
+            self._db.execute("BEGIN")
+            try:
+                for sql, params, _ in writes:
+                    self._db.execute(sql, params)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+
+    async def _writer(self)-> None:
+        # everything queued while a commit is running goes into the next one
+        while True:
+            await self._write_wake.wait()
+            self._write_wake.clear()
+            writes = self._take_writes()
+            if not writes:
+                continue
+            try:
+                self._flushing = asyncio.ensure_future(asyncio.to_thread(self._flush_writes, writes))
+                await asyncio.shield(self._flushing)
+                for _, _, fut in writes:
+                    if fut is not None and not fut.done():
+                        fut.set_result(None)
+            except Exception as e:
+                self.logger.exception("group commit of %d write(s) failed", len(writes))
+                for _, _, fut in writes:
+                    if fut is not None and not fut.done():
+                        fut.set_exception(e)
+
+
+    # --- public api ---
+
+    def _new_job(self, kind: str, coll: str, payload: dict)-> Job:
+        return Job(id=str(uuid.uuid4()), kind=kind, coll=coll, payload=payload, seq=next(self._seq))
+
+
+    def _track(self, job: Job)-> None:
+        if job.id in self._jobs:
+            return
+        self._jobs[job.id] = job
+        if job.kind in self._ordered:
+            self._lines.setdefault((job.kind, job.coll), deque()).append(job.id)
+
+
+    def _forget(self, job_id: str)-> Job | None:
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            return None
+        line = self._lines.get((job.kind, job.coll), None)
+        if line is not None:
+            try:
+                line.remove(job_id)
+            except ValueError:
+                pass
+            if not line:
+                del self._lines[(job.kind, job.coll)]
+        return job
+
+
+    def put_many(self, jobs: list[tuple[str, str, dict]], dispatch: bool = True)-> list[str]:
+        """Durably commit jobs (kind, coll, payload) in one transaction before returning.
+        Blocks on the commit, call it from a worker thread."""
+        new_jobs = [self._new_job(kind, coll, payload) for kind, coll, payload in jobs]
+        if not new_jobs:
+            return []
+        self._commit_now(new_jobs)
+        for job in new_jobs:
+            self._on_loop(self._schedule if dispatch else self._track, job)
+        return [job.id for job in new_jobs]
+
+
+    def put(self, kind: str, coll: str, payload: dict, dispatch: bool = True)-> str:
+        return self.put_many([(kind, coll, payload)], dispatch=dispatch)[0]
+
+
+    async def put_async(self, kind: str, coll: str, payload: dict, dispatch: bool = True)-> str:
+        """Same as put, but the commit is shared with other concurrent writes.
+        With dispatch=False the job is claimed by the caller, who must ack or fail it."""
+        job = self._new_job(kind, coll, payload)
+        fut = self._loop.create_future()
+        row = self._insert_rows([job])[0]
+        self._queue_write(
+            "INSERT INTO jobs (id, kind, coll, payload, attempts, not_before, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            row, fut,
+        )
+        await fut
+        self._track(job)
+        if dispatch:
+            self._schedule(job)
+        return job.id
+
+
+    def put_coalesced(self, kind: str, coll: str, key: str, items: list, max_items: int, linger: float = 0.0)-> list[str]:
+        """Durably add `items` to payload[key] of the newest not-yet-started job of
+        (kind, coll) until it holds max_items, opening new jobs for the rest.
+        A partial job waits up to `linger` seconds for more items before it runs, jobs
+        pending at startup take more items too. Blocks on the commit, call it from a worker thread."""
+        max_items = max(1, max_items)
+        items = list(items)
+
+        with self._coalesce_lock:
+            update: tuple[Job, dict] | None = None
+            with self._open_lock:
+                open_job = self._open.get((kind, coll), None)
+                if open_job is not None and open_job.state != "running" and key in open_job.payload:
+                    room = max_items - len(open_job.payload[key])
+                    if room > 0 and items:
+                        take, items = items[:room], items[room:]
+                        update = (open_job, {**open_job.payload, key: open_job.payload[key] + take})
+                        open_job.filling = True
+
+            new_jobs = [self._new_job(kind, coll, {key: items[i:i+max_items]}) for i in range(0, len(items), max_items)]
+            now = time.time()
+            for job in new_jobs:
+                if len(job.payload[key]) < max_items:
+                    job.not_before = now + linger
+
+            try:
+                self._commit_now(new_jobs, update=update)
+            except BaseException:
+                if update is not None:
+                    self._filled(update[0], None, key, max_items)
+                raise
+            if update is not None:
+                self._filled(update[0], update[1], key, max_items)
+
+            with self._open_lock:
+                if new_jobs:
+                    last = new_jobs[-1]
+                    if len(last.payload[key]) < max_items:
+                        self._open[(kind, coll)] = last
+                    else:
+                        self._open.pop((kind, coll), None)
+            for job in new_jobs:
+                self._on_loop(self._schedule, job)
+
+        return [job.id for job in new_jobs]
+
+
+    def _filled(self, job: Job, payload: dict | None, key: str, max_items: int)-> None:
+        """Ends a put_coalesced update of job, payload None when its commit failed."""
+        with self._open_lock:
+            job.filling = False
+            full = payload is not None and len(payload[key]) >= max_items
+            if payload is not None:
+                job.payload = payload
+            if full and self._open.get((job.kind, job.coll), None) is job:
+                del self._open[(job.kind, job.coll)]
+        self._on_loop(self._resume, job)
+        if full:
+            self._on_loop(self._promote, job)
+        return
+
+
+    async def replace(self, job_id: str, jobs: list[tuple[str, str, dict]], dispatch: bool = False)-> list[str]:
+        """Atomically swap a finished job for follow-up jobs."""
+        new_jobs = [self._new_job(kind, coll, payload) for kind, coll, payload in jobs]
+        # one transaction of its own: the delete must not be grouped apart from the inserts
+        await asyncio.to_thread(self._commit_now, new_jobs, job_id)
+        self._forget(job_id)
+        for job in new_jobs:
+            self._track(job)
+            if dispatch:
+                self._schedule(job)
+        return [job.id for job in new_jobs]
+
+
+    def ack(self, job_id: str)-> None:
+        self._forget(job_id)
+        if self._wake is not None:
+            self._wake.set() # next job of an ordered line may run now
+        self._queue_write("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+
+    def fail(self, job_id: str, e: BaseException)-> None:
+        """Schedule a delayed retry, or park the job as dead after max_attempts."""
+        job = self._jobs.get(job_id, None)
+        if job is None:
+            return
+
+        job.attempts += 1
+        if job.attempts >= self.max_attempts:
+            self.logger.error("job %s (%s, coll=%s) failed %d times, kept as dead: %s", job.id, job.kind, job.coll, job.attempts, e)
+            self._forget(job_id)
+            self._queue_write("UPDATE jobs SET attempts = ?, dead = 1 WHERE id = ?", (job.attempts, job.id))
+            return
+
+        delay = min(self.retry_max, self.retry_base * (2 ** (job.attempts - 1)))
+        job.not_before = time.time() + delay
+        self.logger.warning("job %s (%s, coll=%s) failed, retry %d in %.1fs: %s", job.id, job.kind, job.coll, job.attempts, delay, e)
+        self._queue_write("UPDATE jobs SET attempts = ?, not_before = ? WHERE id = ?", (job.attempts, job.not_before, job.id))
+        self._schedule(job)
+
+
+    def claim_following(self, job: Job, limit: int)-> list[Job]:
+        """For ordered kinds: claim up to `limit` runnable jobs queued right behind
+        `job` in its collection, so a handler can work on them together. The handler
+        must ack, fail or release each of them."""
+        line = self._lines.get((job.kind, job.coll), None)
+        if line is None or limit <= 0:
+            return []
+        claimed: list[Job] = []
+        with self._open_lock:
+            for job_id in list(line)[1:]:
+                nxt = self._jobs.get(job_id, None)
+                if nxt is None or nxt.state != "ready" or nxt.filling or len(claimed) >= limit:
+                    break
+                nxt.state = "running"
+                if self._open.get((nxt.kind, nxt.coll), None) is nxt:
+                    del self._open[(nxt.kind, nxt.coll)]
+                claimed.append(nxt)
+        return claimed
+
+
+    def release(self, job: Job)-> None:
+        """Hand a claimed job back untouched."""
+        if job.id in self._jobs and job.state == "running":
+            job.state = "ready"
+            if job.kind not in self._ordered:
+                self._ready[job.kind].appendleft(job.id)
+            self._wake.set()
+
+
+    async def run_claimed(self, job_id: str, cr: Coroutine)-> Any:
+        """Run a claimed job inline: ack on success, schedule a retry and re-raise on failure."""
+        try:
+            result = await cr
+        except asyncio.CancelledError:
+            # stays on disk, replayed at next start
+            raise
+        except Exception as e:
+            self.fail(job_id, e)
+            raise
+        self.ack(job_id)
+        return result
+
+
+    def pending_count(self, kind: str, coll: str | None = None)-> int:
+        return sum(1 for job in list(self._jobs.values()) if job.kind == kind and (coll is None or job.coll == coll))
+
+
+    def stats(self)-> dict:
+        pending: dict[str, int] = {}
+        by_coll: dict[str, dict[str, int]] = {}
+        for job in list(self._jobs.values()):
+            pending[job.kind] = pending.get(job.kind, 0) + 1
+            colls = by_coll.setdefault(job.kind, {})
+            colls[job.coll] = colls.get(job.coll, 0) + 1
+        return {
+            "pending": pending,
+            "pending_by_coll": by_coll,
+            "in_flight": dict(self._in_flight),
+            "delayed": sum(1 for job in list(self._jobs.values()) if job.state == "delayed"),
+            "workers": {kind: self._worker_stats(kind) for kind in self._handlers},
+        }
+
+
+    def _worker_stats(self, kind: str)-> dict:
+        elapsed = max(1e-6, time.monotonic() - self._started_at)
+        return {
+            "concurrency": self._limits[kind],
+            "done": self._done[kind],
+            "failed": self._failed[kind],
+            "jobs_per_min": round(self._done[kind] * 60.0 / elapsed, 2),
+            "utilization": round(self._busy_s[kind] / (elapsed * self._limits[kind]), 3),
+        }
+
+
+    # --- dispatching ---
+
+    def _on_loop(self, fn: Callable[[Job], None], job: Job)-> None:
+        """Runs fn right away on the loop thread or before start(), else hands it to the loop."""
+        if self._loop is None:
+            fn(job)
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            fn(job)
+        else:
+            self._loop.call_soon_threadsafe(fn, job)
+
+
+    def _schedule(self, job: Job)-> None:
+        if self._loop is None:
+            self._replay.append(job)
+            return
+        if job.kind not in self._handlers:
+            self.logger.error("no handler registered for job kind '%s', job %s left pending", job.kind, job.id)
+            return
+        self._track(job)
+        if job.not_before > time.time():
+            job.state = "delayed"
+            heapq.heappush(self._delayed, (job.not_before, next(self._seq), job.id))
+        else:
+            job.state = "ready"
+            self._ready[job.kind].append(job.id)
+        self._wake.set()
+
+
+    def _resume(self, job: Job)-> None:
+        """Schedule a job _start held back while put_coalesced was filling it."""
+        if job.state == "held" and not job.filling:
+            self._schedule(job)
+
+
+    def _promote(self, job: Job)-> None:
+        """Make a delayed job runnable right away, its stale heap entry is skipped later."""
+        job.not_before = 0.0
+        if self._loop is not None and job.state == "delayed":
+            job.state = "ready"
+            self._ready[job.kind].append(job.id)
+            self._wake.set()
+
+
+    async def _run_job(self, job: Job)-> None:
+        start = time.monotonic()
+        try:
+            await self._handlers[job.kind](job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._failed[job.kind] += 1
+            self.fail(job.id, e)
+        else:
+            self._done[job.kind] += 1
+            self.ack(job.id)
+        finally:
+            took = time.monotonic() - start
+            self._busy_s[job.kind] += took
+            self._in_flight[job.kind] -= 1
+            self._wake.set()
+            self.logger.debug("job %s (%s, coll=%s) took %.2fs", job.id, job.kind, job.coll, took)
+
+
+    def _start(self, job: Job)-> None:
+        with self._open_lock:
+            if job.filling:
+                job.state = "held" # _filled reschedules it
+                return
+            job.state = "running"
+            if self._open.get((job.kind, job.coll), None) is job:
+                del self._open[(job.kind, job.coll)]
+        self._in_flight[job.kind] += 1
+        t = asyncio.create_task(self._run_job(job))
+        self._running.add(t)
+        t.add_done_callback(self._running.discard)
+
+
+    def _start_ordered(self, kind: str)-> None:
+        # only the head of each collection's line may run, oldest heads first
+        heads: list[Job] = []
+        for (line_kind, _), line in self._lines.items():
+            if line_kind != kind:
+                continue
+            head = self._jobs.get(line[0], None)
+            if head is not None and head.state == "ready":
+                heads.append(head)
+        heads.sort(key=lambda j: j.seq)
+        for head in heads:
+            if self._in_flight[kind] >= self._limits[kind]:
+                break
+            self._start(head)
+
+
+    async def _dispatcher(self)-> None:
+        while True:
+            now = time.time()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, job_id = heapq.heappop(self._delayed)
+                job = self._jobs.get(job_id, None)
+                if job is not None and job.state == "delayed" and job.not_before <= now:
+                    job.state = "ready"
+                    self._ready[job.kind].append(job_id)
+
+            for kind, ready in self._ready.items():
+                if kind in self._ordered:
+                    ready.clear()
+                    self._start_ordered(kind)
+                    continue
+                while ready and self._in_flight[kind] < self._limits[kind]:
+                    job = self._jobs.get(ready.popleft(), None)
+                    if job is None or job.state != "ready":
+                        continue
+                    self._start(job)
+
+            timeout = max(0.0, self._delayed[0][0] - time.time()) if self._delayed else None
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,41 @@
+from collections import deque
+from math import ceil
+
+
+class LatencyTracker:
+    """Sliding window of recent latencies (seconds) for percentile estimates."""
+    samples: deque[float]
+
+    def __init__(self, window: int = 256)-> None:
+        self.samples = deque(maxlen=window)
+        return
+
+
+    def add(self, seconds: float)-> None:
+        self.samples.append(seconds)
+
+
+    def count(self)-> int:
+        return len(self.samples)
+
+
+    def percentile(self, p: float)-> float | None:
+        """p in [0.0, 1.0], nearest-rank. None when no samples were recorded yet."""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        rank = max(1, ceil(p * len(ordered)))
+        return ordered[min(rank, len(ordered)) - 1]
+
+
+    def to_dict(self)-> dict:
+        def _ms(p: float)-> int | None:
+            val = self.percentile(p)
+            return int(val * 1_000) if val is not None else None
+
+        return {
+            "samples": len(self.samples),
+            "p50_ms": _ms(0.5),
+            "p90_ms": _ms(0.9),
+            "p99_ms": _ms(0.99),
+        }
@@ -0,0 +1,192 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Literal
+
+
+# lower value = served first when the governor is saturated
+LlmCallSite = Literal["process", "stm_merge", "compression"]
+CALL_SITE_PRIORITIES: dict[str, int] = {
+    "process": 0,
+    "stm_merge": 1,
+    "compression": 2,
+}
+
+
+class _TokenBucket:
+    """Token bucket that allows going into debt: a reservation always succeeds
+    and returns how long the caller must wait before the tokens are actually there."""
+    rate: float
+    capacity: float
+    tokens: float
+    last: float
+
+    def __init__(self, tokens_per_minute: int, burst: int)-> None:
+        self.rate = tokens_per_minute / 60.0
+        self.capacity = float(burst if burst > 0 else tokens_per_minute)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        return
+
+
+    def _refill(self)-> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+
+    def reserve(self, amount: int)-> float:
+        self._refill()
+        # a single oversized request should not wait forever
+        self.tokens -= min(float(amount), self.capacity)
+        if self.tokens >= 0.0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+    def refund(self, amount: int)-> None:
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _SiteStats:
+    waiting: int
+    acquired: int
+    wait_total_s: float
+    wait_max_s: float
+
+    def __init__(self)-> None:
+        self.waiting = 0
+        self.acquired = 0
+        self.wait_total_s = 0.0
+        self.wait_max_s = 0.0
+        return
+
+    def to_dict(self)-> dict:
+        return {
+            "waiting": self.waiting,
+            "acquired": self.acquired,
+            "wait_avg_ms": int(self.wait_total_s * 1_000 / self.acquired) if self.acquired else 0,
+            "wait_max_ms": int(self.wait_max_s * 1_000),
+        }
+
+
+class LlmGovernor:
+    """Process-wide limit on in-flight LLM requests.
+
+    Slots are handed out by call-site priority (process > stm_merge > compression),
+    FIFO within a priority. An optional token bucket throttles on estimated tokens."""
+    max_concurrency: int
+    logger: logging.Logger
+
+    def __init__(self, max_concurrency: int = 4, tokens_per_minute: int = 0, token_burst: int = 0)-> None:
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.max_concurrency = max(1, int(max_concurrency))
+
+        self._in_flight = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._bucket = _TokenBucket(tokens_per_minute, token_burst) if tokens_per_minute > 0 else None
+        self._stats: dict[str, _SiteStats] = {site: _SiteStats() for site in CALL_SITE_PRIORITIES}
+        return
+
+
+    def _release_slot(self)-> None:
+        # hand the slot directly to the best waiter so nobody can barge in
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._in_flight -= 1
+
+
+    async def _acquire_slot(self, prio: int)-> None:
+        if self._in_flight < self.max_concurrency and not self._waiters:
+            self._in_flight += 1
+            return
+
+        fut = asyncio.get_running_loop().create_future()
+        entry = (prio, next(self._seq), fut)
+        heapq.heappush(self._waiters, entry)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # slot was handed over right before cancellation, pass it on
+                self._release_slot()
+            else:
+                try:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                except ValueError:
+                    pass
+            raise
+
+
+    async def acquire(self, call_site: LlmCallSite, est_tokens: int = 0)-> float:
+        """Wait for a slot (and tokens, if rate limited). Returns seconds waited."""
+        stats = self._stats[call_site]
+        start = time.monotonic()
+
+        stats.waiting += 1
+        try:
+            await self._acquire_slot(CALL_SITE_PRIORITIES[call_site])
+        finally:
+            stats.waiting -= 1
+
+        if self._bucket is not None and est_tokens > 0:
+            delay = self._bucket.reserve(est_tokens)
+            if delay > 0.0:
+                self.logger.info("rate limited: site=%s est_tokens=%d delay=%.2fs", call_site, est_tokens, delay)
+                try:
+                    await asyncio.sleep(delay)
+                except asyncio.CancelledError:
+                    self._bucket.refund(est_tokens)
+                    self._release_slot()
+                    raise
+
+        waited = time.monotonic() - start
+        stats.acquired += 1
+        stats.wait_total_s += waited
+        stats.wait_max_s = max(stats.wait_max_s, waited)
+
+        if waited > 1.0:
+            self.logger.info("slot acquired: site=%s waited=%.2fs queue=%d", call_site, waited, len(self._waiters))
+        return waited
+
+
+    def release(self)-> None:
+        self._release_slot()
+
+
+    def settle(self, est_tokens: int, used_tokens: int)-> None:
+        """Correct the token bucket once the provider reported actual usage."""
+        if self._bucket is not None and est_tokens > 0:
+            self._bucket.refund(est_tokens - used_tokens)
+
+
+    @asynccontextmanager
+    async def slot(self, call_site: LlmCallSite, est_tokens: int = 0)-> AsyncIterator[None]:
+        await self.acquire(call_site, est_tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+    def queue_depth(self)-> int:
+        return len(self._waiters)
+
+
+    def stats(self)-> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._in_flight,
+            "queue_depth": len(self._waiters),
+            "tokens_available": int(self._bucket.tokens) if self._bucket is not None else None,
+            "sites": {site: s.to_dict() for site, s in self._stats.items()},
+        }
@@ -1,6 +1,169 @@
+import atexit
+import json
 import logging
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from src.config import LoggingConfig
+from src import metrics
+
+
+class Payload:
+    """Lazy %s argument for message payloads: only rendered (redacted, truncated)
+    when a record is actually written, so disabled levels cost nothing.
+    Records are formatted on the writer thread, the payload must not be mutated after logging."""
+    max_chars: int = 2000
+    redact_keys: frozenset[str] = frozenset()
+
+    def __init__(self, obj: object)-> None:
+        self.obj = obj
+        return
+
+    @classmethod
+    def _redact(cls, obj: object)-> object:
+        if isinstance(obj, dict):
+            return {k: ("***" if k in cls.redact_keys else cls._redact(v)) for k, v in obj.items()}
+        if isinstance(obj, list):
+            return [cls._redact(x) for x in obj]
+        return obj
+
+    def __str__(self)-> str:
+        obj = self.obj
+        if isinstance(obj, bytes):
+            text = f"<{len(obj)} bytes>"
+        elif isinstance(obj, str):
+            text = obj
+        else:
+            try:
+                text = json.dumps(self._redact(obj), ensure_ascii=False, default=str)
+            except Exception:
+                text = repr(obj)
+
+        if self.max_chars > 0 and len(text) > self.max_chars:
+            return f"{text[:self.max_chars]}...(+{len(text) - self.max_chars} chars)"
+        return text
+
+
+def kv(**fields)-> dict:
+    """Structured fields for a record, use as logger.info("msg", extra=kv(a=1))."""
+    return {"kv": fields}
+
+
+class _KvFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord)-> str:
+        out = super().format(record)
+        fields: dict | None = getattr(record, "kv", None)
+        if not fields:
+            return out
+
+        parts = []
+        for k, v in fields.items():
+            if k in Payload.redact_keys:
+                v = "***"
+            s = str(v)
+            if len(s) > 200:
+                s = s[:200] + "..."
+            if " " in s or "=" in s or not s:
+                s = json.dumps(s, ensure_ascii=False)
+            parts.append(f"{k}={s}")
+        return f"{out} {' '.join(parts)}"
+
+
+class _SamplingFilter(logging.Filter):
+    """Per logger-name-prefix sampling and rate limits for records below WARNING.
+    How many records were dropped is reported on the next one that gets through,
+    and counted in memento_log_records_dropped_total."""
+
+    def __init__(self, sample: dict[str, float], rate_limit: dict[str, float])-> None:
+        super().__init__()
+        self._sample = sample
+        self._rate = rate_limit
+        self._prefixes = sorted(set(sample) | set(rate_limit), key=len, reverse=True)
+        self._rule_for: dict[str, str | None] = {}
+        self._tokens: dict[str, float] = {}
+        self._last: dict[str, float] = {}
+        self._dropped: dict[str, int] = {}
+        self._lock = threading.Lock()
+        return
+
+
+    def _rule(self, name: str)-> str | None:
+        rule = self._rule_for.get(name, "")
+        if rule == "":
+            rule = next((p for p in self._prefixes if name.startswith(p)), None)
+            self._rule_for[name] = rule
+        return rule
+
+
+    def _drop_reason(self, rule: str)-> str | None:
+        p = self._sample.get(rule)
+        if p is not None and random.random() >= p:
+            return "sampled"
+
+        rate = self._rate.get(rule)
+        if rate is None:
+            return None
+        now = time.monotonic()
+        tokens = min(rate, self._tokens.get(rule, rate) + (now - self._last.get(rule, now)) * rate)
+        self._last[rule] = now
+        if tokens < 1.0:
+            self._tokens[rule] = tokens
+            return "rate_limited"
+        self._tokens[rule] = tokens - 1.0
+        return None
+
+
+    def filter(self, record: logging.LogRecord)-> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rule = self._rule(record.name)
+        if rule is None:
+            return True
+
+        with self._lock:
+            reason = self._drop_reason(rule)
+            if reason is not None:
+                self._dropped[rule] = self._dropped.get(rule, 0) + 1
+            else:
+                dropped = self._dropped.pop(rule, 0)
+        if reason is not None:
+            metrics.LOG_RECORDS_DROPPED.inc(reason=reason)
+            return False
+
+        if dropped:
+            record.kv = {**(getattr(record, "kv", None) or {}), "dropped_before": dropped}
+        return True
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """Never blocks the caller: formatting happens on the listener thread and
+    records are dropped if that thread falls behind. Drops are counted, and
+    reported on the next record that makes it into the queue."""
+    dropped: int = 0
+
+    def prepare(self, record: logging.LogRecord)-> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord)-> None:
+        dropped = self.dropped
+        if dropped:
+            record.kv = {**(getattr(record, "kv", None) or {}), "dropped_queue_full": dropped}
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            metrics.LOG_RECORDS_DROPPED.inc(reason="queue_full")
+            return
+        if dropped:
+            self.dropped -= dropped
+
+
+def logging_init(args, conf: LoggingConfig | None = None) -> None:
+    conf = conf or LoggingConfig()
 
-def logging_init(args) -> None:
     # silence the telemetry error spam
     for name in (
         "chromadb.telemetry",
@@ -11,9 +174,24 @@ def logging_init(args) -> None:
         log.propagate = False
         log.handlers.clear()
         log.addHandler(logging.NullHandler())
-    
-    logging.basicConfig(
-        format="[%(asctime)s][%(name)s.%(funcName)s] %(message)s",
+
+    Payload.max_chars = conf.max_payload_chars
+    Payload.redact_keys = frozenset(conf.redact_keys)
+
+    stream = logging.StreamHandler()
+    stream.setFormatter(_KvFormatter(
+        fmt="[%(asctime)s][%(name)s.%(funcName)s] %(message)s",
         datefmt="%m/%d %H:%M:%S",
+    ))
+
+    handler = _DroppingQueueHandler(queue.Queue(maxsize=conf.queue_size))
+    handler.addFilter(_SamplingFilter(conf.sample, conf.rate_limit))
+
+    listener = QueueListener(handler.queue, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop) # flushes what is left in the queue
+
+    logging.basicConfig(
+        handlers=[handler],
         level=logging.DEBUG if args.verbose else logging.INFO
     )
@@ -50,10 +50,12 @@ class Memory(BaseModel):
 class QueriedMemory:
     memory: Memory = Field(...)
     distance: float = Field(...)
+    embedding: Optional[list[float]] = None # stored vector, only when asked for, never serialized
 
-    def __init__(self, memory: Memory = None, distance: float = 0.0):
+    def __init__(self, memory: Memory = None, distance: float = 0.0, embedding: Optional[list[float]] = None):
         self.memory = memory
         self.distance = distance
+        self.embedding = embedding
         return
 
     def to_dict(self)-> dict:
@@ -1,12 +1,35 @@
 import json
 import os
-from typing import Literal, List, Optional
+from typing import Literal, List, Optional, Union
 from pydantic import BaseModel, Field, field_validator
 
 from src.memory import Memory
+from src.wire import MemoryField
 
 DataBases = Literal["stm", "ltm", "users"]
-MessageTypes = Literal["query", "store", "process", "evict", "clear", "count", "close", "unhandled"]
+MAX_QUERIES = 32 # strings in one query message
+MessageTypes = Literal["hello", "query", "store", "process", "evict", "clear", "count", "batch", "export", "import", "snapshot", "stats", "profile", "close", "unhandled"]
+
+
+class MsgHello(BaseModel):
+    type: Literal["hello"] = Field(...)
+    uid: str = Field(...)
+    encodings: List[str] = Field(default_factory=lambda: ["json"])  # by preference, "msgpack" | "json"
+    fields: Optional[List[MemoryField]] = Field(default=None)       # memory fields returned by queries, None = all
+
+    class Config:
+        populate_by_name = True
+
+
+class RankSpec(BaseModel):
+    """Server-side re-ranking of stm/ltm results: n * candidates are fetched, then ordered by the weighted sum."""
+    distance: float = Field(default=1.0, ge=0.0)            # weight of similarity to the query, min-max normalized over the candidates
+    score: float = Field(default=0.0, ge=0.0)               # weight of the memory's score
+    recency: float = Field(default=0.0, ge=0.0)             # weight of 0.5 ** (age / half_life)
+    half_life: float = Field(default=86_400.0, gt=0.0)      # seconds
+    lifetime: float = Field(default=0.0, ge=0.0)            # weight of remaining lifetime, relative to the longest among the candidates
+    candidates: int = Field(default=4, ge=1, le=20)         # over-fetch factor
+    mmr: Optional[float] = Field(default=None, ge=0.0, le=1.0) # MMR lambda on stored embeddings, 1 = relevance only, lower = more diverse
 
 
 class MsgQuery(BaseModel):
@@ -14,9 +37,20 @@ class MsgQuery(BaseModel):
     uid: str = Field(...)
     ai_name: str = Field(...)
     user: str = Field(...)
-    query: str = Field(...)
+    query: Union[str, List[str]] = Field(...)   # a list is embedded in one batch, stm/ltm results then come back per query
     from_: List[DataBases] = Field(..., alias="from", min_length=1, max_length=3)
     n: List[int] = Field(..., min_length=1, max_length=3)
+    fields: Optional[List[MemoryField]] = Field(default=None) # memory fields to return, overrides the ones set in hello
+    mode: Literal["vector", "lexical", "hybrid"] = Field(default="vector") # stm/ltm: embeddings, BM25 keywords only (no embedding), or both fused by rank
+    rank: Optional[RankSpec] = Field(default=None)
+    dedup: bool = Field(default=False) # list queries: a memory is only kept for the query it ranks highest in
+    
+    @field_validator("query")
+    @classmethod
+    def _query_count(cls, v):
+        if isinstance(v, list) and not 1 <= len(v) <= MAX_QUERIES:
+            raise ValueError(f"'query' must hold between 1 and {MAX_QUERIES} strings")
+        return v
     
     @field_validator("n")
     @classmethod
@@ -56,6 +90,7 @@ class MsgProcess(BaseModel):
     ai_name: str = Field(...)
     context: Optional[List[OpenLlmMsg]] = Field(default=None)
     messages: List[OpenLlmMsg] = Field(...)
+    stream: bool = Field(default=False) # also send partial summaries while they are generated
 
     class Config:
         populate_by_name = True
@@ -88,6 +123,77 @@ class MsgEvict(BaseModel):
         populate_by_name = True
 
 
+class MsgBatch(BaseModel):
+    type: Literal["batch"] = Field(...)
+    uid: str = Field(...)
+    ops: List[dict] = Field(..., min_length=1, max_length=64) # query/store/process/evict/clear/count messages, uid optional
+    parallel: bool = Field(default=False)                     # run ops concurrently instead of in order
+
+    class Config:
+        populate_by_name = True
+
+
+class MsgExport(BaseModel):
+    type: Literal["export"] = Field(...)
+    uid: str = Field(...)
+    ai_name: str = Field(...)
+    from_: DataBases = Field(..., alias="from")
+    cursor: Optional[str] = Field(default=None)           # from a previous export page, resumes after it
+    page_size: int = Field(default=256, ge=1)             # clamped to transfer.max_page_size
+    max_pages: Optional[int] = Field(default=None, ge=1)  # stop after this many pages, None = until done
+    embeddings: bool = Field(default=False)               # include vectors (stm/ltm only)
+
+    class Config:
+        populate_by_name = True
+
+
+class MsgImport(BaseModel):
+    type: Literal["import"] = Field(...)
+    uid: str = Field(...)
+    ai_name: str = Field(...)
+    to: DataBases = Field(...)
+    memories: List[Memory] = Field(..., min_length=1)
+    embeddings: Optional[List[List[float]]] = Field(default=None) # one per memory, stored as-is without re-embedding
+
+    @field_validator("embeddings")
+    @classmethod
+    def _lens_match(cls, v, info):
+        mems = info.data.get("memories")
+        if v is not None and mems is not None and len(v) != len(mems):
+            raise ValueError("length of 'embeddings' must match length of 'memories'")
+        return v
+
+    class Config:
+        populate_by_name = True
+
+
+class MsgSnapshot(BaseModel):
+    type: Literal["snapshot"] = Field(...)
+    uid: str = Field(...)
+
+    class Config:
+        populate_by_name = True
+
+
+class MsgStats(BaseModel):
+    type: Literal["stats"] = Field(...)
+    uid: str = Field(...)
+
+    class Config:
+        populate_by_name = True
+
+
+class MsgProfile(BaseModel):
+    type: Literal["profile"] = Field(...)
+    uid: str = Field(...)
+    action: Literal["start", "stop", "status"] = Field(...)
+    scope: Optional[MessageTypes] = Field(default=None)      # only sample work done while handling this message type
+    duration: Optional[float] = Field(default=None, gt=0)   # seconds until the profile stops itself, capped by config
+
+    class Config:
+        populate_by_name = True
+
+
 class MsgClose(BaseModel):
     type: Literal["close"] = Field(...)
     uid: str = Field(...)
@@ -97,12 +203,19 @@ class MsgClose(BaseModel):
 
 def generate_schemas()-> None:
     models: list[tuple[MessageTypes, BaseModel]] = [
+        ("hello", MsgHello),
         ("query", MsgQuery),
         ("store", MsgStore),
         ("process", MsgProcess),
         ("evict", MsgEvict),
         ("clear", MsgClear),
         ("count", MsgCount),
+        ("batch", MsgBatch),
+        ("export", MsgExport),
+        ("import", MsgImport),
+        ("snapshot", MsgSnapshot),
+        ("stats", MsgStats),
+        ("profile", MsgProfile),
         ("close", MsgClose),
     ]
 
@@ -0,0 +1,311 @@
+import asyncio
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+
+# seconds, covers a cached lookup up to a slow LLM call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _fmt(value: float)-> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str)-> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_str(names: tuple[str, ...], values: tuple[str, ...], extra: str = "")-> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind: str = ""
+    name: str
+    help: str
+    labelnames: tuple[str, ...]
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ())-> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock() # vdb ops and embeddings are recorded from worker threads
+        return
+
+
+    def _key(self, labels: dict[str, str])-> tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[k]) for k in self.labelnames)
+
+
+    def _samples(self)-> dict[tuple[str, ...], float]:
+        return {}
+
+
+    def render(self)-> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._samples().items()):
+            lines.append(f"{self.name}{_labels_str(self.labelnames, key)} {_fmt(value)}")
+        return lines
+
+
+    def snapshot(self)-> dict:
+        return {",".join(key) or "": value for key, value in sorted(self._samples().items())}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ())-> None:
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+        return
+
+
+    def inc(self, amount: float = 1.0, **labels: str)-> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+    def _samples(self)-> dict[tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge(_Metric):
+    """Set directly, or computed on collection with set_function (returning
+    one value, or {label value tuple: value} when the gauge has labels)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ())-> None:
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._fn: Callable[[], float | dict[tuple[str, ...], float]] | None = None
+        return
+
+
+    def set(self, value: float, **labels: str)-> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+    def inc(self, amount: float = 1.0, **labels: str)-> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+    def dec(self, amount: float = 1.0, **labels: str)-> None:
+        self.inc(-amount, **labels)
+
+
+    def set_function(self, fn: Callable[[], float | dict[tuple[str, ...], float]])-> None:
+        self._fn = fn
+
+
+    def _samples(self)-> dict[tuple[str, ...], float]:
+        with self._lock:
+            values = dict(self._values)
+        if self._fn is not None:
+            computed = self._fn()
+            values.update(computed if isinstance(computed, dict) else {(): computed})
+        return values
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+    buckets: tuple[float, ...]
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS)-> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., +Inf count], sum
+        self._counts: dict[tuple[str, ...], list[int]] = {}
+        self._sums: dict[tuple[str, ...], float] = {}
+        return
+
+
+    def observe(self, value: float, **labels: str)-> None:
+        key = self._key(labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            counts[idx] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+
+    @contextmanager
+    def time(self, **labels: str)-> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+    def _collect(self)-> list[tuple[tuple[str, ...], list[int], float]]:
+        with self._lock:
+            return [(key, list(counts), self._sums[key]) for key, counts in sorted(self._counts.items())]
+
+
+    def render(self)-> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, counts, total in self._collect():
+            cumulative = 0
+            for bound, n in zip((*self.buckets, float("inf")), counts):
+                cumulative += n
+                le = 'le="' + _fmt(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels_str(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_str(self.labelnames, key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{_labels_str(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+    def snapshot(self)-> dict:
+        out = {}
+        for key, counts, total in self._collect():
+            n = sum(counts)
+            out[",".join(key)] = {
+                "count": n,
+                "sum_ms": round(total * 1_000, 3),
+                "avg_ms": round(total * 1_000 / n, 3) if n else 0.0,
+                "p50_ms": self._quantile_ms(counts, 0.5),
+                "p99_ms": self._quantile_ms(counts, 0.99),
+            }
+        return out
+
+
+    def _quantile_ms(self, counts: list[int], q: float)-> float | None:
+        """Upper bound of the bucket holding the quantile, None if it is past the last bucket."""
+        n = sum(counts)
+        if n == 0:
+            return None
+        rank = q * n
+        cumulative = 0
+        for bound, c in zip(self.buckets, counts):
+            cumulative += c
+            if cumulative >= rank:
+                return bound * 1_000
+        return None
+
+
+class Registry:
+    _metrics: dict[str, _Metric]
+
+    def __init__(self)-> None:
+        self._metrics = {}
+        self._lock = threading.Lock()
+        return
+
+
+    def _get_or_add(self, cls: type[_Metric], name: str, *args, **kwargs)-> _Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"metric {name} already registered as {metric.kind}")
+            return metric
+
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ())-> Counter:
+        return self._get_or_add(Counter, name, help, labelnames)
+
+
+    def gauge(self, name: str, help: str, labelnames: tuple[str, ...] = ())-> Gauge:
+        return self._get_or_add(Gauge, name, help, labelnames)
+
+
+    def histogram(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS)-> Histogram:
+        return self._get_or_add(Histogram, name, help, labelnames, buckets)
+
+
+    def render(self)-> str:
+        """Prometheus text exposition format."""
+        lines: list[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+    def snapshot(self)-> dict:
+        return {name: metric.snapshot() for name, metric in list(self._metrics.items())}
+
+
+REGISTRY = Registry()
+
+WS_MESSAGES = REGISTRY.counter("memento_ws_messages_total", "Handled websocket messages.", ("type", "status"))
+WS_REQUEST_SECONDS = REGISTRY.histogram("memento_ws_request_seconds", "Time from receiving a message until its handler finished.", ("type",))
+WS_CONNECTIONS = REGISTRY.gauge("memento_ws_connections", "Open websocket connections.")
+WS_IN_FLIGHT = REGISTRY.gauge("memento_ws_in_flight", "Requests being handled, over all connections.")
+VDB_OP_SECONDS = REGISTRY.histogram("memento_vdb_op_seconds", "Vector and user database operations.", ("tier", "op"))
+EMBED_SECONDS = REGISTRY.histogram("memento_embedding_seconds", "Embedding function calls.", ("tier",))
+EMBED_TEXTS = REGISTRY.counter("memento_embedding_texts_total", "Texts embedded.", ("tier",))
+EMBED_POOL_PENDING = REGISTRY.gauge("memento_embedding_pool_pending", "Embedding batches waiting for a worker process.")
+EMBED_POOL_RESTARTS = REGISTRY.counter("memento_embedding_pool_restarts_total", "Embedding worker processes replaced after a crash or timeout.")
+LLM_CALL_SECONDS = REGISTRY.histogram("memento_llm_call_seconds", "Single LLM requests, retries and hedges counted separately.", ("site", "outcome"))
+LLM_TOKENS = REGISTRY.counter("memento_llm_tokens_total", "Tokens reported by the LLM provider.", ("site", "kind"))
+QUEUE_DEPTH = REGISTRY.gauge("memento_queue_depth", "Items waiting per queue.", ("queue",))
+DECAY_RUNS = REGISTRY.counter("memento_decay_runs_total", "Long term memory decay runs.", ("status",))
+DECAY_SECONDS = REGISTRY.histogram("memento_decay_seconds", "Duration of decay runs.", buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0))
+QUERY_CACHE_LOOKUPS = REGISTRY.counter("memento_query_cache_lookups_total", "Query cache lookups: hit, miss, or shared with an identical query in flight.", ("tier", "outcome"))
+QUERY_CACHE_ENTRIES = REGISTRY.gauge("memento_query_cache_entries", "Cached query results.")
+LOG_RECORDS_DROPPED = REGISTRY.counter("memento_log_records_dropped_total", "Log records not written: sampled out, rate limited, or the writer queue was full.", ("reason",))
+LOOP_LAG_SECONDS = REGISTRY.histogram("memento_event_loop_lag_seconds", "How late the event loop woke up a periodic timer.",
+                                      buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+
+
+async def monitor_loop_lag(interval: float = 0.1)-> None:
+    """Anything blocking the event loop shows up as a late wake-up here."""
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - start - interval))
+    except asyncio.CancelledError:
+        return
+
+
+async def serve_metrics(host: str, port: int, registry: Registry = REGISTRY)-> asyncio.Server:
+    """Minimal HTTP listener answering every GET with the registry in Prometheus text format."""
+    logger = logging.getLogger("metrics")
+
+    async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter)-> None:
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5.0)
+            if request.startswith(b"GET "):
+                status, body = "200 OK", registry.render().encode("utf-8")
+            else:
+                status, body = "405 Method Not Allowed", b""
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode("ascii") + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(_handle, host=host, port=port)
+    logger.info("serving metrics on http://%s:%d/metrics", host, port)
+    return server
@@ -0,0 +1,236 @@
+import asyncio.events
+import concurrent.futures.thread
+import contextvars
+import functools
+import logging
+import marshal
+import os
+import re
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from types import FrameType
+
+from src.config import ProfilingConfig
+
+
+# message type the current task is handling, copied into asyncio.to_thread workers with the context
+message_type: ContextVar[str | None] = ContextVar("message_type", default=None)
+
+# the event loop runs every callback and task step through Handle._run, executors run
+# asyncio.to_thread's functools.partial(ctx.run, ...) through _WorkItem.run
+_HANDLE_RUN = asyncio.events.Handle._run.__code__
+_WORK_ITEM_RUN = concurrent.futures.thread._WorkItem.run.__code__
+
+# leaf frames of threads that are waiting rather than working
+_IDLE_LEAVES = {("selectors.py", "select"), ("threading.py", "wait"), ("thread.py", "_worker"), ("queue.py", "get")}
+
+_Func = tuple[str, int, str] # filename, first line, qualified name, same key pstats uses
+
+
+def _frame_context(frame: FrameType | None)-> contextvars.Context | None:
+    """Context a thread is currently running in, found by walking its stack."""
+    while frame is not None:
+        code = frame.f_code
+        if code is _HANDLE_RUN:
+            return getattr(frame.f_locals.get("self"), "_context", None)
+        if code is _WORK_ITEM_RUN:
+            fn = getattr(frame.f_locals.get("self"), "fn", None)
+            owner = getattr(fn.func, "__self__", None) if isinstance(fn, functools.partial) else None
+            return owner if isinstance(owner, contextvars.Context) else None
+        frame = frame.f_back
+    return None
+
+
+def _stack(frame: FrameType | None, max_depth: int)-> tuple[_Func, ...]:
+    """Root first."""
+    stack = []
+    while frame is not None and len(stack) < max_depth:
+        code = frame.f_code
+        stack.append((code.co_filename, code.co_firstlineno, code.co_qualname))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+def _short_path(path: str, cwd: str)-> str:
+    if path.startswith(cwd + os.sep):
+        return os.path.relpath(path, cwd)
+    return "/".join(path.replace(os.sep, "/").split("/")[-2:])
+
+
+def write_collapsed(samples: dict[tuple[str, tuple[_Func, ...]], int], path: str)-> None:
+    """One "thread;frame;...;leaf count" line per stack, as read by flamegraph.pl and speedscope."""
+    cwd = os.getcwd()
+    with open(path, "w", encoding="utf-8") as f:
+        for (thread, stack), n in sorted(samples.items(), key=lambda kv: -kv[1]):
+            frames = [thread] + [f"{name} ({_short_path(file, cwd)}:{line})" for file, line, name in stack]
+            f.write(";".join(x.replace(";", ":") for x in frames) + f" {n}\n")
+
+
+def write_pstats(samples: dict[tuple[str, tuple[_Func, ...]], int], interval: float, path: str)-> None:
+    """pstats file built from samples, readable by pstats.Stats, snakeviz and gprof2dot.
+    A "call" is one sample and times are samples * interval."""
+    stats: dict[_Func, list] = {}
+    for (_, stack), n in samples.items():
+        t = n * interval
+        seen: set[_Func] = set()
+        for i, func in enumerate(stack):
+            entry = stats.setdefault(func, [0, 0, 0.0, 0.0, {}])
+            leaf = i == len(stack) - 1
+            if func not in seen: # recursion counts once per sample
+                seen.add(func)
+                entry[0] += n
+                entry[1] += n
+                entry[3] += t
+            if leaf:
+                entry[2] += t
+            if i > 0:
+                cc, nc, tt, ct = entry[4].get(stack[i - 1], (0, 0, 0.0, 0.0))
+                entry[4][stack[i - 1]] = (cc + n, nc + n, tt + (t if leaf else 0.0), ct + t)
+
+    with open(path, "wb") as f:
+        marshal.dump({func: tuple(entry) for func, entry in stats.items()}, f)
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads, asyncio.to_thread workers included, from its own
+    thread. Nothing is hooked into the interpreter, so a stopped profiler costs nothing."""
+    last_result: dict | None
+
+    def __init__(self)-> None:
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._samples: dict[tuple[str, tuple[_Func, ...]], int] = {}
+        self._ticks = 0
+        self._count = 0 # samples so far, _samples is only read once the sampler thread is done
+        self._started = 0.0
+        self._conf = ProfilingConfig()
+        self._scope: str | None = None
+        self._deadline: float | None = None
+        self.last_result = None
+        return
+
+
+    @property
+    def running(self)-> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+
+    def start(self, conf: ProfilingConfig, scope: str | None = None, duration: float | None = None)-> dict:
+        """Profiles until stop(), or for duration seconds. With a scope only work done
+        while handling that message type is sampled."""
+        with self._lock:
+            if self.running:
+                raise RuntimeError("a profile is already running")
+            self._conf = conf
+            self._scope = scope
+            self._samples = {}
+            self._ticks = 0
+            self._count = 0
+            self._started = time.monotonic()
+            self._deadline = self._started + duration if duration else None
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+        self.logger.info("profiling started: scope=%s duration=%s interval_ms=%s", scope, duration, conf.interval_ms)
+        return self.status()
+
+
+    def stop(self)-> dict | None:
+        """Stops a running profile and returns where it was written, or the last result when none runs."""
+        with self._lock:
+            thread = self._thread
+        if thread is None:
+            return self.last_result
+        self._stop.set()
+        thread.join()
+        with self._lock:
+            if self._thread is thread:
+                self._thread = None
+                self._started = 0.0
+        return self.last_result
+
+
+    def status(self)-> dict:
+        return {
+            "running": self.running,
+            "scope": self._scope,
+            "samples": self._count,
+            "elapsed": round(time.monotonic() - self._started, 3) if self.running else 0.0,
+            "last": self.last_result,
+        }
+
+
+    def _run(self)-> None:
+        own = threading.get_ident()
+        interval = self._conf.interval_ms / 1_000
+        while not self._stop.wait(interval):
+            if self._deadline is not None and time.monotonic() >= self._deadline:
+                break
+            self._sample(own)
+
+        try:
+            self.last_result = self._write()
+        except Exception:
+            self.logger.exception("failed to write profile")
+        return
+
+
+    def _sample(self, own: int)-> None:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            if self._scope is not None:
+                ctx = _frame_context(frame)
+                if ctx is None or ctx.get(message_type) != self._scope:
+                    continue
+            stack = _stack(frame, self._conf.max_depth)
+            if not stack:
+                continue
+            if not self._conf.include_idle:
+                file, _, name = stack[-1]
+                if (os.path.basename(file), name.rsplit(".", 1)[-1]) in _IDLE_LEAVES:
+                    continue
+            key = (names.get(ident, f"thread-{ident}"), stack)
+            self._samples[key] = self._samples.get(key, 0) + 1
+            self._count += 1
+        self._ticks += 1
+
+
+    def _write(self)-> dict:
+        os.makedirs(self._conf.dir, exist_ok=True)
+        now = time.time()
+        stem = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now * 1_000) % 1_000:03d}"
+        if self._scope:
+            stem += "-" + re.sub(r"[^\w-]", "_", self._scope)
+        stem = os.path.join(self._conf.dir, stem)
+
+        duration = time.monotonic() - self._started
+        # ticks come slower than interval_ms while busy threads hold the GIL
+        tick = duration / self._ticks if self._ticks else self._conf.interval_ms / 1_000
+
+        files = []
+        if "collapsed" in self._conf.formats:
+            write_collapsed(self._samples, stem + ".collapsed")
+            files.append(stem + ".collapsed")
+        if "pstats" in self._conf.formats:
+            write_pstats(self._samples, tick, stem + ".pstats")
+            files.append(stem + ".pstats")
+
+        result = {
+            "scope": self._scope,
+            "duration": round(duration, 3),
+            "ticks": self._ticks,
+            "samples": self._count,
+            "files": files,
+        }
+        self.logger.info("profile written: %s", result)
+        return result
+
+
+PROFILER = SamplingProfiler()
@@ -0,0 +1,72 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from src.config import QueryCacheConfig
+from src import metrics
+
+
+class QueryCache:
+    """Query results per (tier, key), valid while the collection's write generation
+    is unchanged. Identical queries in flight share one lookup."""
+    enabled: bool
+    ttl: float
+    max_entries: int
+
+    def __init__(self, config: QueryCacheConfig)-> None:
+        self.enabled = config.enabled and config.max_entries > 0
+        self.ttl = config.ttl
+        self.max_entries = config.max_entries
+        # (tier, *key) -> (generation, expires at, result)
+        self._entries: OrderedDict[tuple, tuple[int, float, Any]] = OrderedDict()
+        self._in_flight: dict[tuple, asyncio.Task] = {}
+        metrics.QUERY_CACHE_ENTRIES.set_function(lambda: float(len(self._entries)))
+        return
+
+
+    async def get(self, tier: str, key: tuple, generation: int, lookup: Callable[[], Awaitable[Any]])-> Any:
+        """generation must be read before the lookup starts: a write that lands
+        while it runs changes it, so the result is never served afterwards."""
+        full_key = (tier, *key)
+
+        if self.enabled:
+            entry = self._entries.get(full_key)
+            if entry is not None:
+                gen, expires, result = entry
+                if gen == generation and time.monotonic() < expires:
+                    self._entries.move_to_end(full_key)
+                    metrics.QUERY_CACHE_LOOKUPS.inc(tier=tier, outcome="hit")
+                    return result
+                del self._entries[full_key]
+
+        flight_key = (full_key, generation)
+        task = self._in_flight.get(flight_key)
+        if task is not None:
+            metrics.QUERY_CACHE_LOOKUPS.inc(tier=tier, outcome="shared")
+        else:
+            metrics.QUERY_CACHE_LOOKUPS.inc(tier=tier, outcome="miss")
+            task = asyncio.ensure_future(lookup())
+            self._in_flight[flight_key] = task
+            task.add_done_callback(lambda t: self._on_done(t, full_key, flight_key, generation))
+
+        # one caller going away (e.g. its connection closed) must not cancel the others
+        return await asyncio.shield(task)
+
+
+    def _on_done(self, task: asyncio.Task, full_key: tuple, flight_key: tuple, generation: int)-> None:
+        self._in_flight.pop(flight_key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        if not self.enabled:
+            return
+
+        current = self._entries.get(full_key)
+        if current is not None and current[0] > generation:
+            return # a lookup started after a later write already finished
+
+        expires = time.monotonic() + self.ttl if self.ttl > 0 else float("inf")
+        self._entries[full_key] = (generation, expires, task.result())
+        self._entries.move_to_end(full_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,70 @@
+import time
+
+import numpy as np
+
+from src.memory import QueriedMemory
+from src.messages import RankSpec
+
+
+def relevance(candidates: list[QueriedMemory], spec: RankSpec, now_ms: int)-> np.ndarray:
+    """Weighted sum of per-candidate signals, each scaled to [0, 1]."""
+    k = len(candidates)
+    distance = np.fromiter((c.distance for c in candidates), dtype=np.float64, count=k)
+    score = np.fromiter((c.memory.score or 0.0 for c in candidates), dtype=np.float64, count=k)
+    age_s = np.fromiter(((now_ms - c.memory.time) / 1_000 for c in candidates), dtype=np.float64, count=k)
+    lifetime = np.fromiter((c.memory.lifetime or 0 for c in candidates), dtype=np.float64, count=k)
+
+    span = distance.max() - distance.min()
+    similarity = 1.0 - (distance - distance.min()) / span if span > 0.0 else np.ones(k)
+    recency = 0.5 ** (np.maximum(age_s, 0.0) / spec.half_life)
+    longest = lifetime.max()
+    remaining = lifetime / longest if longest > 0.0 else np.zeros(k)
+
+    return spec.distance * similarity + spec.score * np.clip(score, 0.0, 1.0) + spec.recency * recency + spec.lifetime * remaining
+
+
+def mmr(rel: np.ndarray, embeddings: np.ndarray, lam: float, n: int)-> list[int]:
+    """Greedy maximal marginal relevance: each pick trades relevance against cosine
+    similarity to what was already picked."""
+    span = rel.max() - rel.min()
+    rel = (rel - rel.min()) / span if span > 0.0 else np.ones_like(rel)
+
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = embeddings / np.where(norms == 0.0, 1.0, norms)
+    sim = unit @ unit.T
+
+    picked = [int(np.argmax(rel))]
+    closest = sim[picked[0]].copy()
+    available = np.ones(len(rel), dtype=bool)
+    available[picked[0]] = False
+    while len(picked) < n and available.any():
+        gain = np.where(available, lam * rel - (1.0 - lam) * closest, -np.inf)
+        i = int(np.argmax(gain))
+        picked.append(i)
+        available[i] = False
+        np.maximum(closest, sim[i], out=closest)
+    return picked
+
+
+def rerank(candidates: list[QueriedMemory], spec: RankSpec, n: int, now_ms: int | None = None)-> list[QueriedMemory]:
+    """Top n candidates by spec, MMR is skipped when a candidate came without its embedding."""
+    if not candidates:
+        return []
+    now_ms = now_ms if now_ms is not None else int(time.time() * 1_000)
+    rel = relevance(candidates, spec, now_ms)
+
+    if spec.mmr is not None and all(c.embedding is not None for c in candidates):
+        order = mmr(rel, np.asarray([c.embedding for c in candidates], dtype=np.float32), spec.mmr, n)
+    else:
+        order = np.argsort(-rel, kind="stable")[:n].tolist()
+    return [candidates[i] for i in order]
+
+
+def dedup_across(per_query: list[list[QueriedMemory]])-> list[list[QueriedMemory]]:
+    """Keeps each memory only in the result list where it sits highest, the earlier query on ties."""
+    best: dict[str, tuple[int, int]] = {}
+    for q, found in enumerate(per_query):
+        for pos, c in enumerate(found):
+            if c.memory.id not in best or pos < best[c.memory.id][1]:
+                best[c.memory.id] = (q, pos)
+    return [[c for pos, c in enumerate(found) if best[c.memory.id] == (q, pos)] for q, found in enumerate(per_query)]
@@ -1,7 +1,13 @@
 import asyncio
+import email.utils
 import logging
+import random
+import time
 import traceback
-from typing import Callable, Coroutine
+from contextlib import nullcontext
+from typing import AsyncContextManager, Callable, Coroutine
+
+import openai
 
 
 def with_retry(fn: Callable, *args, max_retries: int = 5, **kwargs):
@@ -28,17 +34,205 @@ async def with_retry_async(cr: Callable[[], Coroutine], *args, max_retries: int
             tries += 1
 
 
-async def with_retry_and_timeout_async(cr: Callable[[], Coroutine], *args, max_retries: int = 5, timeout_each: float = 5.0, **kwargs):
+class CircuitOpenError(Exception):
+    pass
+
+
+class RetryPolicy:
+    """Per-call-site retry settings: attempt count, per-attempt timeout and
+    exponential backoff with full jitter."""
+    max_retries: int
+    timeout_each: float
+    backoff_base: float
+    backoff_max: float
+
+    def __init__(self, max_retries: int = 5, timeout_each: float = 5.0, backoff_base: float = 1.0, backoff_max: float = 30.0)-> None:
+        self.max_retries = max(1, int(max_retries))
+        self.timeout_each = timeout_each
+        self.backoff_base = max(0.0, backoff_base)
+        self.backoff_max = max(0.0, backoff_max)
+        return
+
+
+    def backoff(self, attempt: int, retry_after: float | None = None)-> float | None:
+        """Delay before the attempt following `attempt` (1-based), None when the server
+        asks for a longer wait than backoff_max and the call should not be retried."""
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        delay = random.uniform(0.0, ceiling)
+        if retry_after is not None:
+            if retry_after > self.backoff_max:
+                return None
+            # the server knows better than our jitter
+            delay = max(delay, retry_after)
+        return delay
+
+
+    def is_retryable(self, e: BaseException)-> bool:
+        if isinstance(e, (TimeoutError, ConnectionError, openai.APIConnectionError)):
+            return True
+        if isinstance(e, (openai.LengthFinishReasonError, openai.ContentFilterFinishReasonError)):
+            return False
+        if isinstance(e, openai.APIStatusError):
+            return e.status_code in (408, 409, 425, 429) or e.status_code >= 500
+        # covers pydantic ValidationError, json errors and bad arguments
+        if isinstance(e, (ValueError, TypeError, KeyError, AssertionError)):
+            return False
+        return True
+
+
+def get_retry_after(e: BaseException)-> float | None:
+    """Seconds requested by the server through Retry-After(-Ms) headers, if any."""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is None:
+        return None
+
+    retry_ms = headers.get("retry-after-ms")
+    if retry_ms is not None:
+        try:
+            return max(0.0, float(retry_ms) / 1_000.0)
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(retry_after)
+        return max(0.0, when.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive retryable failures and fails
+    fast for `reset_after` seconds, then lets a single probe through (half-open)."""
+    failure_threshold: int
+    reset_after: float
+    logger: logging.Logger
+
+    def __init__(self, failure_threshold: int = 5, reset_after: float = 30.0, name: str = "llm")-> None:
+        self.logger = logging.getLogger(f"{self.__class__.__name__}({name})")
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_after = reset_after
+
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+        return
+
+
+    @property
+    def state(self)-> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_after:
+            return "half_open"
+        return "open"
+
+
+    def before_call(self)-> None:
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            self.logger.info("half-open, letting a probe request through")
+            return
+        raise CircuitOpenError(f"circuit open after {self._failures} consecutive failures")
+
+
+    def record_success(self)-> None:
+        if self._opened_at is not None:
+            self.logger.info("probe succeeded, circuit closed")
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+
+    def record_failure(self)-> None:
+        self._failures += 1
+        if self._probing:
+            # failed probe, stay open for another period
+            self._probing = False
+            self._opened_at = time.monotonic()
+            self.logger.warning("probe failed, circuit re-opened for %.1fs", self.reset_after)
+        elif self._opened_at is None and self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            self.logger.warning("%d consecutive failures, circuit opened for %.1fs", self._failures, self.reset_after)
+
+
+    def release_probe(self)-> None:
+        """Called when a probe ended without telling us anything about the backend."""
+        self._probing = False
+
+
+async def with_retry_and_timeout_async(
+    cr: Callable[[], Coroutine],
+    *args,
+    max_retries: int = 5,
+    timeout_each: float = 5.0,
+    policy: RetryPolicy | None = None,
+    breaker: CircuitBreaker | None = None,
+    gate: Callable[[], AsyncContextManager] | None = None,
+    **kwargs
+):
+    """Returns the result of `cr`, or None when all attempts failed, a fatal
+    error occured, or the circuit breaker is open."""
     logger = logging.getLogger("with_retry_and_timeout_async")
-    tries = 1
+    if policy is None:
+        policy = RetryPolicy(max_retries=max_retries, timeout_each=timeout_each)
 
-    while tries <= max_retries:
+    for attempt in range(1, policy.max_retries + 1):
+        if breaker is not None:
+            try:
+                breaker.before_call()
+            except CircuitOpenError as e:
+                logger.warning("failing fast: %s", e)
+                return None
+
+        retry_after: float | None = None
         try:
-            async with asyncio.timeout(timeout_each):
-                return await cr(*args, **kwargs)
-        except (asyncio.TimeoutError, asyncio.CancelledError):
-            logger.warning("retried on coroutine timeout:\n%s", traceback.format_exc())
+            # gate is entered before the timeout starts, time spent queued does not count
+            async with (gate() if gate is not None else nullcontext()):
+                async with asyncio.timeout(policy.timeout_each):
+                    result = await cr(*args, **kwargs)
+            if breaker is not None:
+                breaker.record_success()
+            return result
+
+        except asyncio.CancelledError:
+            if breaker is not None:
+                breaker.release_probe()
+            raise
+
         except Exception as e:
-            logger.warning("retried on coroutine exception:\n%s", traceback.format_exc())
-        finally:
-            tries += 1
+            retryable = policy.is_retryable(e)
+            if breaker is not None:
+                if retryable:
+                    breaker.record_failure()
+                else:
+                    breaker.release_probe()
+
+            logger.warning("attempt %d/%d failed (%s): %s: %s",
+                           attempt, policy.max_retries, "retryable" if retryable else "fatal", type(e).__name__, e)
+            logger.debug("attempt %d traceback:\n%s", attempt, traceback.format_exc())
+
+            if not retryable:
+                return None
+            retry_after = get_retry_after(e)
+
+        if attempt < policy.max_retries:
+            delay = policy.backoff(attempt, retry_after)
+            if delay is None:
+                logger.error("giving up, server asked to retry after %.1fs (backoff_max %.1fs)", retry_after, policy.backoff_max)
+                return None
+            logger.info("retrying in %.2fs", delay)
+            await asyncio.sleep(delay)
+
+    logger.error("giving up after %d attempts", policy.max_retries)
+    return None
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import uuid
+from typing import Coroutine
+
+from websockets.asyncio.server import ServerConnection
+
+from src.wire import WireSession
+
+
+class _Lane:
+    """Requests of one session on one collection that later ones may have to wait for."""
+
+    def __init__(self)-> None:
+        self.write: asyncio.Task | None = None
+        self.reads: set[asyncio.Task] = set() # started since the last write
+        return
+
+
+class Session:
+    """Everything one client connection owns. Closing it cancels only its own requests,
+    work that has to outlive it is handed to the server before it starts."""
+    id: str
+    conn: ServerConnection
+    wire: WireSession
+    send_lock: asyncio.Lock
+    send_errors: int                        # consecutive, reset by every successful send
+    in_flight: dict[str, asyncio.Task]      # uid -> request running in the background
+    closed: bool
+    logger: logging.Logger
+
+    def __init__(self, conn: ServerConnection, max_in_flight: int = 64)-> None:
+        self.id = uuid.uuid4().hex[:8]
+        self.conn = conn
+        self.wire = WireSession()
+        self.send_lock = asyncio.Lock()
+        self.send_errors = 0
+        self.in_flight = {}
+        self.closed = False
+        self._tasks: set[asyncio.Task] = set()
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._lanes: dict[str, _Lane] = {}
+        self.logger = logging.getLogger(f"{self.__class__.__name__}({self.id})")
+        return
+
+
+    @property
+    def running(self)-> int:
+        return len(self._tasks)
+
+
+    async def spawn(self, cr: Coroutine, uid: str | None = None, colls: tuple[str, ...] = (), write: bool = False)-> asyncio.Task:
+        """Runs a request in the background, cancelled when the session closes. Waits while
+        max_in_flight requests are running. On each of colls a write starts after every
+        earlier request, a read only after earlier writes."""
+        try:
+            await self._slots.acquire()
+        except asyncio.CancelledError:
+            cr.close()
+            raise
+
+        after: set[asyncio.Task] = set()
+        for coll in colls:
+            lane = self._lanes.get(coll)
+            if lane is None:
+                continue
+            if lane.write is not None:
+                after.add(lane.write)
+            if write:
+                after.update(lane.reads)
+
+        task = asyncio.create_task(self._run_after(after, cr))
+        self._tasks.add(task)
+        if uid is not None:
+            self.in_flight[uid] = task
+        for coll in colls:
+            lane = self._lanes.setdefault(coll, _Lane())
+            if write:
+                lane.write = task
+                lane.reads = set()
+            else:
+                lane.reads.add(task)
+        task.add_done_callback(lambda t: self._forget(t, cr, uid, colls))
+        return task
+
+
+    @staticmethod
+    async def _run_after(after: set[asyncio.Task], cr: Coroutine)-> None:
+        try:
+            if after:
+                await asyncio.wait(after) # failed or cancelled predecessors count as done
+        except asyncio.CancelledError:
+            cr.close()
+            raise
+        await cr
+
+
+    def _forget(self, task: asyncio.Task, cr: Coroutine, uid: str | None, colls: tuple[str, ...])-> None:
+        # a task cancelled before its first step never reached _run_after, nothing else closes cr
+        cr.close()
+        self._slots.release()
+        self._tasks.discard(task)
+        if uid is not None and self.in_flight.get(uid) is task:
+            del self.in_flight[uid]
+        for coll in colls:
+            lane = self._lanes.get(coll)
+            if lane is None:
+                continue
+            if lane.write is task:
+                lane.write = None
+            lane.reads.discard(task)
+            if lane.write is None and not lane.reads:
+                del self._lanes[coll]
+
+
+    async def close(self)-> None:
+        if self.closed:
+            return
+        self.closed = True
+        tasks = list(self._tasks)
+        if tasks:
+            self.logger.info("cancelling %d request(s): %s", len(tasks), ", ".join(self.in_flight) or "-")
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return
@@ -0,0 +1,268 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from websockets.asyncio.client import connect
+from websockets.exceptions import WebSocketException
+
+from src.config import SnapshotConfig
+
+
+# all on-disk state, relative to the working directory
+STATE_DIRS = ("vectors", "users", "decay_meta", "jobs")
+
+_MANIFEST = "manifest.json"
+_SQLITE_SIDE_FILES = ("-wal", "-shm", "-journal")
+_FICLONE = 0x40049409 # linux ioctl, copy-on-write clone on btrfs/xfs
+
+
+class WriteGate:
+    """Lets a snapshot quiesce writers without touching readers.
+
+    Writes done synchronously on the event loop only need `await opened()` right
+    before them: nothing else runs on the loop until they are done. Writes that
+    span awaits or threads hold `writing()` instead."""
+
+    def __init__(self)-> None:
+        self._frozen = False
+        self._writers = 0
+        self._cond = asyncio.Condition()
+        return
+
+
+    async def opened(self)-> None:
+        if not self._frozen:
+            return
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._frozen)
+
+
+    @asynccontextmanager
+    async def writing(self)-> AsyncIterator[None]:
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._frozen)
+            self._writers += 1
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._writers -= 1
+                self._cond.notify_all()
+
+
+    @asynccontextmanager
+    async def frozen(self)-> AsyncIterator[None]:
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._frozen)
+            self._frozen = True
+            await self._cond.wait_for(lambda: self._writers == 0)
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._frozen = False
+                self._cond.notify_all()
+
+
+def _clone_or_copy(src: str, dst: str)-> None:
+    try:
+        import fcntl
+        with open(src, "rb") as fs, open(dst, "wb") as fd:
+            fcntl.ioctl(fd.fileno(), _FICLONE, fs.fileno())
+        return
+    except (ImportError, OSError):
+        pass
+    shutil.copyfile(src, dst)
+
+
+def _backup_sqlite(src: str, dst: str)-> None:
+    # consistent even if another connection is mid-write, includes the WAL content
+    source = sqlite3.connect(src)
+    dest = sqlite3.connect(dst)
+    try:
+        source.backup(dest)
+    finally:
+        dest.close()
+        source.close()
+
+
+def _list_snapshots(root: str)-> list[str]:
+    if not os.path.isdir(root):
+        return []
+    return sorted(x for x in os.listdir(root) if not x.startswith(".") and os.path.isfile(os.path.join(root, x, _MANIFEST)))
+
+
+def _load_manifest(root: str, snap_id: str)-> dict:
+    with open(os.path.join(root, snap_id, _MANIFEST), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class Snapshotter:
+    """Point-in-time copies of STATE_DIRS under conf.dir/<id>/, one gzip per file.
+    Files unchanged since the previous snapshot are hardlinked from it, so every
+    snapshot is complete on its own while only changed files take new space."""
+    conf: SnapshotConfig
+    logger: logging.Logger
+
+    def __init__(self, config: SnapshotConfig)-> None:
+        self.conf = config
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self._lock = asyncio.Lock()
+        return
+
+
+    def _capture(self, staging: str, prev: dict)-> tuple[dict, list[str]]:
+        """Copies files whose stat differs from prev to staging. Runs once while writes go on,
+        then again frozen against that first pass, so only what changed in between is copied frozen."""
+        files: dict[str, dict] = {}
+        changed: list[str] = []
+
+        for state_dir in STATE_DIRS:
+            for dirpath, _, filenames in os.walk(state_dir):
+                for name in filenames:
+                    if name.endswith(_SQLITE_SIDE_FILES):
+                        continue
+                    rel = os.path.join(dirpath, name)
+                    st = os.stat(rel)
+                    entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+                    # in WAL mode, commits may only touch the -wal file
+                    if os.path.isfile(rel + "-wal"):
+                        wal = os.stat(rel + "-wal")
+                        entry["wal"] = [wal.st_size, wal.st_mtime_ns]
+                    files[rel] = entry
+
+                    if prev.get(rel) == entry:
+                        continue
+
+                    dst = os.path.join(staging, rel)
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    if name.endswith(".sqlite3"):
+                        _backup_sqlite(rel, dst)
+                    else:
+                        _clone_or_copy(rel, dst)
+                    changed.append(rel)
+        return files, changed
+
+
+    def _store(self, staging: str, target: str, prev_dir: str | None, files: dict, changed: list[str])-> int:
+        """Runs after writes resumed: compresses changed files, links the others. Returns bytes written."""
+        written = 0
+        changed_set = set(changed)
+        for rel in files:
+            dst = os.path.join(target, "files", rel + ".gz")
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+
+            if rel not in changed_set:
+                src = os.path.join(prev_dir, "files", rel + ".gz")
+                try:
+                    os.link(src, dst)
+                except OSError:
+                    shutil.copyfile(src, dst)
+                continue
+
+            with open(os.path.join(staging, rel), "rb") as fs, gzip.open(dst, "wb", compresslevel=self.conf.compress_level) as fd:
+                shutil.copyfileobj(fs, fd, length=1024 * 1024)
+            written += os.path.getsize(dst)
+        return written
+
+
+    def _prune(self)-> None:
+        snaps = _list_snapshots(self.conf.dir)
+        for snap_id in snaps[:max(0, len(snaps) - self.conf.keep)]:
+            shutil.rmtree(os.path.join(self.conf.dir, snap_id), ignore_errors=True)
+            self.logger.info("removed old snapshot %s", snap_id)
+
+
+    async def take(self, gate: WriteGate | None = None)-> dict:
+        """Snapshots all state. With a gate, writes are frozen only while changed
+        files are copied, compression happens afterwards. Reads are never blocked."""
+        async with self._lock:
+            start = time.monotonic()
+            snap_id = time.strftime("%Y%m%d-%H%M%S", time.gmtime()) + f"-{int(time.time() * 1000) % 1000:03d}"
+            staging = os.path.join(self.conf.dir, f".staging-{snap_id}")
+            target = os.path.join(self.conf.dir, f".tmp-{snap_id}")
+
+            previous = _list_snapshots(self.conf.dir)
+            prev_dir = os.path.join(self.conf.dir, previous[-1]) if previous else None
+            prev_files = _load_manifest(self.conf.dir, previous[-1])["files"] if previous else {}
+
+            os.makedirs(staging, exist_ok=True)
+            try:
+                if gate is not None:
+                    # bulk of the copying while writes go on, may be torn across files
+                    staged, changed = await asyncio.to_thread(self._capture, staging, prev_files)
+                    # includes waiting for in-flight writers, new ones are held from the start
+                    quiesce_start = time.monotonic()
+                    async with gate.frozen():
+                        files, recopied = await asyncio.to_thread(self._capture, staging, staged)
+                    quiesce_ms = int((time.monotonic() - quiesce_start) * 1_000)
+                    changed = [rel for rel in changed if rel in files] + [rel for rel in recopied if rel not in changed]
+                else:
+                    quiesce_start = time.monotonic()
+                    files, changed = await asyncio.to_thread(self._capture, staging, prev_files)
+                    quiesce_ms = int((time.monotonic() - quiesce_start) * 1_000)
+
+                written = await asyncio.to_thread(self._store, staging, target, prev_dir, files, changed)
+
+                manifest = {
+                    "id": snap_id,
+                    "created": int(time.time() * 1000),
+                    "parent": previous[-1] if previous else None,
+                    "files": files,
+                    "changed": changed,
+                }
+                with open(os.path.join(target, _MANIFEST), "w", encoding="utf-8") as f:
+                    json.dump(manifest, f, indent=4)
+                os.rename(target, os.path.join(self.conf.dir, snap_id))
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+                shutil.rmtree(target, ignore_errors=True)
+
+            await asyncio.to_thread(self._prune)
+
+            result = {
+                "id": snap_id,
+                "files": len(files),
+                "changed": len(changed),
+                "bytes_written": written,
+                "quiesce_ms": quiesce_ms,
+                "elapsed_ms": int((time.monotonic() - start) * 1_000),
+            }
+            self.logger.info("snapshot %s: files=%d changed=%d written=%dB quiesce=%dms elapsed=%dms",
+                             snap_id, len(files), len(changed), written, quiesce_ms, result["elapsed_ms"])
+            return result
+
+
+async def snapshot_from_cli(config: SnapshotConfig, host: str, port: int)-> dict | None:
+    """--snapshot: a running server takes the snapshot itself, between its own writes.
+    The files are only copied from this process when no server is listening. None when
+    talking to the server failed in any other way."""
+    logger = logging.getLogger("snapshot")
+    try:
+        async with connect(f"ws://{host}:{port}", open_timeout=10) as ws:
+            uid = str(uuid.uuid4())
+            await ws.send(json.dumps({"type": "snapshot", "uid": uid}))
+            while True:
+                obj = json.loads(await ws.recv())
+                if obj.get("uid") != uid:
+                    continue
+                if obj.get("type") == "error":
+                    raise RuntimeError(f"server failed to take snapshot: {obj.get('error')}")
+                logger.info("snapshot taken by the running server")
+                return obj
+    except ConnectionRefusedError:
+        logger.info("no server running on %s:%d, taking snapshot from this process", host, port)
+    except (OSError, WebSocketException) as e:
+        # a server may be there (timed out, reset mid-snapshot, refused the handshake),
+        # copying its files from here would not be consistent
+        logger.error("snapshot through the server on %s:%d failed, none taken: %s: %s", host, port, type(e).__name__, e)
+        return None
+    return await Snapshotter(config).take()
@@ -1,14 +1,16 @@
+import asyncio
 import uuid
 import logging
-from typing import List
+from typing import Callable, List
 from pydantic import BaseModel, Field
 
 from src.messages import OpenLlmMsg
 from src.ai import AI
 from src.config import Config
+from src.dedup import Deduper
 from src.memory import Memory
+from src.snapshot import WriteGate
 from src.vdbs.vector_database import VectorDataBase
-from src.retry_and_timeout import with_retry_and_timeout_async
 
 
 class _MergeOut(BaseModel):
@@ -17,10 +19,12 @@ class _MergeOut(BaseModel):
 
 
 class StmMerger:
-    def __init__(self, ai: AI, vdb: VectorDataBase, config: Config):
+    def __init__(self, ai: AI, vdb: VectorDataBase, config: Config, gate: WriteGate | None = None):
         self.ai = ai
         self.vdb = vdb
         self.conf = config
+        self.gate = gate
+        self.deduper = Deduper(config.stm_dedup)
         self.log = logging.getLogger(self.__class__.__name__)
 
 
@@ -56,12 +60,34 @@ class StmMerger:
         ]
 
 
-    async def merge_and_store(self, ai_name: str, new_mem: Memory, context: List[OpenLlmMsg]) -> None:
+    async def _write(self, fn: Callable[..., None], *args)-> None:
+        """STM writes embed their texts and can evict, which commits compression jobs, so they run on a worker thread."""
+        if self.gate is None:
+            await asyncio.to_thread(fn, *args)
+            return
+        async with self.gate.writing():
+            await asyncio.to_thread(fn, *args)
+
+
+    def _apply_merge(self, ai_name: str, delete_ids: List[str], final_mem: Memory)-> None:
+        for mem_id in delete_ids:
+            try:
+                self.vdb.remove(ai_name, mem_id)
+                self.log.info("STM-MERGE deleted obsolete mem id=%s", mem_id)
+            except Exception as e:
+                self.log.warning("STM-MERGE delete failed: id=%s err=%s", mem_id, e)
+        self.vdb.store(ai_name, final_mem)
+
+
+    async def merge_and_store(self, ai_name: str, new_mem: Memory, context: List[OpenLlmMsg]) -> bool:
+        """Returns False if new_mem was dropped as a duplicate of an existing STM memory."""
         self.log.debug("STM-MERGE start: new_mem=%s", new_mem.content)
+        if self.gate is not None:
+            await self.gate.opened()
 
         # 1) find similar STM neighbors
         k = max(1, int(self.conf.stm_merge.similar_top_k))
-        neighbors = self.vdb.query(coll_name=ai_name, query_str=new_mem.content, n=k)
+        neighbors = await asyncio.to_thread(self.vdb.query, coll_name=ai_name, query_str=new_mem.content, n=k) # embeds the text
         existing = [qm.memory for qm in neighbors]
 
         self.log.info("STM-MERGE searching for similar mems: k=%s found=%s", k, len(existing))
@@ -69,10 +95,16 @@ class StmMerger:
         # 2) if nothing else in stm, just store
         if not existing:
             self.log.info("STM-MERGE no similar found, storing new_mem id=%s", new_mem.id)
-            self.vdb.store(ai_name, new_mem)
-            return
+            await self._write(self.vdb.store, ai_name, new_mem)
+            return True
+
+        # 3) duplicates of what is already in STM are dropped without asking the model
+        dup = self.deduper.find_duplicate(new_mem, neighbors)
+        if dup is not None:
+            self.log.info("STM-MERGE dropped duplicate of id=%s dist=%.4f: '%s...'", dup.memory.id, dup.distance, new_mem.content[:80])
+            return False
 
-        # 3) ask the model to merge
+        # 4) ask the model to merge
         merge_msgs = self._build_merge_prompt(
             ai_name=ai_name,
             new_text=new_mem.content,
@@ -85,35 +117,23 @@ class StmMerger:
 
         self.log.debug("STM-MERGE sending merge prompt to model. new_mem.id=%s", new_mem.id)
 
-        maybe_comp = await with_retry_and_timeout_async(
-            cr=self.ai.client.beta.chat.completions.parse,
-            model=self.ai.model_name,
+        maybe_comp = await self.ai.parse(
+            call_site="stm_merge",
             messages=merge_msgs,
             temperature=self.conf.openllm.temp,
             max_completion_tokens=self.conf.openllm.max_completion_tokens,
             response_format=_MergeOut,
-            timeout=65.0,
-            max_retries=5,
-            timeout_each=60.0,
         )
-
         if maybe_comp is None:
             self.log.warning("STM-MERGE model call failed, storing new_mem id=%s as-is", new_mem.id)
-            self.vdb.store(ai_name, new_mem)
-            return
+            await self._write(self.vdb.store, ai_name, new_mem)
+            return True
 
         merged: _MergeOut = maybe_comp.choices[0].message.parsed
         self.log.info("STM-MERGE result: new_text='%s...' delete_ids=%s", merged.new_text[:80], merged.delete_ids)
 
-        # 4) delete any obsolete memories from STM
-        for mem_id in (merged.delete_ids or []):
-            try:
-                self.vdb.remove(ai_name, mem_id)
-                self.log.info("STM-MERGE deleted obsolete mem id=%s", mem_id)
-            except Exception as e:
-                self.log.warning("STM-MERGE delete failed: id=%s err=%s", mem_id, e)
-
-        # 5) store merged text as a new STM memory (keep new memories metadata)
+        # 5) delete any obsolete memories from STM, 6) store merged text as a new
+        # STM memory (keep new memories metadata), both in one gated write
         final_mem = Memory(
             id=str(uuid.uuid4()),
             content=merged.new_text.strip(),
@@ -122,5 +142,6 @@ class StmMerger:
             score=new_mem.score,
             lifetime=new_mem.lifetime,
         )
-        self.vdb.store(ai_name, final_mem)
+        await self._write(self._apply_merge, ai_name, merged.delete_ids or [], final_mem)
         self.log.info("STM-MERGE stored final_mem id=%s", final_mem.id)
+        return True
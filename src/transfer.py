@@ -0,0 +1,74 @@
+import base64
+import json
+from typing import Literal
+
+from src.db_bundle import DbBundle
+from src.memory import Memory
+
+
+Tier = Literal["stm", "ltm", "users"]
+
+
+def encode_cursor(tier: Tier, coll_name: str, offset: int)-> str:
+    raw = json.dumps({"t": tier, "c": coll_name, "o": offset}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str)-> tuple[Tier, str, int]:
+    try:
+        obj = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return obj["t"], obj["c"], int(obj["o"])
+    except Exception:
+        raise ValueError("invalid export cursor")
+
+
+class Page:
+    mems: list[Memory]
+    embeddings: list[list[float]] | None
+    next_offset: int | None # None once the collection is exhausted
+
+    def __init__(self, mems: list[Memory], embeddings: list[list[float]] | None, next_offset: int | None)-> None:
+        self.mems = mems
+        self.embeddings = embeddings
+        self.next_offset = next_offset
+        return
+
+
+def read_page(dbs: DbBundle, tier: Tier, coll_name: str, offset: int, limit: int, with_embeddings: bool = False)-> Page:
+    """Offsets are positions in insertion order for stm/ltm and user indices for users.
+    Memories removed by eviction/decay while paging can shift later pages, which is
+    harmless for imports since those are upserts."""
+    if tier == "users":
+        users = sorted(dbs.users.get_collection_users(coll_name))
+        mems: list[Memory] = []
+        idx = offset
+        # whole users per page, a page may overshoot limit by at most one user's memories
+        while idx < len(users) and len(mems) < limit:
+            mems.extend(dbs.users.get_all(coll_name, users[idx]))
+            idx += 1
+        return Page(mems, None, idx if idx < len(users) else None)
+
+    vdb = dbs.short_term if tier == "stm" else dbs.long_term
+    mems, embeddings = vdb.get_page(coll_name, offset, limit, with_embeddings)
+    next_offset = offset + len(mems) if len(mems) == limit else None
+    return Page(mems, embeddings, next_offset)
+
+
+def write_page(dbs: DbBundle, tier: Tier, coll_name: str, mems: list[Memory], embeddings: list[list[float]] | None = None, evict: bool = True)-> int:
+    """Returns how many memories were written, user memories without a user are skipped.
+    evict=False writes stm without triggering eviction into ltm."""
+    if tier == "users":
+        by_user: dict[str, list[Memory]] = {}
+        for mem in mems:
+            if mem.user is not None:
+                by_user.setdefault(mem.user, []).append(mem)
+        for user, user_mems in by_user.items():
+            dbs.users.store_many(coll_name, user, user_mems)
+        return sum(len(x) for x in by_user.values())
+
+    if tier == "stm":
+        vdb = dbs.short_term if evict else dbs.short_term.wrapped
+    else:
+        vdb = dbs.long_term
+    vdb.store_many(coll_name, mems, embeddings)
+    return len(mems)
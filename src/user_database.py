@@ -1,8 +1,12 @@
+import itertools
 import json
 import logging
 import os
+import threading
+import time
 
 from src.memory import Memory
+from src import metrics
 import src.utils as utils
 
 
@@ -12,6 +16,9 @@ import src.utils as utils
 
 # TODO: caching for active users
 
+_generations = itertools.count(1)
+
+
 class UserDatabase:
     size_limit_per_user: int = -1
     logger: logging.Logger
@@ -21,6 +28,10 @@ class UserDatabase:
         if not self._is_initialized():
             self._initialize()
         self.size_limit_per_user = size_limit_per_user
+        self._gens: dict[str, int] = {}
+        # user file path -> lock; writes are read-modify-write and come from several threads
+        self._file_locks: dict[str, threading.Lock] = {}
+        self._file_locks_lock = threading.Lock()
         self.logger.info("initialized user KV database")
         return
 
@@ -34,6 +45,15 @@ class UserDatabase:
         return
 
 
+    def _bump(self, coll_name: str)-> None:
+        self._gens[coll_name] = next(_generations)
+
+
+    def generation(self, coll_name: str)-> int:
+        """Changes after every write to the collection, lets callers cache reads."""
+        return self._gens.get(coll_name, 0)
+
+
     def _sanitize_name(self, user: str)-> str:
         return utils.sanitize_for_path(user)
 
@@ -44,6 +64,15 @@ class UserDatabase:
         return os.path.join(".", "users", sanitized_coll, sanitized_user + ".json")
 
 
+    def _lock(self, coll_name: str, user: str)-> threading.Lock:
+        path = self._get_path(coll_name, user) # names that sanitize alike share a file, so they share a lock
+        with self._file_locks_lock:
+            lock = self._file_locks.get(path)
+            if lock is None:
+                lock = self._file_locks[path] = threading.Lock()
+            return lock
+
+
     def _is_coll_exist(self, coll_name: str)-> bool:
         sanitized_coll: str = self._sanitize_name(coll_name)
         return os.path.exists(os.path.join(".", "users", sanitized_coll))
@@ -52,7 +81,7 @@ class UserDatabase:
     def _init_coll(self, coll_name: str)-> None:
         sanitized_coll: str = self._sanitize_name(coll_name)
         path = os.path.join(".", "users", sanitized_coll)
-        os.makedirs(path)
+        os.makedirs(path, exist_ok=True)
 
 
     def _is_user_exist(self, coll_name: str, user: str)-> bool:
@@ -82,24 +111,59 @@ class UserDatabase:
         if not self._is_coll_exist(coll_name):
             self._init_coll(coll_name)
 
-        if not self._is_user_exist(coll_name, user):
-            self._init_user(coll_name, user)
-        
         # TODO: move all dat to superior CSV
-        obj = self._read_user_file(coll_name, user)
+        start = time.perf_counter()
+        with self._lock(coll_name, user):
+            if not self._is_user_exist(coll_name, user):
+                self._init_user(coll_name, user)
+
+            obj = self._read_user_file(coll_name, user)
+
+            mems: list[dict] = obj.get("mems", None)
+            if mems is None:
+                raise AssertionError('missing field "mems" in user file.')
+            
+            mems.append(memory.to_dict())
+
+            if self.size_limit_per_user >= 0 and len(mems) > self.size_limit_per_user:
+                mems = mems[len(mems) - self.size_limit_per_user:] # rem first elems
+            
+            obj["mems"] = mems # dunno if python does hidden copies, better be safe
+
+            self._write_user_data(coll_name, user, obj)
+        self._bump(coll_name)
+        metrics.VDB_OP_SECONDS.observe(time.perf_counter() - start, tier="users", op="store")
+        return
 
-        mems: list[dict] = obj.get("mems", None)
-        if mems is None:
-            raise AssertionError('missing field "mems" in user file.')
-        
-        mems.append(memory.to_dict())
 
-        if self.size_limit_per_user >= 0 and len(mems) > self.size_limit_per_user:
-            mems = mems[len(mems) - self.size_limit_per_user:] # rem first elems
-        
-        obj["mems"] = mems # dunno if python does hidden copies, better be safe
+    def store_many(self, coll_name: str, user: str, memories: list[Memory])-> None:
+        """Same as store, with a single read/write of the user file. Memories whose id
+        is already stored replace the old entry, so restoring the same dump twice is a no-op."""
+        if not memories:
+            return
+        if not self._is_coll_exist(coll_name):
+            self._init_coll(coll_name)
+
+        with self._lock(coll_name, user):
+            if not self._is_user_exist(coll_name, user):
+                self._init_user(coll_name, user)
+
+            obj = self._read_user_file(coll_name, user)
 
-        self._write_user_data(coll_name, user, obj)
+            mems: list[dict] = obj.get("mems", None)
+            if mems is None:
+                raise AssertionError('missing field "mems" in user file.')
+
+            new_ids = {m.id for m in memories}
+            mems = [m for m in mems if m.get("id") not in new_ids]
+            mems.extend(m.to_dict() for m in memories)
+
+            if self.size_limit_per_user >= 0 and len(mems) > self.size_limit_per_user:
+                mems = mems[len(mems) - self.size_limit_per_user:]
+
+            obj["mems"] = mems
+            self._write_user_data(coll_name, user, obj)
+        self._bump(coll_name)
         return
 
 
@@ -110,7 +174,8 @@ class UserDatabase:
         if not self._is_user_exist(coll_name, user):
             return []
         
-        obj = self._read_user_file(coll_name, user)
+        with metrics.VDB_OP_SECONDS.time(tier="users", op="query"), self._lock(coll_name, user):
+            obj = self._read_user_file(coll_name, user) # never a half-written file
 
         mems: list[dict] = obj.get("mems", None)
         if mems is None:
@@ -123,14 +188,23 @@ class UserDatabase:
         return [Memory.from_dict(x) for x in mems]
         
 
+    def get_all(self, coll_name: str, user: str)-> list[Memory]:
+        if not self._is_coll_exist(coll_name) or not self._is_user_exist(coll_name, user):
+            return []
+        with self._lock(coll_name, user):
+            obj = self._read_user_file(coll_name, user)
+        return [Memory.from_dict(x) for x in obj.get("mems", [])]
+
+
     def clear_user(self, coll_name: str, user: str) -> None:
         """Wipe a single user's mems for a collection."""
         if not self._is_coll_exist(coll_name):
             return
         path = self._get_path(coll_name, user)
         os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "w", encoding="utf-8") as f:
+        with self._lock(coll_name, user), open(path, "w", encoding="utf-8") as f:
             f.write('{"mems": []}')
+        self._bump(coll_name)
 
 
     def clear_all_users(self, coll_name: str) -> None:
@@ -141,8 +215,10 @@ class UserDatabase:
         for name in os.listdir(coll_dir):
             p = os.path.join(coll_dir, name)
             if os.path.isfile(p) and p.endswith(".json"):
-                with open(p, "w", encoding="utf-8") as f:
+                # the file name is already sanitized, and sanitizing is idempotent
+                with self._lock(coll_name, name.removesuffix(".json")), open(p, "w", encoding="utf-8") as f:
                     f.write('{"mems": []}')
+        self._bump(coll_name)
     
 
     def get_collaction_names(self)-> list[str]:
@@ -157,6 +233,8 @@ class UserDatabase:
 
     def get_collection_users(self, coll_name: str)-> list[str]:
         coll_dir = os.path.join(".", "users", self._sanitize_name(coll_name))
+        if not os.path.isdir(coll_dir):
+            return []
 
         names = []
         for name in os.listdir(coll_dir):
@@ -54,8 +54,29 @@ class DecayingVdb(VectorDataBase):
         return
 
 
-    def query(self, coll_name: str, query_str: str, n: int)-> list[QueriedMemory]:
-        return self.wrapped.query(coll_name, query_str, n)
+    def store_many(self, coll_name: str, memories: list[Memory], embeddings: list[list[float]] | None = None)-> None:
+        self.wrapped.store_many(coll_name, memories, embeddings)
+        return
+
+
+    def query(self, coll_name: str, query_str: str, n: int, with_embeddings: bool = False)-> list[QueriedMemory]:
+        return self.wrapped.query(coll_name, query_str, n, with_embeddings)
+
+
+    def query_many(self, coll_name: str, query_strs: list[str], n: int, with_embeddings: bool = False)-> list[list[QueriedMemory]]:
+        return self.wrapped.query_many(coll_name, query_strs, n, with_embeddings)
+
+
+    def query_lexical(self, coll_name: str, query_str: str, n: int, with_embeddings: bool = False)-> list[QueriedMemory]:
+        return self.wrapped.query_lexical(coll_name, query_str, n, with_embeddings)
+
+
+    def query_hybrid(self, coll_name: str, query_str: str, n: int, lexical_str: str | None = None, with_embeddings: bool = False)-> list[QueriedMemory]:
+        return self.wrapped.query_hybrid(coll_name, query_str, n, lexical_str, with_embeddings)
+
+
+    def query_hybrid_many(self, coll_name: str, query_strs: list[str], n: int, lexical_strs: list[str] | None = None, with_embeddings: bool = False)-> list[list[QueriedMemory]]:
+        return self.wrapped.query_hybrid_many(coll_name, query_strs, n, lexical_strs, with_embeddings)
 
 
     def remove(self, coll_name: str, memory_id: str)-> None:
@@ -63,6 +84,11 @@ class DecayingVdb(VectorDataBase):
         return
 
 
+    def remove_many(self, coll_name: str, memory_ids: list[str])-> None:
+        self.wrapped.remove_many(coll_name, memory_ids)
+        return
+
+
     def clear(self, coll_name: str)-> None:
         self.wrapped.clear(coll_name)
         return
@@ -80,10 +106,18 @@ class DecayingVdb(VectorDataBase):
         return self.wrapped.peek_oldest(coll_name, n)
     
 
+    def get_page(self, coll_name: str, offset: int, limit: int, with_embeddings: bool = False)-> tuple[list[Memory], list[list[float]] | None]:
+        return self.wrapped.get_page(coll_name, offset, limit, with_embeddings)
+
+
     def get_collection_names(self)-> list[str]:
         return self.wrapped.get_collection_names()
 
 
+    def generation(self, coll_name: str)-> int:
+        return self.wrapped.generation(coll_name)
+
+
     def decay_all(self)-> None:
         self.logger.info("running decay for all collections...")
 
@@ -11,8 +11,10 @@ class EvictingVdb(VectorDataBase):
     max_size: int
     evict_fraction: float
     evict_min_batch: int
+    max_deferred: int
     logger: logging.Logger
     on_evict: Optional[Callable[[str, list[Memory]], None]]
+    is_backlogged: Optional[Callable[[str], bool]]
 
 
     def __init__(
@@ -22,7 +24,8 @@ class EvictingVdb(VectorDataBase):
         progressive_eviction: bool = True,
         max_size_before_evict: int = -1,
         evict_fraction: float = 0.0,
-        evict_min_batch: int = 1
+        evict_min_batch: int = 1,
+        max_deferred: int = 0,
     )-> None:
         self.logger = logging.getLogger(self.__class__.__name__)
         self.wrapped = wrapped_vdb
@@ -32,7 +35,9 @@ class EvictingVdb(VectorDataBase):
         # clamp + store
         self.evict_fraction = 0.0 if evict_fraction < 0.0 else (1.0 if evict_fraction > 1.0 else float(evict_fraction))
         self.evict_min_batch = max(0, int(evict_min_batch))
+        self.max_deferred = max(0, int(max_deferred))
         self.on_evict = None
+        self.is_backlogged = None
         return
         
 
@@ -41,6 +46,11 @@ class EvictingVdb(VectorDataBase):
         self.logger.info("set_on_evict: handler installed = %s", bool(self.on_evict))
 
 
+    def set_backpressure(self, cb: Callable[[str], bool]) -> None:
+        """cb(coll_name) returns True while the eviction sink can't keep up for that collection."""
+        self.is_backlogged = cb
+
+
     def _emit_evict(self, coll_name: str, evicted: List[Memory]) -> None:
         self.logger.info("emit_evict: coll=%s batch=%d handler=%s", coll_name, len(evicted), bool(self.on_evict))
         if not evicted:
@@ -63,11 +73,18 @@ class EvictingVdb(VectorDataBase):
     def _evict_overflow(self, coll_name: str) -> None:
         if self.prog_evict and self.max_size > 0:
             current = self.wrapped.count(coll_name)
-            self.logger.info("evict_overflow: coll=%s count=%d max=%d", coll_name, current, self.max_size)
+            self.logger.debug("evict_overflow: coll=%s count=%d max=%d", coll_name, current, self.max_size)
             if current <= self.max_size:
                 return
 
             overflow = current - self.max_size
+            backlogged = self.is_backlogged is not None and self.is_backlogged(coll_name)
+
+            # backpressure: let STM grow up to max_deferred past its limit,
+            # then trickle out only the overflow until the sink catches up
+            if backlogged and overflow <= self.max_deferred:
+                self.logger.info("evict_overflow: sink backlogged, deferring eviction (overflow=%d, max_deferred=%d)", overflow, self.max_deferred)
+                return
 
             # decide how many to evict:
             # - fraction mode: evict at least floor(current * fraction)
@@ -79,6 +96,9 @@ class EvictingVdb(VectorDataBase):
             else:
                 n_to_evict = max(overflow, self.evict_min_batch)
 
+            if backlogged:
+                n_to_evict = overflow - self.max_deferred
+
             n_to_evict = min(n_to_evict, current)
 
             self.logger.info(
@@ -86,31 +106,60 @@ class EvictingVdb(VectorDataBase):
                 n_to_evict, overflow, self.evict_fraction, self.evict_min_batch
             )
 
-            evicted: List[Memory] = []
             remain = n_to_evict
             while remain > 0:
                 chunk_n = min(256, remain)
-                popped = self.wrapped.pop_oldest(coll_name, n=chunk_n)
-                self.logger.info("evict_overflow: popped=%d", len(popped))
-                if not popped:
+                evicted = self._evict_chunk(coll_name, chunk_n)
+                self.logger.info("evict_overflow: evicted=%d", evicted)
+                if evicted == 0:
                     break
-                evicted.extend(popped)
-                remain -= len(popped)
-
-            self._emit_evict(coll_name, evicted)
+                remain -= evicted
         return
 
 
+    def _evict_chunk(self, coll_name: str, n: int)-> int:
+        # hand the memories over before deleting them, so a failing
+        # handler leaves them in place instead of losing them
+        chunk = self.wrapped.peek_oldest(coll_name, n=n)
+        if not chunk:
+            return 0
+        self._emit_evict(coll_name, chunk)
+        self.wrapped.remove_many(coll_name, [m.id for m in chunk])
+        return len(chunk)
+
+
     def store(self, coll_name: str, memory: Memory)-> None:
         self.wrapped.store(coll_name, memory)
-        post = self.wrapped.count(coll_name)
-        self.logger.info("store: coll=%s post_count=%d", coll_name, post)
+        self.logger.debug("store: coll=%s", coll_name)
         self._evict_overflow(coll_name)
         return
 
 
-    def query(self, coll_name: str, query_str: str, n: int)-> list[QueriedMemory]:
-        return self.wrapped.query(coll_name, query_str, n)
+    def store_many(self, coll_name: str, memories: list[Memory], embeddings: list[list[float]] | None = None)-> None:
+        self.wrapped.store_many(coll_name, memories, embeddings)
+        self.logger.debug("store_many: coll=%s n=%d", coll_name, len(memories))
+        self._evict_overflow(coll_name)
+        return
+
+
+    def query(self, coll_name: str, query_str: str, n: int, with_embeddings: bool = False)-> list[QueriedMemory]:
+        return self.wrapped.query(coll_name, query_str, n, with_embeddings)
+
+
+    def query_many(self, coll_name: str, query_strs: list[str], n: int, with_embeddings: bool = False)-> list[list[QueriedMemory]]:
+        return self.wrapped.query_many(coll_name, query_strs, n, with_embeddings)
+
+
+    def query_lexical(self, coll_name: str, query_str: str, n: int, with_embeddings: bool = False)-> list[QueriedMemory]:
+        return self.wrapped.query_lexical(coll_name, query_str, n, with_embeddings)
+
+
+    def query_hybrid(self, coll_name: str, query_str: str, n: int, lexical_str: str | None = None, with_embeddings: bool = False)-> list[QueriedMemory]:
+        return self.wrapped.query_hybrid(coll_name, query_str, n, lexical_str, with_embeddings)
+
+
+    def query_hybrid_many(self, coll_name: str, query_strs: list[str], n: int, lexical_strs: list[str] | None = None, with_embeddings: bool = False)-> list[list[QueriedMemory]]:
+        return self.wrapped.query_hybrid_many(coll_name, query_strs, n, lexical_strs, with_embeddings)
 
 
     def remove(self, coll_name: str, memory_id: str)-> None:
@@ -118,6 +167,11 @@ class EvictingVdb(VectorDataBase):
         return
 
 
+    def remove_many(self, coll_name: str, memory_ids: list[str])-> None:
+        self.wrapped.remove_many(coll_name, memory_ids)
+        return
+
+
     def clear(self, coll_name: str)-> None:
         self.wrapped.clear(coll_name)
         return
@@ -138,15 +192,22 @@ class EvictingVdb(VectorDataBase):
     def evict_all(self, coll_name: str) -> None:
         total_evicted = 0
         while True:
-            chunk = self.wrapped.pop_oldest(coll_name, n=256)
-            self.logger.info("evict_all: popped=%d", len(chunk))
-            if not chunk:
+            evicted = self._evict_chunk(coll_name, 256)
+            self.logger.info("evict_all: evicted=%d", evicted)
+            if evicted == 0:
                 break
-            total_evicted += len(chunk)
-            self._emit_evict(coll_name, chunk)
+            total_evicted += evicted
         self.logger.info("evict_all: coll=%s total=%d", coll_name, total_evicted)
         return
 
 
+    def get_page(self, coll_name: str, offset: int, limit: int, with_embeddings: bool = False)-> tuple[list[Memory], list[list[float]] | None]:
+        return self.wrapped.get_page(coll_name, offset, limit, with_embeddings)
+
+
     def get_collection_names(self) -> list[str]:
         return self.wrapped.get_collection_names()
+
+
+    def generation(self, coll_name: str)-> int:
+        return self.wrapped.generation(coll_name)
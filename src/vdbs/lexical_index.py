@@ -0,0 +1,126 @@
+import heapq
+import re
+import sys
+import threading
+from collections import Counter
+from math import log
+
+
+_TOKEN = re.compile(r"\w+")
+_PHRASE = re.compile(r'"([^"]+)"')
+
+
+def tokenize(text: str)-> list[str]:
+    return _TOKEN.findall(text.casefold())
+
+
+def _contains(tokens: tuple[str, ...], phrase: tuple[str, ...])-> bool:
+    n = len(phrase)
+    return any(tokens[i:i + n] == phrase for i, t in enumerate(tokens) if t == phrase[0])
+
+
+def rrf_fuse(rankings: list[list[str]], k: int = 60)-> list[tuple[str, float]]:
+    """Reciprocal-rank fusion: sum of 1 / (k + rank) over the rankings an id appears in, best first."""
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+
+
+class LexicalIndex:
+    """Incremental BM25 inverted index over one collection: memory content plus the user name.
+    "quoted phrases" in a query must appear verbatim in the content of a hit."""
+    k1: float
+    b: float
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75)-> None:
+        self.k1 = k1
+        self.b = b
+        self._postings: dict[str, dict[str, int]] = {} # term -> doc id -> term frequency
+        # doc id -> (content tokens in order, user tokens), for phrase checks and removal
+        self._docs: dict[str, tuple[tuple[str, ...], tuple[str, ...]]] = {}
+        self._total_len = 0
+        self._lock = threading.Lock() # vdb calls run on worker threads
+        return
+
+
+    def __len__(self)-> int:
+        return len(self._docs)
+
+
+    def add(self, doc_id: str, content: str, user: str | None = None)-> None:
+        """Adds or replaces a document."""
+        # interned, so every posting and doc shares one copy of each term
+        content_tokens = tuple(sys.intern(t) for t in tokenize(content))
+        user_tokens = tuple(sys.intern(t) for t in tokenize(user)) if user else ()
+
+        with self._lock:
+            self._remove(doc_id)
+            for term, tf in Counter(content_tokens + user_tokens).items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+            self._docs[doc_id] = (content_tokens, user_tokens)
+            self._total_len += len(content_tokens) + len(user_tokens)
+
+
+    def remove(self, doc_id: str)-> None:
+        with self._lock:
+            self._remove(doc_id)
+
+
+    def _remove(self, doc_id: str)-> None:
+        doc = self._docs.pop(doc_id, None)
+        if doc is None:
+            return
+        content_tokens, user_tokens = doc
+        for term in set(content_tokens + user_tokens):
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self._postings[term]
+        self._total_len -= len(content_tokens) + len(user_tokens)
+
+
+    def search(self, query: str, n: int)-> list[tuple[str, float]]:
+        """Top n (doc id, BM25 score), best first. Documents sharing no term with the query are never returned."""
+        phrases = [tuple(p) for p in (tokenize(x) for x in _PHRASE.findall(query)) if p]
+        terms = set(tokenize(query))
+        if not terms or n <= 0:
+            return []
+
+        with self._lock:
+            n_docs = len(self._docs)
+            if n_docs == 0:
+                return []
+            avg_len = self._total_len / n_docs
+
+            scores: dict[str, float] = {}
+            for term in terms:
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                df = len(posting)
+                idf = log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+                for doc_id, tf in posting.items():
+                    content_tokens, user_tokens = self._docs[doc_id]
+                    norm = self.k1 * (1.0 - self.b + self.b * (len(content_tokens) + len(user_tokens)) / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1.0) / (tf + norm)
+
+            if phrases:
+                scores = {
+                    doc_id: s for doc_id, s in scores.items()
+                    if all(_contains(self._docs[doc_id][0], p) for p in phrases)
+                }
+
+        return heapq.nlargest(n, scores.items(), key=lambda kv: kv[1])
+
+
+    def stats(self)-> dict:
+        with self._lock:
+            return {
+                "docs": len(self._docs),
+                "terms": len(self._postings),
+                "postings": sum(len(p) for p in self._postings.values()),
+            }
@@ -1,14 +1,21 @@
+import itertools
 import logging
 import os
+import threading
 import time
 from typing import Callable, Literal
 from chromadb import Client, ClientAPI, Collection, Settings
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
 from chromadb.errors import NotFoundError
 from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2, DefaultEmbeddingFunction
 from chromadb.utils.embedding_functions.sentence_transformer_embedding_function import SentenceTransformerEmbeddingFunction
 
+from src.config import LexicalConfig
+from src.embedding_pool import EmbeddingPool
 from src.vdbs.vector_database import VectorDataBase
+from src.vdbs.lexical_index import LexicalIndex, rrf_fuse
 from src.memory import Memory, QueriedMemory
+from src import metrics
 
 
 class ChromaClientSingleton(object):
@@ -29,16 +36,57 @@ class ChromaClientSingleton(object):
     return cls.instance
 
 
+class _TimedMiniLM(ONNXMiniLM_L6_V2):
+    """Records embedding calls under the owning database's tier."""
+    tier: str = ""
+
+    def __call__(self, input: Documents)-> Embeddings:
+        with metrics.EMBED_SECONDS.time(tier=self.tier):
+            out = super().__call__(input)
+        metrics.EMBED_TEXTS.inc(len(input), tier=self.tier)
+        return out
+
+
+class PooledEmbedding(EmbeddingFunction[Documents]):
+    """Embeds through worker processes of an EmbeddingPool, timed like _TimedMiniLM."""
+    tier: str
+
+    def __init__(self, pool: EmbeddingPool, tier: str)-> None:
+        self.pool = pool
+        self.tier = tier
+        return
+
+    def __call__(self, input: Documents)-> Embeddings:
+        with metrics.EMBED_SECONDS.time(tier=self.tier):
+            out = self.pool.embed(input)
+        metrics.EMBED_TEXTS.inc(len(input), tier=self.tier)
+        return list(out)
+
+
+# process-wide, so every bump yields a value never seen before even when two threads race
+_generations = itertools.count(1)
+
+_LEXICAL_BUILD_PAGE = 1_000
+
+
 class VdbChroma(VectorDataBase):
     client: ClientAPI = None
     coll_cache: dict[str, Collection]
     size_limit: int = -1
     name: str
     logger: logging.Logger
-    embedding_function: ONNXMiniLM_L6_V2 | SentenceTransformerEmbeddingFunction
-
-
-    def __init__(self, db_name: str, size_limit: int = -1, device: Literal["cpu", "cuda"] = "cuda")-> None:
+    embedding_function: EmbeddingFunction
+    lexical: LexicalConfig | None
+
+
+    def __init__(
+        self,
+        db_name: str,
+        size_limit: int = -1,
+        device: Literal["cpu", "cuda"] = "cuda",
+        embedding_function: EmbeddingFunction | None = None,
+        lexical: LexicalConfig | None = None,
+    )-> None:
         self.logger = logging.getLogger(f"{self.__class__.__name__}({db_name})")
         self.size_limit = size_limit
         self.name = db_name
@@ -46,13 +94,24 @@ class VdbChroma(VectorDataBase):
         client_singleton = ChromaClientSingleton()
         self.client = client_singleton.client
 
-        if device == "cuda":
-            self.embedding_function = ONNXMiniLM_L6_V2(preferred_providers=['CUDAExecutionProvider'])
+        if embedding_function is not None:
+            # e.g. a deterministic stand-in for benchmarks
+            self.embedding_function = embedding_function
+        elif device == "cuda":
+            self.embedding_function = _TimedMiniLM(preferred_providers=['CUDAExecutionProvider'])
             #self.embedding_function = SentenceTransformerEmbeddingFunction(model_name="sentence-transformers/all-MiniLM-L6-v2", device="cuda")
         else:
-            self.embedding_function = ONNXMiniLM_L6_V2(preferred_providers=['CPUExecutionProvider'])
+            self.embedding_function = _TimedMiniLM(preferred_providers=['CPUExecutionProvider'])
+        if isinstance(self.embedding_function, _TimedMiniLM):
+            self.embedding_function.tier = db_name
 
         self.coll_cache = {}  # instance-local cache
+        self._gens: dict[str, int] = {}
+
+        # keyword indexes, None = disabled
+        self.lexical = lexical if lexical is not None and lexical.enabled else None
+        self._lexical: dict[str, LexicalIndex] = {}
+        self._lexical_lock = threading.Lock()
         self.logger.info("initialized %s vector database", db_name)
         return
 
@@ -76,6 +135,59 @@ class VdbChroma(VectorDataBase):
         return collection
 
 
+    def _bump(self, coll_name: str)-> None:
+        """Called after a write has completed, so readers that saw the old value are invalidated."""
+        self._gens[coll_name] = next(_generations)
+
+
+    def generation(self, coll_name: str)-> int:
+        return self._gens.get(coll_name, 0)
+
+
+    def _get_lexical(self, coll_name: str)-> LexicalIndex:
+        """Built from the collection on first use, kept current by every write after that."""
+        if self.lexical is None:
+            raise ValueError(f"lexical index is disabled for {self.name}")
+        index = self._lexical.get(coll_name)
+        if index is not None:
+            return index
+
+        with self._lexical_lock:
+            index = self._lexical.get(coll_name)
+            if index is not None:
+                return index
+
+            start = time.perf_counter()
+            index = LexicalIndex(k1=self.lexical.k1, b=self.lexical.b)
+            collection = self._get_collection(coll_name)
+            offset = 0
+            while True:
+                res = collection.get(ids=None, offset=offset, limit=_LEXICAL_BUILD_PAGE, include=["documents", "metadatas"])
+                for doc_id, doc, meta in zip(res["ids"], res["documents"], res["metadatas"]):
+                    index.add(doc_id, doc, meta.get("u"))
+                if len(res["ids"]) < _LEXICAL_BUILD_PAGE:
+                    break
+                offset += _LEXICAL_BUILD_PAGE
+            self._lexical[coll_name] = index
+
+        self.logger.info("built lexical index", extra={"kv": {"coll": coll_name, "docs": len(index), "ms": int((time.perf_counter() - start) * 1_000)}})
+        return index
+
+
+    def _lexical_update(self, coll_name: str, fn: Callable[[LexicalIndex], None])-> None:
+        """Applies a write to the index if it was built, after the collection itself was written."""
+        if self.lexical is None:
+            return
+        index = self._lexical.get(coll_name)
+        if index is None:
+            # a build in progress may have read the collection before this write
+            with self._lexical_lock:
+                index = self._lexical.get(coll_name)
+            if index is None:
+                return
+        fn(index)
+
+
     def _restrict_size(self, coll_name: str)-> None:
         if self.size_limit < 0:
             return
@@ -89,10 +201,12 @@ class VdbChroma(VectorDataBase):
         items = collection.get(ids=None, limit=size_diff)
         ids_to_remove = items['ids']
         collection.delete(ids=ids_to_remove)
+        self._lexical_update(coll_name, lambda index: [index.remove(x) for x in ids_to_remove])
+        self.logger.info("size limit %d reached in %s, dropped %d oldest memories", self.size_limit, coll_name, len(ids_to_remove))
         return
 
 
-    def store(self, coll_name: str, memory: Memory)-> None:
+    def _to_metadata(self, memory: Memory)-> dict:
         metadata = {"t": memory.time}
 
         if memory.user:                    # only add when non-empty truthy
@@ -101,54 +215,176 @@ class VdbChroma(VectorDataBase):
             metadata["s"] = memory.score
         if memory.lifetime is not None:
             metadata["l"] = memory.lifetime
+        return metadata
 
-        self._get_collection(coll_name).add(
-            ids=[memory.id],
-            documents=[memory.content],
-            metadatas=[metadata],
+
+    def _from_record(self, doc_id: str, document: str, meta: dict)-> Memory:
+        return Memory(
+            id=      doc_id,
+            content= document,
+            time=    meta.get("t", 0),
+            user=    meta.get("u", None),
+            score=   meta.get("s", None),
+            lifetime=meta.get("l", None),
         )
 
+
+    def store(self, coll_name: str, memory: Memory)-> None:
+        with metrics.VDB_OP_SECONDS.time(tier=self.name, op="store"):
+            self._get_collection(coll_name).add(
+                ids=[memory.id],
+                documents=[memory.content],
+                metadatas=[self._to_metadata(memory)],
+            )
+        self._lexical_update(coll_name, lambda index: index.add(memory.id, memory.content, memory.user))
+
         if self.size_limit >= 0:
             self._restrict_size(coll_name)
+        self._bump(coll_name)
+
+
+    def store_many(self, coll_name: str, memories: list[Memory], embeddings: list[list[float]] | None = None)-> None:
+        if not memories:
+            return
+        # one upsert call, the embedding function runs once over the whole page if needed
+        with metrics.VDB_OP_SECONDS.time(tier=self.name, op="store_many"):
+            self._get_collection(coll_name).upsert(
+                ids=[m.id for m in memories],
+                documents=[m.content for m in memories],
+                metadatas=[self._to_metadata(m) for m in memories],
+                embeddings=embeddings,
+            )
+        self._lexical_update(coll_name, lambda index: [index.add(m.id, m.content, m.user) for m in memories])
+
+        if self.size_limit >= 0:
+            self._restrict_size(coll_name)
+        self._bump(coll_name)
 
 
     def remove(self, coll_name: str, memory_id: str)-> None:
         self._get_collection(coll_name).delete(ids=[memory_id])
+        self._lexical_update(coll_name, lambda index: index.remove(memory_id))
+        self._bump(coll_name)
         return
 
 
-    def query(self, coll_name: str, query_str: str, n: int)-> list[QueriedMemory]:
-        start_time = int(time.time() * 1_000)
+    def remove_many(self, coll_name: str, memory_ids: list[str])-> None:
+        if not memory_ids:
+            return
+        with metrics.VDB_OP_SECONDS.time(tier=self.name, op="remove_many"):
+            self._get_collection(coll_name).delete(ids=memory_ids)
+        self._lexical_update(coll_name, lambda index: [index.remove(x) for x in memory_ids])
+        self._bump(coll_name)
+        return
 
-        final: list[QueriedMemory] = []
 
-        res = self._get_collection(coll_name).query(
-            query_texts=[query_str],
-            n_results=n,
-        )
+    def query(self, coll_name: str, query_str: str, n: int, with_embeddings: bool = False)-> list[QueriedMemory]:
+        return self.query_many(coll_name, [query_str], n, with_embeddings)[0]
 
-        res_len = len(res["documents"][0])
-        for i in range(res_len):
-            meta = res["metadatas"][0][i]
-            mem: Memory = Memory(
-                id=      res["ids"][0][i],
-                content= res["documents"][0][i],
-                time=    meta.get("t", 0),
-                user=    meta.get("u", None),
-                score=   meta.get("s", None),
-                lifetime=meta.get("l", None),
-            )
-            qmem: QueriedMemory = QueriedMemory(
-                memory=mem,
-                distance=res["distances"][0][i],
+
+    def query_many(self, coll_name: str, query_strs: list[str], n: int, with_embeddings: bool = False)-> list[list[QueriedMemory]]:
+        """All queries embedded in one batch and searched in one collection query, results per query."""
+        start_time = int(time.time() * 1_000)
+
+        final: list[list[QueriedMemory]] = []
+
+        include = ["documents", "metadatas", "distances", "embeddings"] if with_embeddings else ["documents", "metadatas", "distances"]
+        with metrics.VDB_OP_SECONDS.time(tier=self.name, op="query"):
+            res = self._get_collection(coll_name).query(
+                query_texts=query_strs,
+                n_results=n,
+                include=include,
             )
-            final.append(qmem)
-        
-        self.logger.info("query latency: %d", int(time.time() * 1_000) - start_time)
+
+        for q in range(len(query_strs)):
+            per_query: list[QueriedMemory] = []
+            for i in range(len(res["documents"][q])):
+                mem = self._from_record(res["ids"][q][i], res["documents"][q][i], res["metadatas"][q][i])
+                qmem: QueriedMemory = QueriedMemory(
+                    memory=mem,
+                    distance=res["distances"][q][i],
+                    embedding=res["embeddings"][q][i] if with_embeddings else None,
+                )
+                per_query.append(qmem)
+            final.append(per_query)
+
+        self.logger.debug("query", extra={"kv": {"coll": coll_name, "queries": len(query_strs), "n": n, "latency_ms": int(time.time() * 1_000) - start_time}})
 
         return final
 
 
+    def query_lexical(self, coll_name: str, query_str: str, n: int, with_embeddings: bool = False)-> list[QueriedMemory]:
+        """Distances are 1 / (1 + BM25 score), smaller is better like vector distances."""
+        index = self._get_lexical(coll_name)
+        with metrics.VDB_OP_SECONDS.time(tier=self.name, op="query_lexical"):
+            hits = index.search(query_str, n)
+            found = self._get_by_ids(coll_name, [doc_id for doc_id, _ in hits], with_embeddings)
+
+        final = []
+        for doc_id, score in hits:
+            if doc_id in found:
+                found[doc_id].distance = 1.0 / (1.0 + score)
+                final.append(found[doc_id])
+        return final
+
+
+    def query_hybrid(self, coll_name: str, query_str: str, n: int, lexical_str: str | None = None, with_embeddings: bool = False)-> list[QueriedMemory]:
+        return self.query_hybrid_many(coll_name, [query_str], n, None if lexical_str is None else [lexical_str], with_embeddings)[0]
+
+
+    def query_hybrid_many(
+        self,
+        coll_name: str,
+        query_strs: list[str],
+        n: int,
+        lexical_strs: list[str] | None = None,
+        with_embeddings: bool = False,
+    )-> list[list[QueriedMemory]]:
+        """Vector and BM25 rankings fused with reciprocal-rank fusion. Distances are
+        1 - fused score / best possible score, so only the order is comparable to vector distances."""
+        index = self._get_lexical(coll_name)
+        k = n * self.lexical.candidates
+        lexical_strs = lexical_strs if lexical_strs is not None else query_strs
+
+        vectors = self.query_many(coll_name, query_strs, k, with_embeddings)
+        with metrics.VDB_OP_SECONDS.time(tier=self.name, op="query_hybrid"):
+            fused_per_query = []
+            found: dict[str, QueriedMemory] = {}
+            for vector, lexical_str in zip(vectors, lexical_strs):
+                hits = index.search(lexical_str, k)
+                fused_per_query.append(rrf_fuse([[q.memory.id for q in vector], [doc_id for doc_id, _ in hits]], k=self.lexical.rrf_k)[:n])
+                found.update((q.memory.id, q) for q in vector)
+
+            # keyword-only hits of every query fetched in one call
+            missing = list({doc_id for fused in fused_per_query for doc_id, _ in fused if doc_id not in found})
+            if missing:
+                found.update(self._get_by_ids(coll_name, missing, with_embeddings))
+
+        best = 2.0 / (self.lexical.rrf_k + 1)
+        return [
+            [
+                QueriedMemory(memory=found[doc_id].memory, distance=1.0 - score / best, embedding=found[doc_id].embedding)
+                for doc_id, score in fused if doc_id in found
+            ]
+            for fused in fused_per_query
+        ]
+
+
+    def _get_by_ids(self, coll_name: str, ids: list[str], with_embeddings: bool = False)-> dict[str, QueriedMemory]:
+        """Distances are left at 0 for the caller to fill in."""
+        if not ids:
+            return {}
+        include = ["documents", "metadatas", "embeddings"] if with_embeddings else ["documents", "metadatas"]
+        res = self._get_collection(coll_name).get(ids=ids, include=include)
+        return {
+            doc_id: QueriedMemory(
+                memory=self._from_record(doc_id, res["documents"][i], res["metadatas"][i]),
+                embedding=res["embeddings"][i] if with_embeddings else None,
+            )
+            for i, doc_id in enumerate(res["ids"])
+        }
+
+
     def pop_oldest(self, coll_name: str, n: int | None = 1) -> list[Memory]:
         coll = self._get_collection(coll_name)
         res = coll.get(ids=None, offset=0, limit=n)
@@ -156,18 +392,13 @@ class VdbChroma(VectorDataBase):
         final: list[Memory] = []
         res_len = len(res["documents"])
         for i in range(res_len):
-            meta = res["metadatas"][i]
-            mem: Memory = Memory(
-                id=      res["ids"][i],
-                content= res["documents"][i],
-                time=    meta.get("t", 0),
-                user=    meta.get("u", None),
-                score=   meta.get("s", None),
-                lifetime=meta.get("l", None),
-            )
+            mem = self._from_record(res["ids"][i], res["documents"][i], res["metadatas"][i])
             final.append(mem)
             coll.delete(ids=[mem.id])
-        
+
+        if final:
+            self._lexical_update(coll_name, lambda index: [index.remove(m.id) for m in final])
+            self._bump(coll_name)
         return final
 
     
@@ -179,27 +410,37 @@ class VdbChroma(VectorDataBase):
         final: list[Memory] = []
         res_len = len(res["documents"])
         for i in range(res_len):
-            meta = res["metadatas"][i]
-            mem: Memory = Memory(
-                id=      res["ids"][i],
-                content= res["documents"][i],
-                time=    meta.get("t", 0),
-                user=    meta.get("u", None),
-                score=   meta.get("s", None),
-                lifetime=meta.get("l", None),
-            )
-            final.append(mem)
+            final.append(self._from_record(res["ids"][i], res["documents"][i], res["metadatas"][i]))
         
         return final
 
 
+    def get_page(self, coll_name: str, offset: int, limit: int, with_embeddings: bool = False)-> tuple[list[Memory], list[list[float]] | None]:
+        include = ["documents", "metadatas", "embeddings"] if with_embeddings else ["documents", "metadatas"]
+        with metrics.VDB_OP_SECONDS.time(tier=self.name, op="get_page"):
+            res = self._get_collection(coll_name).get(ids=None, offset=offset, limit=limit, include=include)
+
+        final: list[Memory] = []
+        for i in range(len(res["ids"])):
+            final.append(self._from_record(res["ids"][i], res["documents"][i], res["metadatas"][i]))
+
+        embeddings = None
+        if with_embeddings:
+            embeddings = [[float(x) for x in e] for e in res["embeddings"]]
+        return final, embeddings
+
+
     def clear(self, coll_name: str)-> None:
         unique_name = self._unique_coll_name(coll_name)
         try:
             self.client.delete_collection(unique_name)
         except NotFoundError:
             pass
-        self.coll_cache[unique_name] = self.client.get_or_create_collection(name=unique_name)
+        # recreated on next use, with the same embedding function
+        self.coll_cache.pop(unique_name, None)
+        with self._lexical_lock:
+            self._lexical.pop(coll_name, None)
+        self._bump(coll_name)
         return
 
 
@@ -7,12 +7,37 @@ class VectorDataBase:
     def store(self, coll_name: str, memory: Memory)-> None:
         return
 
-    def query(self, coll_name: str, query_str: str, n: int)-> list[QueriedMemory]:
+    def store_many(self, coll_name: str, memories: list[Memory], embeddings: list[list[float]] | None = None)-> None:
+        """Upsert, embeddings are computed only when not supplied."""
+        return
+
+    def query(self, coll_name: str, query_str: str, n: int, with_embeddings: bool = False)-> list[QueriedMemory]:
         return []
     
+    def query_many(self, coll_name: str, query_strs: list[str], n: int, with_embeddings: bool = False)-> list[list[QueriedMemory]]:
+        """Results per query, implementations embed all queries in one batch."""
+        return [self.query(coll_name, q, n, with_embeddings) for q in query_strs]
+
+    def query_lexical(self, coll_name: str, query_str: str, n: int, with_embeddings: bool = False)-> list[QueriedMemory]:
+        """Keyword lookup without embedding the query, see LexicalIndex."""
+        return []
+
+    def query_hybrid(self, coll_name: str, query_str: str, n: int, lexical_str: str | None = None, with_embeddings: bool = False)-> list[QueriedMemory]:
+        """Vector and keyword results fused by rank, lexical_str defaults to query_str."""
+        return self.query(coll_name, query_str, n, with_embeddings)
+
+    def query_hybrid_many(self, coll_name: str, query_strs: list[str], n: int, lexical_strs: list[str] | None = None, with_embeddings: bool = False)-> list[list[QueriedMemory]]:
+        lexical_strs = lexical_strs if lexical_strs is not None else query_strs
+        return [self.query_hybrid(coll_name, q, n, lex, with_embeddings) for q, lex in zip(query_strs, lexical_strs)]
+
     def remove(self, coll_name: str, memory_id: str)-> None:
         return
 
+    def remove_many(self, coll_name: str, memory_ids: list[str])-> None:
+        """One write for all ids, implementations delete them in a single call."""
+        for memory_id in memory_ids:
+            self.remove(coll_name, memory_id)
+
     def pop_oldest(self, coll_name: str, n: int | None = 1)-> list[Memory]:
         return []
 
@@ -25,6 +50,13 @@ class VectorDataBase:
     def count(self, coll_name: str)-> int:
         return 0
     
+    def get_page(self, coll_name: str, offset: int, limit: int, with_embeddings: bool = False)-> tuple[list[Memory], list[list[float]] | None]:
+        return [], None
+    
     def get_collection_names(self)-> list[str]:
         return []
+
+    def generation(self, coll_name: str)-> int:
+        """Changes after every write to the collection, lets callers cache reads."""
+        return 0
         
@@ -0,0 +1,79 @@
+import json
+from typing import Any, List, Literal, Optional
+
+# both are optional, the plain json module is always available as fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+WireEncoding = Literal["json", "msgpack"]
+MemoryField = Literal["id", "content", "time", "user", "score", "lifetime"]
+
+
+def available_encodings()-> list[str]:
+    return ["msgpack", "json"] if msgpack is not None else ["json"]
+
+
+def pick_encoding(preferred: List[str])-> WireEncoding:
+    """First encoding of the client's preference list the server supports."""
+    supported = available_encodings()
+    return next((e for e in preferred if e in supported), "json")
+
+
+def dumps_json(obj: Any)-> str | bytes:
+    """orjson returns utf-8 bytes, which websockets can send as a text frame as-is."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def loads_json(data: str | bytes)-> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def decode(data: str | bytes)-> Any:
+    """Text frames are json, binary frames are msgpack, whatever was negotiated."""
+    if isinstance(data, str):
+        return loads_json(data)
+    if msgpack is None:
+        raise ValueError("received binary frame but msgpack is not installed on the server")
+    return msgpack.unpackb(data, raw=False)
+
+
+def project_memory(mem: dict, fields: Optional[List[MemoryField]])-> dict:
+    if fields is None:
+        return mem
+    return {k: v for k, v in mem.items() if k in fields}
+
+
+class WireSession:
+    """Per-connection wire settings, negotiated through a hello message."""
+    encoding: WireEncoding
+    fields: Optional[List[MemoryField]]
+
+    def __init__(self)-> None:
+        self.encoding = "json"
+        self.fields = None
+        return
+
+
+    def negotiate(self, preferred: List[str], fields: Optional[List[MemoryField]])-> WireEncoding:
+        self.encoding = pick_encoding(preferred)
+        self.fields = fields
+        return self.encoding
+
+
+    def encode(self, obj: Any)-> tuple[str | bytes, bool]:
+        """Returns (frame, is_text)."""
+        if self.encoding == "msgpack":
+            return msgpack.packb(obj, use_bin_type=True), False
+        return dumps_json(obj), True
@@ -1,5 +1,6 @@
 import asyncio
 import json
+from contextvars import ContextVar
 from math import floor
 
 import time
@@ -14,11 +15,51 @@ from websockets import ConnectionClosed
 
 from src.config import Config
 from src.compressor import Compressor
-from src.memory import Memory
+from src.memory import Memory, QueriedMemory
 from src.ai import AI
-from src.messages import MessageTypes, MsgClose, MsgEvict, MsgQuery, MsgStore, MsgProcess, MsgCount, MsgClear
+from src.messages import MessageTypes, MsgBatch, MsgClose, MsgExport, MsgHello, MsgImport, MsgSnapshot, MsgStats, MsgProfile, MsgEvict, MsgQuery, MsgStore, MsgProcess, MsgCount, MsgClear, OpenLlmMsg
 from src.db_bundle import DbBundle
+from src.vdbs.vector_database import VectorDataBase
+from src.job_queue import Job, JobQueue
 from src.stm_merger import StmMerger
+from src import transfer
+from src.snapshot import Snapshotter
+from src import wire
+from src.wire import WireSession
+from src.session import Session
+from src.logging import Payload, kv
+from src import metrics
+from src.profiling import PROFILER, message_type
+from src.query_cache import QueryCache
+from src import ranking
+
+
+# message types that may appear inside a batch
+BATCHABLE_TYPES = ("query", "store", "process", "evict", "clear", "count")
+
+# answered from the receive loop itself: they change how later frames are answered, or stop the server
+INLINE_TYPES = ("hello", "close")
+
+# with wss.ordered_writes, per collection and connection: a write starts after every
+# earlier request, a read only after earlier writes
+WRITE_TYPES = ("store", "clear", "evict", "import")
+READ_TYPES = ("query", "count", "export")
+
+# perf_counter() at receive time of the message being handled, background
+# tasks copy it when they are created so overlapping requests don't mix
+_request_start: ContextVar[float | None] = ContextVar("request_start", default=None)
+
+
+class _BatchItemConn:
+    """Stands in for the connection while a batch item runs, keeping what its handler sends."""
+    conn: ServerConnection
+    sent: list[dict]
+
+    def __init__(self, conn: ServerConnection)-> None:
+        self.conn = conn
+        self.sent = []
+        return
+
 
 class WssHandler:
     _config: Config
@@ -32,8 +73,7 @@ class WssHandler:
     _close_server: asyncio.Future
 
     _handlers: dict[MessageTypes, Callable[[ServerConnection, dict], Coroutine]]
-    _consecutive_err_count: dict[str, int]
-    _recv_time: int = 0
+    _sessions: dict[ServerConnection, Session]
 
 
     def __init__(self, database_bundle: DbBundle, config: Config, env: dict)-> None:
@@ -42,37 +82,54 @@ class WssHandler:
         self._config = config
         self._env = env
         
-        self._bg_tasks: set[asyncio.Task] = set()
+        self._sessions = {}
+        self._detached: set[asyncio.Task] = set() # server-owned, outlives the session that started it
         
         self._dbs = database_bundle
         self._handlers = {
+            "hello": self._on_hello,
             "query": self._on_query,
             "store": self._on_store,
             "process": self._on_process,
             "evict": self._on_evict,
             "clear": self._on_clear,
             "count": self._on_count, 
+            "batch": self._on_batch,
+            "export": self._on_export,
+            "import": self._on_import,
+            "snapshot": self._on_snapshot,
+            "stats": self._on_stats,
+            "profile": self._on_profile,
             "close": self._on_close,
             "unhandled": self._on_unhandled,
         }
-        self._consecutive_err_count = {
-            "send": 0
-        }
-
         self._ai = AI(
             base_url=config.openllm.base_url,
             model_name=config.openllm.model,
             api_key=env["OPENAI_API_KEY"],
             config=config
         )
-        self.compressor = Compressor(ai=self._ai, long_vdb=self._dbs.long_term, config=self._config)
-
-        self._compress_q: asyncio.Queue[tuple[str, list[Memory]]] = asyncio.Queue(maxsize=8)
-        self._compress_worker_task = asyncio.create_task(self._compressor_worker())
-
-        self.stm_merger = StmMerger(ai=self._ai, vdb=self._dbs.short_term, config=self._config)
+        self.compressor = Compressor(ai=self._ai, long_vdb=self._dbs.long_term, config=self._config, gate=self._dbs.gate)
+        self.stm_merger = StmMerger(ai=self._ai, vdb=self._dbs.short_term, config=self._config, gate=self._dbs.gate)
+        self._snapshotter = Snapshotter(config.snapshot)
+        self._query_cache = QueryCache(config.query_cache)
+
+        # every piece of LLM-dependent work is journaled here before its source data is gone
+        self._jobs = JobQueue(
+            retry_base=config.jobs.retry_base,
+            retry_max=config.jobs.retry_max,
+            max_attempts=config.jobs.max_attempts,
+            synchronous=config.jobs.synchronous,
+        )
+        self._jobs.register("compress", self._job_compress, concurrency=config.jobs.compress_concurrency, ordered=True)
+        self._jobs.register("process", self._job_process, concurrency=config.jobs.process_concurrency)
+        self._jobs.register("stm_merge", self._job_stm_merge, concurrency=config.jobs.stm_merge_concurrency)
+        self._jobs.start()
 
         self._dbs.short_term.set_on_evict(self._on_evict_chunk)
+        self._dbs.short_term.set_backpressure(self._is_compress_backlogged)
+        metrics.QUEUE_DEPTH.set_function(self._queue_depths)
+        metrics.WS_IN_FLIGHT.set_function(lambda: float(sum(s.running for s in list(self._sessions.values()))))
         self._logger.info("initialized wss handler")
         return
 
@@ -83,17 +140,49 @@ class WssHandler:
         await self._close_server
 
 
+    def _session(self, conn: ServerConnection)-> Session:
+        if isinstance(conn, _BatchItemConn):
+            conn = conn.conn
+        session = self._sessions.get(conn)
+        if session is None:
+            raise ConnectionClosed(None, None) # handle() already cleaned up after the connection
+        return session
+
+
+    def _wire(self, conn: ServerConnection)-> WireSession:
+        return self._session(conn).wire
+
+
+    def _detach(self, cr: Coroutine)-> asyncio.Task:
+        """Hands work to the server, so closing the session that started it does not cancel it."""
+        task = asyncio.create_task(cr)
+        self._detached.add(task)
+        task.add_done_callback(self._on_detached_done)
+        return task
+
+
+    def _on_detached_done(self, task: asyncio.Task)-> None:
+        self._detached.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            # the session may be gone, nobody else sees this
+            self._logger.warning("detached work failed: %s", task.exception())
+
+
     async def _send(self, conn: ServerConnection, data: dict)-> None:
+        if isinstance(conn, _BatchItemConn):
+            conn.sent.append(data)
+            return
+        session = self._session(conn)
         try:
-            json_data = json.dumps(data)
-            if not hasattr(conn, "_send_lock"):
-                conn._send_lock = asyncio.Lock()
-            async with conn._send_lock:
-                await conn.send(json_data, text=True)
+            frame, is_text = session.wire.encode(data)
+            async with session.send_lock:
+                await conn.send(frame, text=is_text)
             
-            self._logger.info("recv->send latency: %d", int(time.time() * 1_000) - self._recv_time)
-            self._logger.info("sent: %s", json_data)
-            self._consecutive_err_count["send"] = 0
+            start = _request_start.get()
+            latency_ms = int((time.perf_counter() - start) * 1_000) if start is not None else None
+            self._logger.info("sent", extra=kv(type=data.get("type"), uid=data.get("uid"), latency_ms=latency_ms))
+            self._logger.debug("sent payload: %s", Payload(data))
+            session.send_errors = 0
 
         except ConnectionClosed as e:
             raise e
@@ -102,11 +191,12 @@ class WssHandler:
             # should not be able to be thrown, would trigger inifine loop
             # since we are using _send_error in the exception handling
             self._logger.error("error during sending: %s\n%s", str(e), traceback.format_exc())
-            self._consecutive_err_count["send"] = self._consecutive_err_count.get("send", 0) + 1
+            session.send_errors += 1
 
-            if self._consecutive_err_count.get("send", 0) > 5:
-                self._logger.error("could not recover after too many errors, closing _server.")
-                self._close_server.set_result(None)
+            if session.send_errors > 5:
+                # only this client is dropped, the others keep their connections
+                self._logger.error("could not recover after too many errors, closing connection of session %s.", session.id)
+                await conn.close(code=1011, reason="too many send errors")
     
 
     async def _send_error(self, conn: ServerConnection, e: Exception, id: str | None = None)-> None:
@@ -122,35 +212,61 @@ class WssHandler:
         await self._send(conn, obj)
 
 
+    async def _dispatch(self, conn: ServerConnection, msg_handler: Callable, msg_type: str, obj: dict)-> None:
+        """Runs one message handler and records it, timed from when the message was received."""
+        # unknown types share one label so clients can't grow the label set
+        label = msg_type if msg_type in self._handlers else "unhandled"
+        token = message_type.set(label)
+        status = "error"
+        try:
+            await msg_handler(conn, obj)
+            status = "ok"
+        finally:
+            message_type.reset(token)
+            start = _request_start.get()
+            if start is not None:
+                metrics.WS_REQUEST_SECONDS.observe(time.perf_counter() - start, type=label)
+            metrics.WS_MESSAGES.inc(type=label, status=status)
+
+
     async def handle(self, conn: ServerConnection)-> None:
+        session = Session(conn, max_in_flight=self._config.wss.max_in_flight)
+        self._sessions[conn] = session
+        metrics.WS_CONNECTIONS.inc()
+        try:
+            await self._handle(conn, session)
+        finally:
+            metrics.WS_CONNECTIONS.dec()
+            del self._sessions[conn]
+            await session.close()
+
+
+    async def _handle(self, conn: ServerConnection, session: Session)-> None:
 
         while True:
             try:
-                data = await conn.recv(decode=True)
+                # text frames come back as str, binary (msgpack) frames as bytes
+                data = await conn.recv()
             except ConnectionClosed:
                 # Should we close _server on connection end?
                 # Would limit to one connection per instance, but would make
                 # the app close by itself, which is massive.
                 # Would prevent addr already used errs
-                self._logger.info("connection closed on recv.")
-                if hasattr(conn, "_send_lock"):
-                    del conn._send_lock
-                for t in list(self._bg_tasks):
-                    t.cancel()
-                self._bg_tasks.clear()
+                self._logger.info("connection closed on recv, session %s.", session.id)
                 return
 
-            self._recv_time = int(time.time() * 1_000)
-            self._logger.info("received message: %s", data)
+            _request_start.set(time.perf_counter())
         
             try:
-                obj = json.loads(data)
+                obj = wire.decode(data)
             except Exception as e:
+                self._logger.debug("received undecodable payload: %s", Payload(data))
                 await self._send_error(conn, e)
                 continue
+            self._logger.debug("received payload: %s", Payload(obj))
 
             if not isinstance(obj, dict):
-                await self._send_error(conn, TypeError("json value sent from client is not a valid object with the shape {\"key\": value, ...}"))
+                await self._send_error(conn, TypeError("value sent from client is not a valid object with the shape {\"key\": value, ...}"))
                 continue
 
             if not "type" in obj:
@@ -166,11 +282,12 @@ class WssHandler:
             msg_handler = self._handlers.get(msg_type, self._on_unhandled)
 
             try:
-                # prevent long ops from blocking the recv loop
-                if msg_type in ("process", "evict"):
-                    async def _runner():
+                # everything else runs concurrently, responses are matched by uid. reading
+                # pauses while max_in_flight requests of this connection are running
+                if msg_type not in INLINE_TYPES:
+                    async def _runner(msg_handler=msg_handler, msg_type=msg_type, obj=obj):
                         try:
-                            await msg_handler(conn, obj)
+                            await self._dispatch(conn, msg_handler, msg_type, obj)
                         except ConnectionClosed:
                             self._logger.info("connection closed during %s", msg_type)
                         except Exception as e:
@@ -180,12 +297,12 @@ class WssHandler:
                             except Exception:
                                 self._logger.exception("failed to send error for background task")
 
-                    t = asyncio.create_task(_runner())
-                    self._bg_tasks.add(t)
-                    t.add_done_callback(lambda _t: self._bg_tasks.discard(_t))
+                    uid = obj.get("uid")
+                    colls, write = self._ordering(msg_type, obj)
+                    await session.spawn(_runner(), uid if isinstance(uid, str) else None, colls, write)
                     continue
 
-                await msg_handler(conn, obj)
+                await self._dispatch(conn, msg_handler, msg_type, obj)
 
             except ConnectionClosed:
                 self._logger.info("connection closed on send.")
@@ -198,14 +315,42 @@ class WssHandler:
 
 
 
+    def _ordering(self, msg_type: str, obj: dict)-> tuple[tuple[str, ...], bool]:
+        """(collections, is write) a request is ordered on, a batch by all of its ops."""
+        if not self._config.wss.ordered_writes:
+            return (), False
+        ops = obj.get("ops") if msg_type == "batch" else [obj]
+        if not isinstance(ops, list):
+            return (), False
+        ops = [op for op in ops if isinstance(op, dict) and op.get("type") in WRITE_TYPES + READ_TYPES]
+        colls = tuple({op["ai_name"] for op in ops if isinstance(op.get("ai_name"), str)})
+        return colls, any(op["type"] in WRITE_TYPES for op in ops)
+
+
+    async def _on_hello(self, conn: ServerConnection, obj: dict)-> None:
+        message = MsgHello.model_validate(obj)
+        session = self._session(conn)
+
+        # the reply still goes out in the previous encoding, the switch happens right after
+        frame, is_text = session.wire.encode({
+            "type": "hello",
+            "uid": message.uid,
+            "encoding": wire.pick_encoding(message.encodings),
+            "encodings": wire.available_encodings(),
+        })
+        async with session.send_lock:
+            await conn.send(frame, text=is_text)
+            encoding = session.wire.negotiate(message.encodings, message.fields)
+
+        self._logger.info("negotiated wire encoding=%s fields=%s", encoding, message.fields)
+        return
+
+
     async def _on_query(self, conn: ServerConnection, obj: dict)-> None:
         if obj.get("user", "") is None:
             obj["user"] = ""
         message = MsgQuery.model_validate(obj, by_alias=True)
-
-        short_query = []
-        long_query = []
-        user_query = []
+        fields = message.fields if message.fields is not None else self._wire(conn).fields
 
         response = {
             "type": "query",
@@ -213,54 +358,69 @@ class WssHandler:
             "from": message.from_,
         }
 
-        # run selected lookups in parallel
+        # run selected lookups in parallel, repeated ones are answered from the cache
         tasks = []
+        cache = self._query_cache
+        multi = isinstance(message.query, list)
+        queries = message.query if multi else [message.query]
+        query_key = (tuple(queries), message.user, message.mode, message.rank.model_dump_json() if message.rank is not None else None, message.dedup)
 
         if "stm" in message.from_:
             idx = message.from_.index("stm") # to get n of stm
             n = message.n[idx]
-            tasks.append(asyncio.to_thread(
-                self._dbs.short_term.query,
-                coll_name=message.ai_name,
-                query_str=message.query + f" ({message.user})",
-                n=n,
+            query_strs = [q + f" ({message.user})" for q in queries]
+            tasks.append(cache.get(
+                "stm", (message.ai_name, n, *query_key),
+                generation=self._dbs.short_term.generation(message.ai_name),
+                lookup=lambda query_strs=query_strs, n=n: self._vdb_lookup(self._dbs.short_term, message, queries, query_strs, n),
             ))
 
         if "ltm" in message.from_:
             idx = message.from_.index("ltm") # to get n of ltm
             n = message.n[idx]
-            tasks.append(asyncio.to_thread(
-                self._dbs.long_term.query,
-                coll_name=message.ai_name,
-                query_str=f"{message.query} ( {message.user} )",
-                n=n,
+            query_strs = [f"{q} ( {message.user} )" for q in queries]
+            tasks.append(cache.get(
+                "ltm", (message.ai_name, n, *query_key),
+                generation=self._dbs.long_term.generation(message.ai_name),
+                lookup=lambda query_strs=query_strs, n=n: self._vdb_lookup(self._dbs.long_term, message, queries, query_strs, n),
             ))
 
         if "users" in message.from_:
             idx = message.from_.index("users") # to get n of users
             n = message.n[idx]
-            tasks.append(asyncio.to_thread(
-                self._dbs.users.query,
-                coll_name=message.ai_name,
-                user=message.user,
-                n=n,
+            tasks.append(cache.get(
+                "users", (message.ai_name, message.user, n),
+                generation=self._dbs.users.generation(message.ai_name),
+                lookup=lambda n=n: asyncio.to_thread(
+                    self._dbs.users.query,
+                    coll_name=message.ai_name,
+                    user=message.user,
+                    n=n,
+                ),
             ))
 
         results = await asyncio.gather(*tasks) if tasks else []
 
-        # put results back in the same order the tasks were added
+        def _queried(per_query: list[list[QueriedMemory]])-> list:
+            out = [[{"memory": wire.project_memory(x.memory.to_dict(), fields), "distance": float(x.distance)} for x in found] for found in per_query]
+            return out if multi else out[0]
+
+        # put results back in the same order the tasks were added,
+        # with a list query stm/ltm hold one result list per query, users is shared
+        if multi:
+            response["queries"] = queries
         k = 0
         if "stm" in message.from_:
-            short_query = results[k] if k < len(results) else []
-            response["stm"] = [x.to_dict() for x in short_query]
+            short_query = results[k] if k < len(results) else [[] for _ in queries]
+            response["stm"] = _queried(short_query)
             k += 1
         if "ltm" in message.from_:
-            long_query = results[k] if k < len(results) else []
-            response["ltm"] = [x.to_dict() for x in long_query]
+            long_query = results[k] if k < len(results) else [[] for _ in queries]
+            response["ltm"] = _queried(long_query)
             k += 1
         if "users" in message.from_:
             user_query = results[k] if k < len(results) else []
-            response["users"] = [m.to_dict() for m in user_query]
+            response["users"] = [wire.project_memory(m.to_dict(), fields) for m in user_query]
             k += 1
 
         await self._send(conn, response)
@@ -268,9 +428,41 @@ class WssHandler:
 
 
 
+    def _vdb_lookup(self, vdb: VectorDataBase, message: MsgQuery, queries: list[str], query_strs: list[str], n: int)-> Coroutine:
+        return asyncio.to_thread(self._vdb_lookup_sync, vdb, message, queries, query_strs, n)
+
+
+    def _vdb_lookup_sync(self, vdb: VectorDataBase, message: MsgQuery, queries: list[str], query_strs: list[str], n: int)-> list[list[QueriedMemory]]:
+        """query_strs carry the user hint for the embeddings, keyword lookups use the queries as sent.
+        With a rank spec, n * candidates are fetched and re-ranked here, on the worker thread."""
+        rank = message.rank
+        k = n * rank.candidates if rank is not None else n
+        with_embeddings = rank is not None and rank.mmr is not None
+
+        if message.mode == "lexical":
+            found = [vdb.query_lexical(message.ai_name, q, k, with_embeddings=with_embeddings) for q in queries]
+        elif message.mode == "hybrid":
+            found = vdb.query_hybrid_many(message.ai_name, query_strs, k, lexical_strs=queries, with_embeddings=with_embeddings)
+        else:
+            found = vdb.query_many(message.ai_name, query_strs, k, with_embeddings=with_embeddings)
+
+        if rank is not None:
+            found = [ranking.rerank(per_query, rank, n) for per_query in found]
+        if message.dedup and len(found) > 1:
+            found = ranking.dedup_across(found)
+        return found
+
+
     async def _on_store(self, conn: ServerConnection, obj: dict)-> None:
         message = MsgStore.model_validate(obj)
-        
+        # embeds on a worker thread, so pipelined requests keep running meanwhile
+        async with self._dbs.gate.writing():
+            await asyncio.to_thread(self._store_sync, message)
+        self._logger.info("stored memories.")
+        return
+
+
+    def _store_sync(self, message: MsgStore)-> None:
         for dest in message.to:
             for mem in message.memories:
                 match dest:
@@ -281,92 +473,179 @@ class WssHandler:
                     case "users":
                         if mem.user is None: continue # No user associated with mem
                         self._dbs.users.store(coll_name=message.ai_name, user=mem.user, memory=mem)
-        
-        self._logger.info("stored memories.")
         return
 
 
     async def _on_process(self, conn: ServerConnection, obj: dict)-> None:
         message = MsgProcess.model_validate(obj)
-        
+        session = self._session(conn)
+
+        async def _send_summary(summary: str, final: bool)-> None:
+            if session.closed:
+                return # the result is still stored, nobody is left to tell
+            try:
+                if not message.stream:
+                    if final:
+                        await self._send(conn, {"uid": message.uid, "type": "summary", "summary": summary})
+                    return
+                await self._send(conn, {
+                    "uid": message.uid,
+                    "type": "summary",
+                    "summary": summary,
+                    "partial": not final,
+                })
+            except ConnectionClosed:
+                return
+
+        # journaled first: if the backend fails, the job is retried in the background
+        job_id = await self._jobs.put_async("process", message.ai_name, message.model_dump(mode="json"), dispatch=False)
+        # detached: a client going away mid-call must not throw the LLM result away
+        work = self._detach(self._jobs.run_claimed(job_id, self._run_process(job_id, message, _send_summary)))
+        await asyncio.shield(work)
+        self._logger.info("processed messages from client.")
+        return
+
+
+    async def _run_process(self, job_id: str, message: MsgProcess, on_summary: Callable | None)-> None:
+        # summary is sent from within process, as soon as it is generated
         res = await self._ai.process(
             ai_name=message.ai_name,
             context=message.context if message.context is not None else [],
             messages=message.messages,
+            on_summary=on_summary,
+            stream=message.stream,
         )
 
-        await self._send(conn, {
-            "uid": message.uid,
-            "type": "summary",
-            "summary": res.summary,
-        })
-
         mem_time = int(time.time() * 1000.0) # timestamp in ms
 
         score = (res.emotional_intensity + res.importance) / 2.0
         lifetime = floor(score * self._config.long_vdb.max_memory_lifetime)
 
-        # store summary to STM
-        summary_mem = Memory(
+        # summary goes to STM, remember entries to STM + users
+        mems = [Memory(
             id=str(uuid.uuid4()),
             content=res.summary,
             user=None,
             time=mem_time,
             score=score,
             lifetime=lifetime,
-        )
-        if self.stm_merger:
-            await self.stm_merger.merge_and_store(
-                ai_name=message.ai_name,
-                new_mem=summary_mem,
-                context=message.context if message.context is not None else []
-            )
-        else:
-            self._dbs.short_term.store(message.ai_name, summary_mem)
-
+        )]
         for rem in res.remember:
-            mem = Memory(
+            mems.append(Memory(
                 id=str(uuid.uuid4()),
                 content=rem.text,
                 user=rem.user,
                 time=mem_time,
                 score=score,
                 lifetime=lifetime,
-            )
-            if self.stm_merger:
-                await self.stm_merger.merge_and_store(
-                    ai_name=message.ai_name,
-                    new_mem=mem,
-                    context=message.context if message.context is not None else []
-                )
-            else:
-                self._dbs.short_term.store(message.ai_name, mem)
-            if rem.user is not None:
-                self._dbs.users.store(coll_name=message.ai_name, user=rem.user, memory=mem)
-        
-        self._logger.info("processed messages from client.")
+            ))
+
+        # near-duplicates within one result are folded locally, before any merge call
+        mems = self.stm_merger.deduper.dedup_batch(mems)
+
+        context = [x.model_dump(mode="json") for x in message.context] if message.context is not None else []
+        payloads = [{"memory": mem.to_dict(), "context": context} for mem in mems]
+
+        # the LLM result is swapped for one job per memory, so a failing merge
+        # is retried alone without calling process again
+        merge_ids = await self._jobs.replace(job_id, [("stm_merge", message.ai_name, p) for p in payloads])
+        for merge_id, payload in zip(merge_ids, payloads):
+            try:
+                await self._jobs.run_claimed(merge_id, self._store_processed(message.ai_name, payload))
+            except Exception as e:
+                self._logger.warning("storing processed memory failed, will be retried: %s", e)
+        return
+
+
+    async def _store_processed(self, ai_name: str, payload: dict)-> None:
+        mem = Memory.from_dict(payload["memory"])
+        context = [OpenLlmMsg.model_validate(x) for x in payload.get("context", [])]
+
+        stored = True
+        if self.stm_merger:
+            stored = await self.stm_merger.merge_and_store(ai_name=ai_name, new_mem=mem, context=context)
+        else:
+            # may evict, which commits compression jobs: never on the loop
+            async with self._dbs.gate.writing():
+                await asyncio.to_thread(self._dbs.short_term.store, ai_name, mem)
+        if stored and mem.user is not None:
+            async with self._dbs.gate.writing():
+                await asyncio.to_thread(self._dbs.users.store, coll_name=ai_name, user=mem.user, memory=mem)
         return
 
 
+    async def _job_process(self, job: Job)-> None:
+        # replayed or retried, no client is waiting for the summary anymore
+        await self._run_process(job.id, MsgProcess.model_validate(job.payload), None)
+
+
+    async def _job_stm_merge(self, job: Job)-> None:
+        await self._store_processed(job.coll, job.payload)
+
+
+    async def _job_compress(self, job: Job)-> None:
+        # batches queued behind this one in the same collection get their LLM
+        # compression step in parallel, LTM merges then run strictly in order
+        jobs = [job, *self._jobs.claim_following(job, self._config.compression.fanout - 1)]
+        if len(jobs) > 1:
+            self._logger.info("compress fan-out: coll=%s batches=%d", job.coll, len(jobs))
+
+        plans = await asyncio.gather(
+            *(self.compressor.compress_llm_async(j.coll, [Memory.from_dict(x) for x in j.payload["mems"]]) for j in jobs),
+            return_exceptions=True,
+        )
+
+        for i, (j, plan) in enumerate(zip(jobs, plans)):
+            try:
+                if isinstance(plan, BaseException):
+                    raise plan
+                if plan is not None:
+                    await self.compressor.merge_into_ltm_async(j.coll, *plan)
+            except Exception as e:
+                for later in jobs[i+1:]:
+                    self._jobs.release(later)
+                if j is job:
+                    raise
+                self._jobs.fail(j.id, e)
+                return
+            if j is not job:
+                self._jobs.ack(j.id)
+
+
     async def _on_evict(self, conn: ServerConnection, obj: dict)-> None:
         message = MsgEvict.model_validate(obj)
-        self._dbs.short_term.evict_all(message.ai_name)
+        # chunked deletes plus a job commit per chunk, kept off the event loop
+        async with self._dbs.gate.writing():
+            await asyncio.to_thread(self._dbs.short_term.evict_all, message.ai_name)
         self._logger.info("evicted messages from collection: %s", message.ai_name)
         return
         
     def _on_evict_chunk(self, coll_name: str, mems: list[Memory]) -> None:
         self._logger.info("on_evict_chunk: coll=%s batch=%d", coll_name, len(mems))
-        # Try to enqueue quickly; if queue is full, fall back to fire-and-forget off-thread task.
-        try:
-            self._compress_q.put_nowait((coll_name, mems))
-            self._logger.info("on_evict_chunk: queued for async compression (size=%d)", self._compress_q.qsize())
-        except asyncio.QueueFull:
-            self._logger.warning("compress queue full; running this chunk off-thread immediately")
-            asyncio.create_task(self.compressor.compress_batch_async(coll_name, mems))
+        # committed before EvictingVdb deletes the memories from STM. small chunks
+        # are folded into the collection's pending batch instead of becoming jobs of their own
+        self._jobs.put_coalesced(
+            kind="compress",
+            coll=coll_name,
+            key="mems",
+            items=[m.to_dict() for m in mems],
+            max_items=self._config.compression.batch_size,
+            linger=self._config.compression.coalesce_linger,
+        )
+        self._logger.info("on_evict_chunk: compression backlog for '%s': %d batch(es)", coll_name, self._jobs.pending_count("compress", coll_name))
+
+
+    def _is_compress_backlogged(self, coll_name: str)-> bool:
+        return self._jobs.pending_count("compress", coll_name) >= self._config.compression.backlog_high_watermark
 
 
     async def _on_clear(self, conn: ServerConnection, obj: dict) -> None:
         msg = MsgClear.model_validate(obj)
+        async with self._dbs.gate.writing():
+            await asyncio.to_thread(self._clear_sync, msg)
+
+
+    def _clear_sync(self, msg: MsgClear)-> None:
         if msg.target == "stm":
             self._dbs.short_term.clear(msg.ai_name)
         elif msg.target == "ltm":
@@ -381,13 +660,13 @@ class WssHandler:
     async def _on_close(self, conn: ServerConnection, obj: dict)-> None:
         _ = MsgClose.model_validate(obj)
         self._logger.info("received close message.")
-        self._compress_worker_task.cancel()
         self._close_server.set_result(None)
-        if hasattr(conn, "_send_lock"):
-            del conn._send_lock
-        for t in list(self._bg_tasks):
+        for session in list(self._sessions.values()):
+            await session.close()
+        for t in list(self._detached):
             t.cancel()
-        self._bg_tasks.clear()
+        # unfinished jobs stay on disk and are replayed on next start
+        await self._jobs.stop()
         return
         
         
@@ -400,28 +679,171 @@ class WssHandler:
             "ai_name": message.ai_name,
         }
         if "stm" in message.from_:
-            resp["stm"] = self._dbs.short_term.count(message.ai_name)
+            resp["stm"] = await asyncio.to_thread(self._dbs.short_term.count, message.ai_name)
         if "ltm" in message.from_:
-            resp["ltm"] = self._dbs.long_term.count(message.ai_name)
+            resp["ltm"] = await asyncio.to_thread(self._dbs.long_term.count, message.ai_name)
 
         await self._send(conn, resp)
 
 
-    async def _on_unhandled(self, conn: ServerConnection, obj: dict)-> None:
-        self._logger.info("received unhandled message.")
-        raise ValueError("received message with unhandled message type: " + json.dumps(obj))
+    async def _run_batch_item(self, conn: ServerConnection, batch_uid: str, idx: int, op: dict)-> dict:
+        op_type = op.get("type")
+        op_uid = op.get("uid")
+        if not isinstance(op_uid, str):
+            op_uid = f"{batch_uid}:{idx}"
+            op = {**op, "uid": op_uid}
+
+        result = {"type": op_type, "uid": op_uid}
+        if op_type not in BATCHABLE_TYPES:
+            result.update(ok=False, error=f"message type {op_type!r} is not allowed in a batch")
+            return result
+
+        # handlers validate their own Msg* model, what they send is kept as the item's response
+        item_conn = _BatchItemConn(conn)
+        token = message_type.set(op_type)
+        try:
+            await self._handlers[op_type](item_conn, op)
+        except ConnectionClosed:
+            raise
+        except Exception as e:
+            result.update(ok=False, error=str(e))
+            return result
+        finally:
+            message_type.reset(token)
 
+        # streamed process summaries: only the final one is kept
+        result.update(ok=True, response=item_conn.sent[-1] if item_conn.sent else None)
+        return result
+
+
+    async def _on_batch(self, conn: ServerConnection, obj: dict)-> None:
+        message = MsgBatch.model_validate(obj)
+
+        if message.parallel:
+            results = await asyncio.gather(*[
+                self._run_batch_item(conn, message.uid, i, op) for i, op in enumerate(message.ops)
+            ])
+        else:
+            results = [await self._run_batch_item(conn, message.uid, i, op) for i, op in enumerate(message.ops)]
+
+        failed = sum(1 for r in results if not r["ok"])
+        self._logger.info("ran batch: ops=%d parallel=%s failed=%d", len(results), message.parallel, failed)
+        await self._send(conn, {
+            "type": "batch",
+            "uid": message.uid,
+            "results": list(results),
+        })
+        return
 
-    async def _compressor_worker(self) -> None:
-        self._logger.info("compressor worker: started")
+
+    async def _on_export(self, conn: ServerConnection, obj: dict)-> None:
+        message = MsgExport.model_validate(obj, by_alias=True)
+        page_size = min(message.page_size, self._config.transfer.max_page_size)
+        with_embeddings = message.embeddings and message.from_ != "users"
+
+        offset = 0
+        if message.cursor is not None:
+            tier, coll_name, offset = transfer.decode_cursor(message.cursor)
+            if tier != message.from_ or coll_name != message.ai_name:
+                raise ValueError("export cursor belongs to a different collection")
+
+        pages = 0
+        total = 0
         while True:
-            coll_name, mems = await self._compress_q.get()
-            try:
-                size = self._config.compression.batch_size
-                for i in range(0, len(mems), size):
-                    sub = mems[i:i+size]
-                    await self.compressor.compress_batch_async(coll_name, sub)
-            except Exception as e:
-                self._logger.exception("compression failed during eviction for '%s': %s", coll_name, e)
-            finally:
-                self._compress_q.task_done()
+            page = await asyncio.to_thread(transfer.read_page, self._dbs, message.from_, message.ai_name, offset, page_size, with_embeddings)
+            pages += 1
+            total += len(page.mems)
+            done = page.next_offset is None
+
+            resp = {
+                "type": "export",
+                "uid": message.uid,
+                "from": message.from_,
+                "ai_name": message.ai_name,
+                "memories": [m.to_dict() for m in page.mems],
+                "cursor": None if done else transfer.encode_cursor(message.from_, message.ai_name, page.next_offset),
+                "done": done,
+            }
+            if with_embeddings:
+                resp["embeddings"] = page.embeddings
+            # one page in flight at a time: the next one is read once this one is written out
+            await self._send(conn, resp)
+
+            if done or (message.max_pages is not None and pages >= message.max_pages):
+                break
+            offset = page.next_offset
+
+        self._logger.info("exported %s/%s: pages=%d mems=%d done=%s", message.from_, message.ai_name, pages, total, done)
+        return
+
+
+    async def _on_import(self, conn: ServerConnection, obj: dict)-> None:
+        message = MsgImport.model_validate(obj)
+        if len(message.memories) > self._config.transfer.max_page_size:
+            raise ValueError(f"import page too large: {len(message.memories)} > {self._config.transfer.max_page_size}")
+
+        embeddings = message.embeddings if message.to != "users" else None
+        async with self._dbs.gate.writing():
+            written = await asyncio.to_thread(transfer.write_page, self._dbs, message.to, message.ai_name, message.memories, embeddings)
+
+        self._logger.info("imported %s/%s: mems=%d embedded=%s", message.to, message.ai_name, written, embeddings is None)
+        await self._send(conn, {
+            "type": "import",
+            "uid": message.uid,
+            "to": message.to,
+            "ai_name": message.ai_name,
+            "count": written,
+        })
+        return
+
+
+    async def _on_snapshot(self, conn: ServerConnection, obj: dict)-> None:
+        message = MsgSnapshot.model_validate(obj)
+        result = await self._snapshotter.take(self._dbs.gate)
+        await self._send(conn, {"type": "snapshot", "uid": message.uid, **result})
+        return
+
+
+    def _queue_depths(self)-> dict[tuple[str, ...], float]:
+        stats = self._jobs.stats()
+        depths = {(f"jobs_{kind}",): float(stats["pending"].get(kind, 0)) for kind in stats["workers"]}
+        depths[("llm_governor",)] = float(self._ai.governor.queue_depth())
+        return depths
+
+
+    async def _on_stats(self, conn: ServerConnection, obj: dict)-> None:
+        message = MsgStats.model_validate(obj)
+        await self._send(conn, {
+            "type": "stats",
+            "uid": message.uid,
+            "metrics": metrics.REGISTRY.snapshot(),
+            "jobs": self._jobs.stats(),
+            "llm_governor": self._ai.governor.stats(),
+            "llm_usage": self._ai.usage,
+        })
+        return
+
+
+    async def _on_profile(self, conn: ServerConnection, obj: dict)-> None:
+        message = MsgProfile.model_validate(obj)
+        conf = self._config.profiling
+
+        if message.action == "start":
+            duration = min(message.duration or conf.max_duration, conf.max_duration)
+            result = PROFILER.start(conf, scope=message.scope, duration=duration)
+        elif message.action == "stop":
+            if not PROFILER.running:
+                raise RuntimeError("no profile is running")
+            # joins the sampler thread, which writes the files
+            await asyncio.to_thread(PROFILER.stop)
+            result = PROFILER.status()
+        else:
+            result = PROFILER.status()
+
+        await self._send(conn, {"type": "profile", "uid": message.uid, "action": message.action, **result})
+        return
+
+
+    async def _on_unhandled(self, conn: ServerConnection, obj: dict)-> None:
+        self._logger.info("received unhandled message.")
+        raise ValueError("received message with unhandled message type: " + json.dumps(obj))
@@ -0,0 +1,69 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from src.ai import AI
+from src.config import Config, HedgeConfig
+
+
+def _ai(delays: list[float], hedge: HedgeConfig | None = None)-> tuple[AI, list[int]]:
+    """AI whose completions take delays[i] seconds for the i-th request."""
+    config = Config(process_hedge=hedge or HedgeConfig(enabled=True, min_delay=0.05, max_delay=0.05))
+    ai = AI(api_key="test", model_name="m", config=config)
+    calls: list[int] = []
+
+    async def parse(**kwargs):
+        i = len(calls)
+        calls.append(i)
+        await asyncio.sleep(delays[i])
+        return SimpleNamespace(usage=None, attempt=i)
+
+    ai.client = SimpleNamespace(beta=SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=parse))))
+    return ai, calls
+
+
+def test_hedge_win_records_the_time_the_caller_waited():
+    ai, calls = _ai([1.0, 0.05])
+
+    async def main():
+        return await ai._hedged_parse("process", 10, model="m")
+
+    completion = asyncio.run(main())
+    assert completion.attempt == 1 and calls == [0, 1]
+    samples = list(ai._get_latency("m", "process").samples)
+    assert len(samples) == 1 # one call, one sample, the cancelled primary adds none
+    assert 0.1 <= samples[0] < 1.0 # hedge delay + secondary, never just the secondary
+    assert ai.usage["process"]["hedge_wins"] == 1
+
+
+def test_fast_primary_is_not_hedged():
+    ai, calls = _ai([0.0])
+    asyncio.run(ai._hedged_parse("process", 10, model="m"))
+    assert calls == [0]
+    assert ai._get_latency("m", "process").count() == 1
+
+
+def test_timed_out_call_still_adds_a_sample():
+    ai, _ = _ai([1.0])
+
+    async def main():
+        await asyncio.wait_for(ai._timed_parse("process", 10, model="m"), timeout=0.05)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(main())
+    samples = list(ai._get_latency("m", "process").samples)
+    assert len(samples) == 1 and samples[0] >= 0.05
+
+
+def test_timed_out_hedged_call_adds_one_sample():
+    ai, calls = _ai([1.0, 1.0])
+
+    async def main():
+        await asyncio.wait_for(ai._hedged_parse("process", 10, model="m"), timeout=0.2)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(main())
+    assert calls == [0, 1]
+    samples = list(ai._get_latency("m", "process").samples)
+    assert len(samples) == 1 and samples[0] >= 0.2
@@ -0,0 +1,72 @@
+from src.config import DedupConfig
+from src.dedup import Deduper, normalize_text, simhash, text_hash
+from src.memory import Memory, QueriedMemory
+
+
+def _mem(content: str, user: str | None = "u1", score: float | None = None)-> Memory:
+    return Memory(id=content, content=content, time=0, user=user, score=score)
+
+
+def test_exact_and_near_duplicates_are_dropped():
+    deduper = Deduper(DedupConfig())
+    mems = [
+        _mem("Alice likes green tea.", score=0.2),
+        _mem("alice LIKES green tea!", score=0.9),
+        _mem("Bob has a dog named Rex."),
+        _mem("Alice likes green tea.", user="u2"), # another user's memory is never a duplicate
+    ]
+    kept = deduper.dedup_batch(mems)
+    assert [m.content for m in kept] == ["Alice likes green tea.", "Bob has a dog named Rex.", "Alice likes green tea."]
+    assert kept[0].score == 0.9 # folded from the dropped duplicate
+
+
+def test_non_ascii_texts_keep_their_words():
+    assert normalize_text("Привет, МИР") == "привет мир"
+    assert normalize_text("ＡＢＣ　ｄｅｆ") == "abc def" # full-width forms
+    assert normalize_text("I don't know") == "i don't know"
+    assert text_hash("猫が好きです。") != text_hash("犬が嫌いです。")
+    assert text_hash("Я люблю чай") != text_hash("Он любит кофе")
+
+
+def test_distinct_non_ascii_memories_are_all_kept():
+    deduper = Deduper(DedupConfig())
+    mems = [
+        _mem("ユーザーは猫が好きです"),
+        _mem("ユーザーは東京に住んでいます"),
+        _mem("Пользователь любит зелёный чай"),
+        _mem("Пользователь живёт в Москве"),
+    ]
+    assert deduper.dedup_batch(mems) == mems
+
+
+def test_repeated_non_ascii_memory_is_a_duplicate():
+    deduper = Deduper(DedupConfig())
+    mems = [_mem("ユーザーは猫が好きです。"), _mem("ユーザーは猫が好きです！"), _mem("Пользователь любит чай."), _mem("пользователь ЛЮБИТ чай")]
+    assert [m.content for m in deduper.dedup_batch(mems)] == ["ユーザーは猫が好きです。", "Пользователь любит чай."]
+
+
+def test_text_without_words_never_matches_by_hash():
+    assert text_hash("!!!") is None
+    assert simhash("🎉🎉") is None
+    deduper = Deduper(DedupConfig())
+    mems = [_mem("🎉🎉"), _mem("😢"), _mem("..."), _mem("😢")]
+    assert [m.content for m in deduper.dedup_batch(mems)] == ["🎉🎉", "😢", "..."]
+
+
+def test_find_duplicate_by_distance_or_text():
+    deduper = Deduper(DedupConfig(min_cosine=0.95))
+    mem = _mem("ユーザーは猫が好きです")
+    far = QueriedMemory(memory=_mem("ユーザーは東京に住んでいます"), distance=0.8)
+    same_text = QueriedMemory(memory=_mem("ユーザーは猫が好きです。"), distance=0.8)
+    close = QueriedMemory(memory=_mem("something else entirely"), distance=0.05)
+    other_user = QueriedMemory(memory=_mem("ユーザーは猫が好きです", user="u2"), distance=0.0)
+
+    assert deduper.find_duplicate(mem, [far]) is None
+    assert deduper.find_duplicate(mem, [other_user, far, same_text]) is same_text
+    assert deduper.find_duplicate(mem, [close]) is close
+
+
+def test_disabled_keeps_everything():
+    deduper = Deduper(DedupConfig(enabled=False))
+    mems = [_mem("same"), _mem("same")]
+    assert deduper.dedup_batch(mems) == mems
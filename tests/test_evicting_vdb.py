@@ -0,0 +1,118 @@
+from src.memory import Memory
+from src.vdbs.evicting_vdb import EvictingVdb
+from src.vdbs.vector_database import VectorDataBase
+
+
+class _ListVdb(VectorDataBase):
+    """In-memory collections, oldest first."""
+
+    def __init__(self)-> None:
+        self.colls: dict[str, list[Memory]] = {}
+        self.removes: list[list[str]] = []
+        return
+
+    def store(self, coll_name: str, memory: Memory)-> None:
+        self.colls.setdefault(coll_name, []).append(memory)
+
+    def store_many(self, coll_name: str, memories: list[Memory], embeddings: list[list[float]] | None = None)-> None:
+        self.colls.setdefault(coll_name, []).extend(memories)
+
+    def remove(self, coll_name: str, memory_id: str)-> None:
+        self.remove_many(coll_name, [memory_id])
+
+    def remove_many(self, coll_name: str, memory_ids: list[str])-> None:
+        self.removes.append(list(memory_ids))
+        self.colls[coll_name] = [m for m in self.colls.get(coll_name, []) if m.id not in memory_ids]
+
+    def peek_oldest(self, coll_name: str, n: int | None = 1)-> list[Memory]:
+        return list(self.colls.get(coll_name, [])[:n])
+
+    def pop_oldest(self, coll_name: str, n: int | None = 1)-> list[Memory]:
+        mems = self.peek_oldest(coll_name, n)
+        self.remove_many(coll_name, [m.id for m in mems])
+        return mems
+
+    def count(self, coll_name: str)-> int:
+        return len(self.colls.get(coll_name, []))
+
+
+def _mems(n: int, start: int = 0)-> list[Memory]:
+    return [Memory(id=f"m{i}", content=f"memory {i}", time=i) for i in range(start, start + n)]
+
+
+def _vdb(**kwargs)-> tuple[EvictingVdb, _ListVdb, list[list[str]]]:
+    stm, ltm = _ListVdb(), _ListVdb()
+    vdb = EvictingVdb(stm, ltm, **kwargs)
+    evicted: list[list[str]] = []
+    vdb.set_on_evict(lambda coll, mems: evicted.append([m.id for m in mems]))
+    return vdb, stm, evicted
+
+
+def test_overflow_is_evicted_oldest_first():
+    vdb, stm, evicted = _vdb(max_size_before_evict=10)
+    vdb.store_many("a", _mems(13))
+    assert evicted == [["m0", "m1", "m2"]]
+    assert [m.id for m in stm.colls["a"]] == [f"m{i}" for i in range(3, 13)]
+
+
+def test_a_chunk_is_removed_in_one_call():
+    vdb, stm, evicted = _vdb(max_size_before_evict=10)
+    vdb.store_many("a", _mems(600))
+    assert [len(c) for c in evicted] == [256, 256, 78]
+    assert [len(r) for r in stm.removes] == [256, 256, 78]
+    assert vdb.count("a") == 10
+
+
+def test_failing_handler_keeps_the_memories():
+    stm, ltm = _ListVdb(), _ListVdb()
+    vdb = EvictingVdb(stm, ltm, max_size_before_evict=2)
+
+    def fail(coll: str, mems: list[Memory])-> None:
+        raise RuntimeError("sink down")
+
+    vdb.set_on_evict(fail)
+    try:
+        vdb.store_many("a", _mems(3))
+    except RuntimeError:
+        pass
+    assert vdb.count("a") == 3
+
+
+def test_backlogged_sink_defers_up_to_max_deferred():
+    backlogged = {"a"}
+    vdb, stm, evicted = _vdb(max_size_before_evict=10, evict_min_batch=5, max_deferred=4)
+    vdb.set_backpressure(lambda coll: coll in backlogged)
+
+    vdb.store_many("a", _mems(14))
+    assert evicted == [] # 4 over the limit, deferred
+
+    vdb.store_many("a", _mems(2, start=14))
+    assert evicted == [["m0", "m1"]] # only what is past max_deferred, not the min batch
+    assert vdb.count("a") == 14
+
+    backlogged.clear()
+    vdb.store("a", Memory(id="m16", content="memory 16", time=16))
+    assert evicted[-1] == ["m2", "m3", "m4", "m5", "m6"]
+    assert vdb.count("a") == 10
+
+
+def test_fraction_and_min_batch():
+    vdb, _, evicted = _vdb(max_size_before_evict=10, evict_fraction=0.5, evict_min_batch=2)
+    vdb.store_many("a", _mems(11))
+    assert len(evicted[0]) == 5 # half of 11, more than the overflow and the min batch
+
+
+def test_evict_all_hands_everything_over():
+    vdb, stm, evicted = _vdb()
+    vdb.store_many("a", _mems(300))
+    vdb.evict_all("a")
+    assert [len(c) for c in evicted] == [256, 44]
+    assert vdb.count("a") == 0
+
+
+def test_without_handler_memories_are_copied_to_dest():
+    stm, ltm = _ListVdb(), _ListVdb()
+    vdb = EvictingVdb(stm, ltm, max_size_before_evict=1)
+    vdb.store_many("a", _mems(3))
+    assert [m.id for m in ltm.colls["a"]] == ["m0", "m1"]
+    assert [m.id for m in stm.colls["a"]] == ["m2"]
@@ -0,0 +1,305 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src.job_queue import Job, JobQueue
+
+
+@pytest.fixture(autouse=True)
+def _db_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(JobQueue, "_DB_DIR", str(tmp_path))
+
+
+async def _until(cond, timeout: float = 5.0)-> None:
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached in time")
+        await asyncio.sleep(0.01)
+
+
+def _pending_on_disk()-> list[tuple[str, str, int, int]]:
+    q = JobQueue()
+    rows = q._db.execute("SELECT kind, coll, attempts, dead FROM jobs ORDER BY created").fetchall()
+    q._db.close()
+    return rows
+
+
+def test_put_is_replayed_after_restart():
+    q = JobQueue()
+    q.put("process", "a", {"n": 1})
+    q._db.close() # crash before start()
+
+    seen: list[dict] = []
+
+    async def main():
+        q = JobQueue()
+
+        async def handler(job: Job)-> None:
+            seen.append(job.payload)
+
+        q.register("process", handler)
+        q.start()
+        await _until(lambda: seen)
+        await q.stop()
+
+    asyncio.run(main())
+    assert seen == [{"n": 1}]
+    assert _pending_on_disk() == [] # acked
+
+
+def test_failed_job_is_retried_then_parked_as_dead():
+    calls: list[int] = []
+
+    async def main():
+        q = JobQueue(retry_base=0.01, retry_max=0.01, max_attempts=3)
+
+        async def handler(job: Job)-> None:
+            calls.append(job.attempts)
+            raise RuntimeError("backend down")
+
+        q.register("process", handler)
+        q.start()
+        await q.put_async("process", "a", {})
+        await _until(lambda: len(calls) == 3)
+        await _until(lambda: q.pending_count("process") == 0)
+        await q.stop()
+
+    asyncio.run(main())
+    assert calls == [0, 1, 2]
+    assert _pending_on_disk() == [("process", "a", 3, 1)]
+
+
+def test_run_claimed_acks_or_schedules_retry():
+    async def main():
+        q = JobQueue(retry_base=60.0)
+        q.register("process", lambda job: asyncio.sleep(0))
+        q.start()
+
+        ok_id = await q.put_async("process", "a", {}, dispatch=False)
+        await q.run_claimed(ok_id, asyncio.sleep(0))
+
+        bad_id = await q.put_async("process", "a", {}, dispatch=False)
+
+        async def fails()-> None:
+            raise RuntimeError("nope")
+
+        with pytest.raises(RuntimeError):
+            await q.run_claimed(bad_id, fails())
+        assert q.stats()["delayed"] == 1
+        await q.stop()
+
+    asyncio.run(main())
+    assert _pending_on_disk() == [("process", "a", 1, 0)]
+
+
+def test_replace_swaps_job_atomically():
+    async def main():
+        q = JobQueue()
+        q.register("process", lambda job: asyncio.sleep(0))
+        q.register("stm_merge", lambda job: asyncio.sleep(0))
+        q.start()
+        job_id = await q.put_async("process", "a", {}, dispatch=False)
+        new_ids = await q.replace(job_id, [("stm_merge", "a", {"i": 0}), ("stm_merge", "a", {"i": 1})])
+        assert len(new_ids) == 2
+        await q.stop() # the follow-ups were never run
+
+    asyncio.run(main())
+    assert _pending_on_disk() == [("stm_merge", "a", 0, 0), ("stm_merge", "a", 0, 0)]
+
+
+def test_ordered_lines_run_one_job_per_collection_in_order():
+    log: list[tuple[str, str, str]] = []
+    running: dict[str, int] = {}
+    fail_once = {"a0"}
+
+    async def main():
+        q = JobQueue(retry_base=0.05, retry_max=0.05)
+
+        async def handler(job: Job)-> None:
+            running[job.coll] = running.get(job.coll, 0) + 1
+            assert running[job.coll] == 1, "two jobs of one collection ran at once"
+            log.append(("start", job.coll, job.payload["id"]))
+            await asyncio.sleep(0.02)
+            running[job.coll] -= 1
+            if job.payload["id"] in fail_once:
+                fail_once.discard(job.payload["id"])
+                raise RuntimeError("retry me")
+            log.append(("done", job.coll, job.payload["id"]))
+
+        q.register("compress", handler, concurrency=4, ordered=True)
+        q.start()
+        for i in range(3):
+            await q.put_async("compress", "a", {"id": f"a{i}"})
+            await q.put_async("compress", "b", {"id": f"b{i}"})
+        await _until(lambda: sum(1 for e in log if e[0] == "done") == 6)
+        await q.stop()
+
+    asyncio.run(main())
+    for coll in "ab":
+        done = [e[2] for e in log if e[0] == "done" and e[1] == coll]
+        assert done == [f"{coll}0", f"{coll}1", f"{coll}2"]
+    # the failing head held back the rest of its line, b was not held back
+    starts = [e[2] for e in log if e[0] == "start"]
+    assert starts.index("a1") > starts.index("a0", starts.index("a0") + 1)
+    assert starts.index("b2") < starts.index("a1")
+
+
+def test_put_coalesced_from_threads_keeps_every_item():
+    seen: list[str] = []
+
+    async def main():
+        q = JobQueue()
+
+        async def handler(job: Job)-> None:
+            seen.extend(job.payload["mems"])
+
+        q.register("compress", handler, concurrency=2, ordered=True)
+        q.start()
+
+        def evict(coll: str)-> None:
+            for i in range(100):
+                q.put_coalesced("compress", coll, "mems", [f"{coll}{i}"], max_items=4, linger=0.01)
+
+        threads = [threading.Thread(target=evict, args=(c,)) for c in "abc"]
+        for t in threads:
+            t.start()
+        await _until(lambda: not any(t.is_alive() for t in threads))
+        await _until(lambda: len(seen) == 300)
+        await q.stop()
+
+    asyncio.run(main())
+    assert sorted(seen) == sorted(f"{c}{i}" for c in "abc" for i in range(100))
+    assert _pending_on_disk() == []
+
+
+def test_put_coalesced_appends_to_a_job_pending_at_startup():
+    q = JobQueue()
+    q.put_coalesced("compress", "a", "mems", ["x"], max_items=4)
+    q._db.close()
+
+    seen: list[list[str]] = []
+
+    async def main():
+        q = JobQueue()
+
+        async def handler(job: Job)-> None:
+            seen.append(job.payload["mems"])
+
+        q.register("compress", handler, ordered=True)
+        q.start()
+        # before the dispatcher first runs
+        assert q.put_coalesced("compress", "a", "mems", ["y"], max_items=4) == []
+        await _until(lambda: seen)
+        await q.stop()
+
+    asyncio.run(main())
+    assert seen == [["x", "y"]]
+    assert _pending_on_disk() == []
+
+
+def test_put_coalesced_commits_without_holding_the_loop():
+    seen: list[list[str]] = []
+    committing = threading.Event()
+
+    async def main():
+        q = JobQueue()
+
+        async def handler(job: Job)-> None:
+            seen.append(job.payload["mems"])
+
+        q.register("compress", handler, ordered=True)
+        q.start()
+        await asyncio.to_thread(q.put_coalesced, "compress", "a", "mems", ["a0"], 2, 0.05)
+
+        commit = q._commit_now
+
+        def slow_commit(*args, **kwargs)-> None:
+            committing.set()
+            time.sleep(0.3) # past the linger, the job comes due mid-commit
+            commit(*args, **kwargs)
+
+        q._commit_now = slow_commit
+        thread = threading.Thread(target=q.put_coalesced, args=("compress", "a", "mems", ["a1"], 2, 0.05))
+        thread.start()
+        await asyncio.to_thread(committing.wait)
+
+        start = time.monotonic()
+        with q._open_lock:
+            pass
+        assert time.monotonic() - start < 0.1
+
+        await _until(lambda: not thread.is_alive())
+        await _until(lambda: seen)
+        await q.stop()
+
+    asyncio.run(main())
+    assert seen == [["a0", "a1"]] # held back while it was being filled, then run with both
+    assert _pending_on_disk() == []
+
+
+def test_claim_following_fans_out_and_releases_on_failure():
+    merged: list[str] = []
+    batches: list[list[str]] = []
+    fail_once = {"a1"}
+
+    async def main():
+        q = JobQueue(retry_base=0.05, retry_max=0.05)
+
+        async def handler(job: Job)-> None:
+            jobs = [job, *q.claim_following(job, 2)]
+            batches.append([j.payload["id"] for j in jobs])
+            for i, j in enumerate(jobs):
+                if j.payload["id"] in fail_once:
+                    fail_once.discard(j.payload["id"])
+                    for later in jobs[i+1:]:
+                        q.release(later)
+                    if j is job:
+                        raise RuntimeError("merge failed")
+                    q.fail(j.id, RuntimeError("merge failed"))
+                    return
+                merged.append(j.payload["id"])
+                if j is not job:
+                    q.ack(j.id)
+
+        q.register("compress", handler, concurrency=2, ordered=True)
+        q.start()
+        # queued before the dispatcher first runs, so a0 finds the rest behind it
+        await asyncio.gather(*(q.put_async("compress", "a", {"id": f"a{i}"}) for i in range(4)))
+        await _until(lambda: len(merged) == 4)
+        await q.stop()
+
+    asyncio.run(main())
+    assert merged == ["a0", "a1", "a2", "a3"]
+    assert batches[0] == ["a0", "a1", "a2"] # at most fanout batches, the failure released a2
+    assert _pending_on_disk() == []
+
+
+def test_worker_stats_report_throughput_and_utilization():
+    async def main():
+        q = JobQueue(retry_base=60.0)
+
+        async def handler(job: Job)-> None:
+            await asyncio.sleep(0.05)
+            if job.payload.get("fail"):
+                raise RuntimeError("nope")
+
+        q.register("compress", handler, concurrency=2, ordered=True)
+        q.start()
+        for coll in "ab":
+            await q.put_async("compress", coll, {})
+        await q.put_async("compress", "c", {"fail": True})
+        await _until(lambda: q.stats()["delayed"] == 1)
+        stats = q.stats()
+        await q.stop()
+        return stats
+
+    stats = asyncio.run(main())
+    workers = stats["workers"]["compress"]
+    assert workers["concurrency"] == 2
+    assert workers["done"] == 2 and workers["failed"] == 1
+    assert workers["jobs_per_min"] > 0
+    assert 0.0 < workers["utilization"] <= 1.0
+    assert stats["pending_by_coll"] == {"compress": {"c": 1}}
@@ -0,0 +1,64 @@
+from src.vdbs.lexical_index import LexicalIndex, rrf_fuse, tokenize
+
+
+def _index()-> LexicalIndex:
+    index = LexicalIndex()
+    index.add("m1", "Alice adopted a cat named Miso")
+    index.add("m2", "The weather was rainy all week", user="alice")
+    index.add("m3", "Bob likes his cat and his dog. The cat sleeps a lot")
+    index.add("m4", "Nothing in common here")
+    return index
+
+
+def test_tokenize_casefolds():
+    assert tokenize("Hello, WORLD! it's 2024") == ["hello", "world", "it", "s", "2024"]
+
+
+def test_bm25_ranks_matching_documents_only():
+    index = _index()
+    hits = index.search("cat", 10)
+    assert [doc_id for doc_id, _ in hits] == ["m3", "m1"] # two occurrences beat one
+    assert all(score > 0 for _, score in hits)
+    assert index.search("cat", 1) == hits[:1]
+    assert index.search("submarine", 10) == []
+    assert index.search("", 10) == []
+
+
+def test_rare_terms_weigh_more():
+    index = _index()
+    hits = dict(index.search("miso cat", 10))
+    assert hits["m1"] > hits["m3"]
+
+
+def test_user_name_is_indexed():
+    assert {doc_id for doc_id, _ in _index().search("ALICE", 10)} == {"m1", "m2"}
+
+
+def test_phrases_must_appear_verbatim_in_content():
+    index = _index()
+    assert [doc_id for doc_id, _ in index.search('"cat named"', 10)] == ["m1"]
+    assert index.search('"named cat"', 10) == []
+    assert index.search('"alice adopted" weather', 10)[0][0] == "m1"
+
+
+def test_add_replaces_and_remove_forgets():
+    index = _index()
+    index.add("m1", "a fresh start")
+    assert {doc_id for doc_id, _ in index.search("cat", 10)} == {"m3"}
+    index.remove("m3")
+    index.remove("missing")
+    assert index.search("cat", 10) == []
+    assert len(index) == 3
+    stats = index.stats()
+    assert stats["docs"] == 3 and "cat" not in index._postings
+    for doc_id in ("m1", "m2", "m4"):
+        index.remove(doc_id)
+    assert index.stats() == {"docs": 0, "terms": 0, "postings": 0}
+    assert index._total_len == 0
+
+
+def test_rrf_fuse():
+    fused = rrf_fuse([["a", "b", "c"], ["c", "a"]], k=60)
+    assert [doc_id for doc_id, _ in fused] == ["a", "c", "b"]
+    assert fused[0][1] == 1 / 61 + 1 / 62
+    assert rrf_fuse([]) == []
@@ -0,0 +1,110 @@
+import asyncio
+
+from src.llm_governor import LlmGovernor, _TokenBucket
+
+
+def test_concurrency_is_capped():
+    gov = LlmGovernor(max_concurrency=2)
+    peak = 0
+    running = 0
+
+    async def call():
+        nonlocal peak, running
+        async with gov.slot("process"):
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    async def main():
+        await asyncio.gather(*(call() for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak == 2
+    stats = gov.stats()
+    assert stats["in_flight"] == 0 and stats["queue_depth"] == 0
+    assert stats["sites"]["process"]["acquired"] == 6
+
+
+def test_slots_go_by_priority_then_fifo():
+    gov = LlmGovernor(max_concurrency=1)
+    order: list[str] = []
+
+    async def call(name: str, site: str):
+        async with gov.slot(site):
+            order.append(name)
+
+    async def main():
+        await gov.acquire("process") # hold the only slot
+        tasks = [
+            asyncio.create_task(call("c1", "compression")),
+            asyncio.create_task(call("m1", "stm_merge")),
+            asyncio.create_task(call("p1", "process")),
+            asyncio.create_task(call("c2", "compression")),
+            asyncio.create_task(call("p2", "process")),
+        ]
+        await asyncio.sleep(0)
+        assert gov.queue_depth() == 5
+        gov.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == ["p1", "p2", "m1", "c1", "c2"]
+
+
+def test_cancelled_waiter_does_not_keep_the_slot():
+    gov = LlmGovernor(max_concurrency=1)
+
+    async def main():
+        await gov.acquire("process")
+        waiter = asyncio.create_task(gov.acquire("compression"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert gov.queue_depth() == 0
+
+        gov.release()
+        await asyncio.wait_for(gov.acquire("stm_merge"), 1.0)
+        assert gov.stats()["in_flight"] == 1
+
+    asyncio.run(main())
+
+
+def test_slot_handed_over_to_a_cancelled_waiter_is_passed_on():
+    gov = LlmGovernor(max_concurrency=1)
+
+    async def main():
+        await gov.acquire("process")
+        first = asyncio.create_task(gov.acquire("process"))
+        second = asyncio.create_task(gov.acquire("compression"))
+        await asyncio.sleep(0)
+        gov.release() # resolves first's future
+        first.cancel() # before it got to run
+        await asyncio.gather(first, return_exceptions=True)
+        await asyncio.wait_for(second, 1.0)
+        assert gov.stats()["in_flight"] == 1
+
+    asyncio.run(main())
+
+
+def test_token_bucket_goes_into_debt():
+    bucket = _TokenBucket(tokens_per_minute=600, burst=100) # 10 tokens/s
+    assert bucket.reserve(100) == 0.0
+    assert 1.9 < bucket.reserve(20) <= 2.0
+    bucket.refund(20)
+    assert bucket.reserve(500) <= 10.0 # oversized requests take at most the whole bucket
+
+
+def test_rate_limited_acquire_waits_and_settle_refunds():
+    gov = LlmGovernor(max_concurrency=4, tokens_per_minute=6_000, token_burst=100) # 100 tokens/s
+
+    async def main():
+        assert await gov.acquire("process", est_tokens=100) < 0.05
+        gov.release()
+        waited = await gov.acquire("process", est_tokens=5)
+        gov.release()
+        return waited
+
+    assert asyncio.run(main()) >= 0.04
+    gov.settle(est_tokens=100, used_tokens=20)
+    assert gov.stats()["tokens_available"] >= 75
@@ -0,0 +1,53 @@
+import logging
+import queue
+
+from src import metrics
+from src.logging import _DroppingQueueHandler, _SamplingFilter
+
+
+def _record(name: str, level: int = logging.INFO)-> logging.LogRecord:
+    return logging.LogRecord(name, level, __file__, 1, "msg", (), None)
+
+
+def _dropped(reason: str)-> float:
+    return metrics.LOG_RECORDS_DROPPED.snapshot().get(reason, 0.0)
+
+
+def test_rate_limited_records_are_counted_and_reported():
+    filt = _SamplingFilter(sample={}, rate_limit={"Hot": 2.0})
+    before = _dropped("rate_limited")
+
+    passed = [filt.filter(_record("HotPath")) for _ in range(5)]
+    assert passed == [True, True, False, False, False]
+    assert _dropped("rate_limited") - before == 3
+    assert filt.filter(_record("HotPath", logging.WARNING)) # never limited
+    assert filt.filter(_record("Other"))
+
+    filt._tokens["Hot"] = 1.0
+    record = _record("HotPath")
+    assert filt.filter(record)
+    assert record.kv == {"dropped_before": 3}
+
+
+def test_sampled_out_records_are_counted():
+    filt = _SamplingFilter(sample={"Noisy": 0.0}, rate_limit={})
+    before = _dropped("sampled")
+    assert not any(filt.filter(_record("Noisy.sub")) for _ in range(4))
+    assert _dropped("sampled") - before == 4
+
+
+def test_full_queue_drops_are_counted_and_reported():
+    handler = _DroppingQueueHandler(queue.Queue(maxsize=1))
+    before = _dropped("queue_full")
+
+    handler.enqueue(_record("a"))
+    handler.enqueue(_record("a"))
+    handler.enqueue(_record("a"))
+    assert handler.dropped == 2
+    assert _dropped("queue_full") - before == 2
+
+    handler.queue.get_nowait()
+    record = _record("a")
+    handler.enqueue(record)
+    assert record.kv == {"dropped_queue_full": 2}
+    assert handler.dropped == 0
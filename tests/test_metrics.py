@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from src.metrics import Registry, serve_metrics
+
+
+def test_counter_and_gauge_rendering():
+    registry = Registry()
+    calls = registry.counter("t_calls_total", "Calls.", ("site", "outcome"))
+    calls.inc(site="process", outcome="ok")
+    calls.inc(2, site="process", outcome="ok")
+    calls.inc(0.5, site='we"ird\n', outcome="error")
+    depth = registry.gauge("t_depth", "Depth.", ("queue",))
+    depth.set_function(lambda: {("compress",): 3.0})
+    registry.gauge("t_empty", "Never set.")
+
+    assert registry.render().splitlines() == [
+        "# HELP t_calls_total Calls.",
+        "# TYPE t_calls_total counter",
+        't_calls_total{site="process",outcome="ok"} 3',
+        't_calls_total{site="we\\"ird\\n",outcome="error"} 0.5',
+        "# HELP t_depth Depth.",
+        "# TYPE t_depth gauge",
+        't_depth{queue="compress"} 3',
+        "# HELP t_empty Never set.",
+        "# TYPE t_empty gauge",
+    ]
+    assert calls.snapshot() == {"process,ok": 3.0, 'we"ird\n,error': 0.5}
+    with pytest.raises(ValueError):
+        calls.inc(site="process")
+    assert registry.counter("t_calls_total", "Calls.", ("site", "outcome")) is calls
+    with pytest.raises(ValueError):
+        registry.gauge("t_calls_total", "Calls.")
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    hist = registry.histogram("t_seconds", "Durations.", ("op",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        hist.observe(value, op="query")
+
+    assert hist.render()[2:] == [
+        't_seconds_bucket{op="query",le="0.1"} 2',
+        't_seconds_bucket{op="query",le="1"} 3',
+        't_seconds_bucket{op="query",le="+Inf"} 4',
+        't_seconds_sum{op="query"} 3.65',
+        't_seconds_count{op="query"} 4',
+    ]
+    snap = hist.snapshot()["query"]
+    assert snap["count"] == 4 and snap["p50_ms"] == 100.0
+    assert snap["p99_ms"] is None # past the last bucket
+
+
+def test_metrics_endpoint_serves_the_registry():
+    registry = Registry()
+    registry.counter("t_hits_total", "Hits.").inc()
+
+    async def main():
+        server = await serve_metrics("127.0.0.1", 0, registry)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: x\r\n\r\n")
+            response = await reader.read()
+            writer.close()
+        finally:
+            server.close()
+            await server.wait_closed()
+        return response.decode()
+
+    response = asyncio.run(main())
+    assert response.startswith("HTTP/1.1 200 OK\r\n")
+    assert response.endswith("# TYPE t_hits_total counter\nt_hits_total 1\n")
@@ -0,0 +1,33 @@
+import os
+import time
+
+from src.config import ProfilingConfig
+from src.profiling import SamplingProfiler
+
+
+def test_stop_resets_the_profiler(tmp_path):
+    profiler = SamplingProfiler()
+    conf = ProfilingConfig(dir=str(tmp_path), interval_ms=1.0)
+
+    profiler.start(conf)
+    time.sleep(0.05)
+    first = profiler.stop()
+    assert first is not None and all(os.path.exists(f) for f in first["files"])
+
+    status = profiler.status()
+    assert not status["running"] and status["elapsed"] == 0.0
+    assert profiler._thread is None
+
+    profiler.start(conf) # not refused as already running
+    assert profiler.stop() is not first
+
+
+def test_a_timed_profile_stops_by_itself(tmp_path):
+    profiler = SamplingProfiler()
+    profiler.start(ProfilingConfig(dir=str(tmp_path), interval_ms=1.0), duration=0.02)
+    deadline = time.monotonic() + 2.0
+    while profiler.running and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert profiler.status()["elapsed"] == 0.0
+    assert profiler.last_result is not None
+    assert profiler.stop() is profiler.last_result
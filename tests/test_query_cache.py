@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from src.config import QueryCacheConfig
+from src.memory import Memory
+from src.query_cache import QueryCache
+from src.user_database import UserDatabase
+
+
+class _Lookup:
+    """Counts calls, each call returns its number once `gate` is set."""
+
+    def __init__(self)-> None:
+        self.calls = 0
+        self.gate = asyncio.Event()
+        self.gate.set()
+        return
+
+    async def __call__(self)-> int:
+        self.calls += 1
+        n = self.calls
+        await self.gate.wait()
+        return n
+
+
+def test_results_are_cached_per_generation():
+    async def main():
+        cache = QueryCache(QueryCacheConfig())
+        lookup = _Lookup()
+        assert await cache.get("stm", ("a", "q"), 0, lookup) == 1
+        assert await cache.get("stm", ("a", "q"), 0, lookup) == 1
+        assert await cache.get("ltm", ("a", "q"), 0, lookup) == 2 # other tier
+        assert await cache.get("stm", ("a", "q"), 1, lookup) == 3 # written to since
+        assert await cache.get("stm", ("a", "q"), 1, lookup) == 3
+
+    asyncio.run(main())
+
+
+def test_identical_queries_in_flight_share_one_lookup():
+    async def main():
+        cache = QueryCache(QueryCacheConfig(enabled=False))
+        lookup = _Lookup()
+        lookup.gate.clear()
+        callers = [asyncio.create_task(cache.get("stm", ("a", "q"), 0, lookup)) for _ in range(3)]
+        await asyncio.sleep(0)
+        callers[0].cancel() # its connection went away
+        lookup.gate.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert isinstance(results[0], asyncio.CancelledError)
+        assert results[1:] == [1, 1]
+        assert lookup.calls == 1
+        assert await cache.get("stm", ("a", "q"), 0, lookup) == 2 # disabled, nothing kept
+
+    asyncio.run(main())
+
+
+def test_a_lookup_older_than_the_cached_result_is_not_stored():
+    async def main():
+        cache = QueryCache(QueryCacheConfig())
+        slow = _Lookup()
+        slow.gate.clear()
+        old = asyncio.create_task(cache.get("stm", ("a", "q"), 0, slow))
+        await asyncio.sleep(0)
+        assert await cache.get("stm", ("a", "q"), 1, lambda: asyncio.sleep(0, "new")) == "new"
+        slow.gate.set()
+        assert await old == 1
+        assert await cache.get("stm", ("a", "q"), 1, _Lookup()) == "new"
+
+    asyncio.run(main())
+
+
+def test_failures_are_not_cached():
+    async def main():
+        cache = QueryCache(QueryCacheConfig())
+
+        async def fails():
+            raise RuntimeError("vdb down")
+
+        with pytest.raises(RuntimeError):
+            await cache.get("stm", ("a", "q"), 0, fails)
+        assert await cache.get("stm", ("a", "q"), 0, _Lookup()) == 1
+
+    asyncio.run(main())
+
+
+def test_ttl_and_lru_bound():
+    async def main():
+        cache = QueryCache(QueryCacheConfig(max_entries=2))
+        lookup = _Lookup()
+        for q in ("q1", "q2"):
+            await cache.get("stm", ("a", q), 0, lookup)
+        await cache.get("stm", ("a", "q1"), 0, lookup) # q2 is now least recently used
+        await cache.get("stm", ("a", "q3"), 0, lookup)
+        assert lookup.calls == 3
+        assert await cache.get("stm", ("a", "q1"), 0, lookup) == 1
+        assert await cache.get("stm", ("a", "q2"), 0, lookup) == 4
+
+        expiring = QueryCache(QueryCacheConfig(ttl=0.01))
+        assert await expiring.get("stm", ("a", "q"), 0, lookup) == 5
+        await asyncio.sleep(0.02)
+        assert await expiring.get("stm", ("a", "q"), 0, lookup) == 6
+
+    asyncio.run(main())
+
+
+def test_user_writes_change_the_generation(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    users = UserDatabase()
+    assert users.generation("a") == 0
+    users.store("a", "bob", Memory(id="m1", content="hi", time=1, user="bob"))
+    after_store = users.generation("a")
+    assert after_store != 0 and users.generation("b") == 0
+    users.clear_user("a", "bob")
+    assert users.generation("a") not in (0, after_store)
@@ -0,0 +1,56 @@
+import numpy as np
+
+from src.memory import Memory, QueriedMemory
+from src.messages import RankSpec
+from src.ranking import dedup_across, mmr, relevance, rerank
+
+NOW = 1_000_000_000
+
+
+def _c(id: str, distance: float, age_s: float = 0.0, score: float | None = None, embedding: list[float] | None = None)-> QueriedMemory:
+    mem = Memory(id=id, content=id, time=NOW - int(age_s * 1_000), score=score)
+    return QueriedMemory(memory=mem, distance=distance, embedding=embedding)
+
+
+def _ids(found: list[QueriedMemory])-> list[str]:
+    return [c.memory.id for c in found]
+
+
+def test_default_spec_orders_by_distance():
+    found = [_c("far", 0.9), _c("near", 0.1), _c("mid", 0.5)]
+    assert _ids(rerank(found, RankSpec(), 2, NOW)) == ["near", "mid"]
+    assert rerank([], RankSpec(), 2, NOW) == []
+
+
+def test_signals_are_normalized_and_weighted():
+    found = [_c("old", 0.1, age_s=86_400 * 10), _c("new", 0.2, age_s=0.0)]
+    rel = relevance(found, RankSpec(distance=1.0, recency=2.0, half_life=86_400), NOW)
+    np.testing.assert_allclose(rel, [1.0 + 2.0 * 0.5 ** 10, 0.0 + 2.0])
+    assert _ids(rerank(found, RankSpec(distance=1.0, recency=2.0, half_life=86_400), 2, NOW)) == ["new", "old"]
+
+    # equal distances count fully for everyone, scores are clipped to [0, 1]
+    found = [_c("a", 0.3, score=5.0), _c("b", 0.3, score=0.5)]
+    np.testing.assert_allclose(relevance(found, RankSpec(score=1.0), NOW), [2.0, 1.5])
+
+
+def test_mmr_prefers_diverse_picks():
+    rel = np.array([1.0, 0.95, 0.5])
+    emb = np.array([[1.0, 0.0], [1.0, 0.01], [0.0, 1.0]], dtype=np.float32)
+    assert mmr(rel, emb, 1.0, 3) == [0, 1, 2]
+    assert mmr(rel, emb, 0.5, 2) == [0, 2] # the near duplicate of the best pick goes last
+    assert mmr(rel, np.zeros((3, 2), dtype=np.float32), 0.5, 5) == [0, 1, 2] # zero vectors, n past the end
+
+
+def test_rerank_uses_mmr_only_with_every_embedding():
+    found = [_c("a", 0.1, embedding=[1.0, 0.0]), _c("a2", 0.11, embedding=[1.0, 0.0]), _c("b", 0.5, embedding=[0.0, 1.0])]
+    assert _ids(rerank(found, RankSpec(mmr=0.5), 2, NOW)) == ["a", "b"]
+    found[2].embedding = None
+    assert _ids(rerank(found, RankSpec(mmr=0.5), 2, NOW)) == ["a", "a2"]
+
+
+def test_dedup_across_keeps_the_highest_position():
+    q1 = [_c("x", 0.1), _c("y", 0.2), _c("z", 0.3)]
+    q2 = [_c("y", 0.1), _c("x", 0.2)]
+    q3 = [_c("z", 0.1)]
+    assert [_ids(found) for found in dedup_across([q1, q2, q3])] == [["x"], ["y"], ["z"]]
+    assert [_ids(found) for found in dedup_across([[_c("x", 0.1)], [_c("x", 0.1)]])] == [["x"], []] # ties go to the earlier query
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+from src.retry_and_timeout import CircuitBreaker, CircuitOpenError, RetryPolicy, get_retry_after, with_retry_and_timeout_async
+
+
+def _status_error(status: int, headers: dict | None = None)-> openai.APIStatusError:
+    response = SimpleNamespace(status_code=status, headers=headers or {}, request=None)
+    return openai.APIStatusError(f"status {status}", response=response, body=None)
+
+
+def test_retryable_errors():
+    policy = RetryPolicy()
+    assert policy.is_retryable(TimeoutError())
+    assert policy.is_retryable(openai.APIConnectionError(request=None))
+    assert policy.is_retryable(_status_error(429))
+    assert policy.is_retryable(_status_error(503))
+    assert not policy.is_retryable(_status_error(400))
+    assert not policy.is_retryable(_status_error(401))
+    assert not policy.is_retryable(ValueError("bad json"))
+
+
+def test_retry_after_headers():
+    assert get_retry_after(_status_error(429, {"retry-after-ms": "1500"})) == 1.5
+    assert get_retry_after(_status_error(429, {"retry-after": "7"})) == 7.0
+    assert get_retry_after(_status_error(429, {"retry-after": "soon"})) is None
+    assert get_retry_after(_status_error(429)) is None
+    assert get_retry_after(TimeoutError()) is None
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy(backoff_base=1.0, backoff_max=4.0)
+    for attempt in range(1, 8):
+        assert 0.0 <= policy.backoff(attempt) <= min(4.0, 2 ** (attempt - 1))
+
+
+def test_backoff_follows_retry_after_up_to_backoff_max():
+    policy = RetryPolicy(backoff_base=0.0, backoff_max=30.0)
+    assert policy.backoff(1, retry_after=12.0) == 12.0
+    assert policy.backoff(1, retry_after=30.0) == 30.0
+    assert policy.backoff(1, retry_after=3600.0) is None
+
+
+def test_long_retry_after_is_not_waited_for():
+    calls: list[int] = []
+
+    async def cr():
+        calls.append(1)
+        raise _status_error(429, {"retry-after": "3600"})
+
+    async def main():
+        start = time.monotonic()
+        result = await with_retry_and_timeout_async(cr, policy=RetryPolicy(max_retries=3, backoff_max=5.0))
+        return result, time.monotonic() - start
+
+    result, took = asyncio.run(main())
+    assert result is None and calls == [1]
+    assert took < 1.0
+
+
+def test_retries_until_success_and_stops_on_fatal_errors():
+    errors = [TimeoutError(), _status_error(500)]
+
+    async def flaky():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    async def fatal():
+        errors.append(1)
+        raise _status_error(400)
+
+    policy = RetryPolicy(max_retries=3, backoff_base=0.0)
+    assert asyncio.run(with_retry_and_timeout_async(flaky, policy=policy)) == "ok"
+    errors.clear()
+    assert asyncio.run(with_retry_and_timeout_async(fatal, policy=policy)) is None
+    assert errors == [1]
+
+
+def test_attempt_timeout_is_retried():
+    attempts: list[int] = []
+
+    async def slow():
+        attempts.append(1)
+        if len(attempts) == 1:
+            await asyncio.sleep(1.0)
+        return "ok"
+
+    policy = RetryPolicy(max_retries=2, timeout_each=0.05, backoff_base=0.0)
+    assert asyncio.run(with_retry_and_timeout_async(slow, policy=policy)) == "ok"
+    assert len(attempts) == 2
+
+
+def test_breaker_opens_fails_fast_and_probes():
+    breaker = CircuitBreaker(failure_threshold=2, reset_after=0.05)
+    breaker.before_call()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    breaker.before_call() # the probe
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call() # only one probe at a time
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+
+def test_open_breaker_skips_the_call():
+    breaker = CircuitBreaker(failure_threshold=1, reset_after=60.0)
+    breaker.record_failure()
+    calls: list[int] = []
+
+    async def cr():
+        calls.append(1)
+        return "ok"
+
+    assert asyncio.run(with_retry_and_timeout_async(cr, policy=RetryPolicy(), breaker=breaker)) is None
+    assert calls == []
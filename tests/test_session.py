@@ -0,0 +1,124 @@
+import asyncio
+import inspect
+
+from src.session import Session
+
+
+def test_close_cancels_only_the_sessions_own_requests():
+    async def main():
+        a, b = Session(conn=None), Session(conn=None)
+        done: list[str] = []
+
+        async def work(name: str)-> None:
+            await asyncio.sleep(0.05)
+            done.append(name)
+
+        cr = work("a")
+        await a.spawn(cr, uid="u1")
+        other = await b.spawn(work("b"), uid="u1") # uids are per session
+        assert a.in_flight.keys() == {"u1"} and a.running == 1
+
+        await a.close()
+        assert a.closed and a.running == 0 and a.in_flight == {}
+        assert inspect.getcoroutinestate(cr) == inspect.CORO_CLOSED # cancelled before it first ran
+        await other
+        assert done == ["b"]
+        assert b.in_flight == {}
+        await a.close() # closing twice is fine
+
+    asyncio.run(main())
+
+
+def test_request_cancelled_before_it_started_is_closed():
+    async def main():
+        session = Session(conn=None, max_in_flight=1)
+        blocker = asyncio.Event()
+        started: list[str] = []
+
+        async def work(name: str)-> None:
+            started.append(name)
+            await blocker.wait()
+
+        await session.spawn(work("first"), colls=("a",), write=True)
+        waiting = asyncio.create_task(session.spawn(work("queued")))
+        await asyncio.sleep(0.01)
+        assert not waiting.done() # over max_in_flight
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        await session.close()
+        assert started == ["first"]
+
+    asyncio.run(main())
+
+
+def test_lanes_order_writes_after_everything_and_reads_after_writes():
+    log: list[str] = []
+
+    async def main():
+        session = Session(conn=None)
+
+        async def op(name: str, delay: float)-> None:
+            log.append(f"+{name}")
+            await asyncio.sleep(delay)
+            log.append(f"-{name}")
+
+        await session.spawn(op("r1", 0.03), colls=("a",))
+        await session.spawn(op("r2", 0.01), colls=("a",))
+        await session.spawn(op("w1", 0.02), colls=("a",), write=True)
+        await session.spawn(op("r3", 0.0), colls=("a",))
+        await session.spawn(op("other", 0.0), colls=("b",))
+        await session.spawn(op("free", 0.0))
+        while session.running:
+            await asyncio.sleep(0.01)
+        await session.close()
+
+    asyncio.run(main())
+    assert log.index("+r2") < log.index("-r1") # reads run together
+    assert log.index("+w1") > max(log.index("-r1"), log.index("-r2"))
+    assert log.index("+r3") > log.index("-w1")
+    assert log.index("-other") < log.index("+w1") and log.index("-free") < log.index("+w1")
+
+
+def test_a_failed_write_does_not_block_its_lane():
+    seen: list[str] = []
+
+    async def main():
+        session = Session(conn=None)
+
+        async def fails()-> None:
+            raise RuntimeError("store failed")
+
+        async def read()-> None:
+            seen.append("read")
+
+        failed = await session.spawn(fails(), colls=("a",), write=True)
+        after = await session.spawn(read(), colls=("a",))
+        await asyncio.wait_for(after, 1.0)
+        assert isinstance(failed.exception(), RuntimeError)
+        assert session._lanes == {}
+
+    asyncio.run(main())
+    assert seen == ["read"]
+
+
+def test_in_flight_requests_are_capped():
+    peak = 0
+    running = 0
+
+    async def main():
+        nonlocal peak, running
+        session = Session(conn=None, max_in_flight=3)
+
+        async def op()-> None:
+            nonlocal peak, running
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        tasks = [await session.spawn(op()) for _ in range(10)]
+        await asyncio.gather(*tasks)
+        await session.close()
+
+    asyncio.run(main())
+    assert peak == 3
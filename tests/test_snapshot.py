@@ -0,0 +1,90 @@
+import asyncio
+import gzip
+import os
+import socket
+
+from websockets.asyncio.server import serve
+
+from src.config import SnapshotConfig
+from src.snapshot import Snapshotter, WriteGate, snapshot_from_cli
+
+
+def _write(rel: str, data: bytes)-> None:
+    os.makedirs(os.path.dirname(rel), exist_ok=True)
+    with open(rel, "wb") as f:
+        f.write(data)
+
+
+def _read(snap_dir: str, rel: str)-> bytes:
+    with gzip.open(os.path.join(snap_dir, "files", rel + ".gz"), "rb") as f:
+        return f.read()
+
+
+def _free_port()-> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_incremental_snapshots_link_unchanged_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write(os.path.join("users", "a.json"), b"one")
+    _write(os.path.join("decay_meta", "b.json"), b"two")
+    snapper = Snapshotter(SnapshotConfig(dir="snaps"))
+
+    first = asyncio.run(snapper.take(WriteGate()))
+    assert first["files"] == 2 and first["changed"] == 2
+
+    _write(os.path.join("users", "a.json"), b"one, edited")
+    second = asyncio.run(snapper.take(WriteGate()))
+    assert second["changed"] == 1
+
+    rel = os.path.join("decay_meta", "b.json")
+    assert _read(os.path.join("snaps", second["id"]), os.path.join("users", "a.json")) == b"one, edited"
+    assert os.path.samefile(os.path.join("snaps", first["id"], "files", rel + ".gz"), os.path.join("snaps", second["id"], "files", rel + ".gz"))
+
+
+def test_writes_between_the_copy_passes_are_captured(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rel = os.path.join("users", "a.json")
+    _write(rel, b"before")
+    snapper = Snapshotter(SnapshotConfig(dir="snaps"))
+    gate = WriteGate()
+    capture = snapper._capture
+    passes: list[int] = []
+
+    def _capture(staging: str, prev: dict):
+        passes.append(len(passes))
+        out = capture(staging, prev)
+        if len(passes) == 1:
+            _write(rel, b"after") # landed after the unfrozen pass copied the file
+        return out
+
+    snapper._capture = _capture
+    snap = asyncio.run(snapper.take(gate))
+    assert passes == [0, 1]
+    assert _read(os.path.join("snaps", snap["id"]), rel) == b"after"
+
+
+def test_cli_snapshot_without_a_server_is_taken_locally(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write(os.path.join("users", "a.json"), b"one")
+    snap = asyncio.run(snapshot_from_cli(SnapshotConfig(dir="snaps"), "127.0.0.1", _free_port()))
+    assert snap is not None and snap["files"] == 1
+
+
+def test_cli_snapshot_reports_a_failing_server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write(os.path.join("users", "a.json"), b"one")
+
+    async def handler(ws)-> None:
+        await ws.recv()
+        await ws.close(code=1011) # gone in the middle of the snapshot
+
+    async def main():
+        port = _free_port()
+        async with serve(handler, "127.0.0.1", port):
+            return await snapshot_from_cli(SnapshotConfig(dir="snaps"), "127.0.0.1", port)
+
+    assert asyncio.run(main()) is None
+    assert not os.path.exists("snaps") # nothing copied from under the server
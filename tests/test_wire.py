@@ -0,0 +1,44 @@
+import pytest
+
+from src import wire
+from src.wire import WireSession
+
+
+def test_negotiation_picks_the_first_supported_encoding():
+    session = WireSession()
+    assert session.encoding == "json"
+    assert session.negotiate(["cbor", "msgpack", "json"], None) == "msgpack"
+    assert session.negotiate(["cbor"], None) == "json"
+
+
+def test_frames_round_trip():
+    obj = {"type": "query", "text": "héllo", "n": [1, 2.5, None]}
+    session = WireSession()
+    frame, is_text = session.encode(obj)
+    assert is_text
+    # orjson hands over utf-8 bytes, websockets delivers text frames as str
+    assert wire.decode(frame.decode() if isinstance(frame, bytes) else frame) == obj
+
+    session.negotiate(["msgpack"], None)
+    frame, is_text = session.encode(obj)
+    assert not is_text and isinstance(frame, bytes)
+    assert wire.decode(frame) == obj
+    assert wire.decode('{"a":1}') == {"a": 1} # text frames stay json after negotiation
+
+
+def test_without_optional_packages_json_is_used(monkeypatch):
+    monkeypatch.setattr(wire, "orjson", None)
+    monkeypatch.setattr(wire, "msgpack", None)
+    assert wire.available_encodings() == ["json"]
+    assert WireSession().negotiate(["msgpack", "json"], None) == "json"
+    assert wire.dumps_json({"a": [1, 2]}) == '{"a":[1,2]}'
+    assert wire.decode('{"a":1}') == {"a": 1}
+    with pytest.raises(ValueError):
+        wire.decode(b"\x81\xa1a\x01")
+
+
+def test_memory_projection():
+    mem = {"id": "m1", "content": "text", "time": 1.0, "user": None, "lifetime": 3}
+    assert wire.project_memory(mem, None) is mem
+    assert wire.project_memory(mem, ["id", "content"]) == {"id": "m1", "content": "text"}
+    assert wire.project_memory(mem, []) == {}